@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grouping benchmark and accuracy harness.
+
+Builds synthetic shoots as exiftool -j -n records with known ground truth
+and runs them through both groupers:
+- hdr     hdr-worker/group_raw_brackets_exiftool.py (read_rows + group_rows)
+- root    ./group_raw_brackets_exiftool.py (group_catalog, the core of main)
+
+Scenarios: 3/5/7-shot brackets, single frames, two bodies interleaved,
+brackets without ExposureBiasValue, long exposures that stretch the
+dynamic gap, and brackets tagged with maker-note sequence fields
+(SequenceNumber / BracketShotNumber counters or a shared BurstUUID). Accuracy is pairwise precision/recall ("are these two frames in
+the same group?") plus the share of true groups reproduced exactly.
+Throughput is frames/s from records to groups at 1k, 10k and 100k frames.
+
+    python3 hdr-worker/bench_grouping.py                # compare with baseline
+    python3 hdr-worker/bench_grouping.py --record       # overwrite baseline
+    python3 hdr-worker/bench_grouping.py --sizes 1000 --no-throughput
+
+Exits 1 when accuracy drops or throughput falls by more than --slowdown
+against the recorded baseline. Throughput baselines are machine specific;
+re-record them on the box that runs the comparison.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+    sys.path.insert(0, HERE)
+
+import group_raw_brackets_exiftool as hdr_grouper  # noqa: E402
+
+BASELINE_PATH = os.path.join(HERE, "bench_grouping_baseline.json")
+DEFAULT_SIZES = [1000, 10000, 100000]
+ACCURACY_FRAMES = 3000
+SCENARIOS = ("brackets", "singles", "multibody", "missing_ev", "long_exposure", "sequence", "mixed")
+SEQUENCE_TAGS = ("SequenceNumber", "BracketShotNumber", "BurstUUID")
+BODIES = (("ILCE-7RM4", "4012345"), ("ILCE-7M3", "3098765"))
+
+
+def _load_root_grouper():
+    path = os.path.join(os.path.dirname(HERE), "group_raw_brackets_exiftool.py")
+    spec = importlib.util.spec_from_file_location("root_group_raw_brackets_exiftool", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+# === Synthetic shoots ===
+def _shoot(rnd, n, body, start, scenario):
+    """Frames of one body: list of (record, true_group) with capture times from `start`."""
+    model, serial = body
+    t = start
+    out = []
+    g = 0
+    fnum, focal = 8.0, 16.0
+    while len(out) < n:
+        kind = scenario if scenario != "mixed" else rnd.choice(
+            ("brackets", "brackets", "singles", "missing_ev", "long_exposure"))
+        if kind == "singles" and rnd.random() < 0.7:
+            size = 1
+        else:
+            size = rnd.choice((3, 5, 7))
+        step = rnd.choice((0.7, 1.0, 1.3))
+        if kind == "long_exposure":
+            base = rnd.choice((1.0, 2.0, 4.0))
+        else:
+            base = rnd.choice((1 / 250, 1 / 60, 1 / 15))
+        if rnd.random() < 0.3:
+            fnum = rnd.choice((5.6, 8.0, 11.0))
+            focal = rnd.choice((16.0, 24.0, 35.0))
+        evs = [step * (k - (size - 1) / 2) for k in range(size)]
+        if size > 1 and rnd.random() < 0.5:
+            evs = [evs[size // 2]] + [e for k, e in enumerate(evs) if k != size // 2]
+        seq_tag = rnd.choice(SEQUENCE_TAGS) if kind == "sequence" else None
+        burst = "%032X" % rnd.getrandbits(128) if seq_tag == "BurstUUID" else None
+
+        longest = 0.0
+        for k, ev in enumerate(evs):
+            shutter = base * 2 ** ev
+            longest = max(longest, shutter)
+            # round to centiseconds first so x.996 s becomes (x + 1).00, not x.00
+            secs, sub = divmod(int(round(t * 100)), 100)
+            stamp = datetime(2025, 12, 17) + timedelta(seconds=secs)
+            rec = {
+                "SourceFile": f"/shoot/{model}/DSC{len(out):06d}.ARW",
+                "Directory": f"/shoot/{model}",
+                "FileName": f"DSC{len(out):06d}.ARW",
+                "DateTimeOriginal": stamp.strftime("%Y:%m:%d %H:%M:%S"),
+                "SubSecDateTimeOriginal": stamp.strftime("%Y:%m:%d %H:%M:%S") + f".{sub:02d}",
+                "ExposureTime": shutter,
+                "FNumber": fnum,
+                "FocalLength": focal,
+                "ISO": 100,
+                "Model": model,
+                "SerialNumber": serial,
+            }
+            if kind != "missing_ev":
+                rec["ExposureBiasValue"] = round(ev, 2)
+            if seq_tag == "BurstUUID":
+                rec["BurstUUID"] = f"{burst[:8]}-{burst[8:12]}-{burst[12:16]}-{burst[16:20]}-{burst[20:]}"
+            elif seq_tag:
+                rec[seq_tag] = k + 1
+            out.append((rec, (serial, g)))
+            # next frame: this exposure plus the camera's write/AEB interval
+            t += shutter + rnd.uniform(0.25, 0.6)
+        g += 1
+        if rnd.random() < 0.1:
+            # next bracket fired straight away (tripod not moved): only the
+            # exposure pattern can separate the two
+            continue
+        # walk to the next composition: clear of the dynamic gap
+        gap = max(3.0, 1.2 + 2.5 * longest)
+        t += gap + rnd.uniform(0.5, 25.0)
+    return out[:n]
+
+
+def synthetic_catalog(n, scenario="mixed", seed=0):
+    """(records, truth): exiftool-style records and {SourceFile: true group key}."""
+    rnd = random.Random(seed)
+    if scenario in ("multibody", "mixed"):
+        half = n // 2
+        frames = _shoot(rnd, half, BODIES[0], 0.0, scenario) + _shoot(rnd, n - half, BODIES[1], 1.0, scenario)
+    else:
+        frames = _shoot(rnd, n, BODIES[0], 0.0, scenario)
+    frames.sort(key=lambda x: x[0]["SubSecDateTimeOriginal"])
+    return [r for r, _ in frames], {r["SourceFile"]: g for r, g in frames}
+
+
+# === Runners ===
+def run_hdr(records):
+    rows, cols = hdr_grouper.read_rows(records)
+    groups, _ = hdr_grouper.group_rows(rows, None, cols)
+    return [[r["path"] for r in g] for g in groups]
+
+
+def make_run_root():
+    root = _load_root_grouper()
+
+    def run_root(records):
+        _, groups, _, _ = root.group_catalog(records)
+        return [[r["path"] for r in g] for g in groups]
+
+    return run_root
+
+
+# === Metrics ===
+def _pairs(counts):
+    return sum(c * (c - 1) // 2 for c in counts)
+
+
+def accuracy(pred_groups, truth):
+    """Pairwise precision / recall and exact-group rate of `pred_groups` against `truth`."""
+    cells = Counter()
+    pred_sizes = []
+    for i, g in enumerate(pred_groups):
+        pred_sizes.append(len(g))
+        for p in g:
+            cells[(i, truth[p])] += 1
+    true_sizes = Counter(truth.values())
+    tp = _pairs(cells.values())
+    pred_pairs = _pairs(pred_sizes)
+    true_pairs = _pairs(true_sizes.values())
+
+    exact = 0
+    for i, g in enumerate(pred_groups):
+        key = truth[g[0]]
+        if cells[(i, key)] == len(g) == true_sizes[key]:
+            exact += 1
+    return {
+        "precision": round(tp / pred_pairs, 4) if pred_pairs else 1.0,
+        "recall": round(tp / true_pairs, 4) if true_pairs else 1.0,
+        "exact_groups": round(exact / len(true_sizes), 4) if true_sizes else 1.0,
+    }
+
+
+def throughput(run, n, repeat):
+    records, _ = synthetic_catalog(n, "mixed", seed=n)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(records)
+        best = min(best, time.perf_counter() - start)
+    return round(n / best, 1)
+
+
+# === Baselines ===
+def compare(current, baseline, slowdown, accuracy_tol):
+    """Regression messages for `current` against `baseline`."""
+    problems = []
+    for runner, cur in current.items():
+        base = baseline.get(runner, {})
+        for scenario, m in cur.get("accuracy", {}).items():
+            b = base.get("accuracy", {}).get(scenario)
+            if not b:
+                continue
+            for k, v in m.items():
+                if v < b[k] - accuracy_tol:
+                    problems.append(f"{runner}/{scenario}: {k} {b[k]:.4f} -> {v:.4f}")
+        for size, fps in cur.get("throughput", {}).items():
+            b = base.get("throughput", {}).get(size)
+            if b and fps < b * (1 - slowdown):
+                problems.append(f"{runner}: {size} frames {b:.0f} -> {fps:.0f} frames/s")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--runners", nargs="+", choices=["hdr", "root"], default=["hdr", "root"])
+    ap.add_argument("--no-throughput", action="store_true")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--record", action="store_true", help="write results as the new baseline")
+    ap.add_argument("--slowdown", type=float, default=0.3, help="allowed throughput drop (fraction)")
+    ap.add_argument("--accuracy-tol", type=float, default=0.002)
+    args = ap.parse_args()
+
+    runners = {"hdr": run_hdr}
+    if "root" in args.runners:
+        runners["root"] = make_run_root()
+
+    results = {}
+    print(f"{'runner':<6} {'scenario':<14} {'precision':>9} {'recall':>7} {'exact':>7}")
+    for name in args.runners:
+        run = runners[name]
+        res = results[name] = {"accuracy": {}, "throughput": {}}
+        for scenario in SCENARIOS:
+            records, truth = synthetic_catalog(ACCURACY_FRAMES, scenario, seed=1)
+            m = res["accuracy"][scenario] = accuracy(run(records), truth)
+            print(f"{name:<6} {scenario:<14} {m['precision']:9.4f} {m['recall']:7.4f} {m['exact_groups']:7.4f}")
+
+    if not args.no_throughput:
+        print(f"\n{'runner':<6} {'frames':>7} {'frames/s':>10}")
+        for name in args.runners:
+            for n in args.sizes:
+                fps = results[name]["throughput"][str(n)] = throughput(runners[name], n, args.repeat)
+                print(f"{name:<6} {n:>7} {fps:10.0f}")
+
+    if args.record:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline written: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline yet; run with --record to create one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    problems = compare(results, baseline, args.slowdown, args.accuracy_tol)
+    if problems:
+        print("\n⚠️ Regressions against baseline:")
+        for p in problems:
+            print("   " + p)
+        return 1
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Typed columns from `exiftool -j -n` records in one pass.
+
+With -n exiftool already returns numbers (0.008 instead of "1/125", 24
+instead of "24.0 mm"), so values go straight into float columns; strings
+(older cached records, odd maker notes) take the slow path. Dates use a
+fixed-layout parser: "YYYY:MM:DD HH:MM:SS[.fff][+hh:mm]" is sliced, not
+matched against strptime formats.
+
+    rows, cols = read_columns(records)
+    cols["time"]    float64 epoch seconds incl. subseconds (naive camera time)
+    cols["ev"], cols["shutter"], cols["iso"], cols["fnum"], cols["focal"]   float64
+
+rows are the make_row() dicts the rest of the grouper works with, aligned
+with the columns; records without a capture time are dropped from both.
+With by_time=True both come back in capture order (stable), ready for
+group_engine.camera_index_groups(rows, cols).
+"""
+
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+
+# 放在字段列表最前面：让 exiftool 输出数值而不是带单位的显示文本
+NUMERIC_ARG = "-n"
+TIME_TAGS = ("SubSecDateTimeOriginal", "DateTimeOriginal", "CreateDate")
+FLOAT_COLUMNS = ("ev", "shutter", "iso", "fnum", "focal")
+
+_num_re = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+def _days_from_civil(y, m, d):
+    """Days since 1970-01-01 for a proleptic Gregorian date (Hinnant's algorithm)."""
+    y -= m <= 2
+    era = (y if y >= 0 else y - 399) // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def split_exif_time(s):
+    """(y, mo, d, h, mi, s, us) from an EXIF date string, None if it is not one."""
+    if not isinstance(s, str) or len(s) < 19 or s[4] != ":" or s[7] != ":" or s[13] != ":":
+        return None
+    try:
+        parts = (int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]))
+    except ValueError:
+        return None
+    if parts[0] == 0 or not 1 <= parts[1] <= 12 or not 1 <= parts[2] <= 31:
+        return None
+    us = 0
+    if len(s) > 20 and s[19] == ".":
+        end = 20
+        while end < len(s) and s[end].isdigit():
+            end += 1
+        frac = s[20:end]
+        if frac:
+            us = int((frac + "000000")[:6])
+    return parts + (us,)
+
+
+def record_time(rec):
+    """First usable capture time of a record as split_exif_time parts."""
+    for k in TIME_TAGS:
+        parts = split_exif_time(rec.get(k))
+        if parts:
+            return parts
+    return None
+
+
+def epoch_seconds(parts):
+    y, mo, d, h, mi, s, us = parts
+    return _days_from_civil(y, mo, d) * 86400.0 + h * 3600 + mi * 60 + s + us / 1e6
+
+
+def to_float(v):
+    """Number from a -n value; strings like "1/125" or "+0.7" still work."""
+    if v is None or v == "":
+        return None
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return float(v)
+    s = str(v).strip()
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    if "/" in s:
+        try:
+            a, b = s.split("/", 1)
+            return float(a) / float(b)
+        except (ValueError, ZeroDivisionError):
+            return None
+    m = _num_re.search(s.replace("+", ""))
+    return float(m.group(0)) if m else None
+
+
+def _first(rec, a, b):
+    v = rec.get(a)
+    return rec.get(b) if v is None or v == "" else v
+
+
+def parse_record(rec):
+    """(row, epoch) for one exiftool record, (None, None) without a capture time."""
+    parts = record_time(rec)
+    if parts is None:
+        return None, None
+    try:
+        dt = datetime(*parts)
+    except ValueError:
+        return None, None
+    row = {
+        "path": os.path.join(rec.get("Directory", ""), rec.get("FileName", "")),
+        "time": dt,
+        "ev": to_float(_first(rec, "ExposureBiasValue", "ExposureCompensation")),
+        "shutter": to_float(_first(rec, "ExposureTime", "ShutterSpeed")),
+        "iso": to_float(rec.get("ISO")),
+        "fnum": to_float(_first(rec, "FNumber", "Aperture")),
+        "focal": to_float(rec.get("FocalLength")),
+        "width": to_float(rec.get("ImageWidth")),
+        "height": to_float(rec.get("ImageHeight")),
+        "orientation": str(rec.get("Orientation")),
+        "model": str(rec.get("Model")),
+        "serial": str(rec.get("SerialNumber")),
+        "seq": to_float(rec.get("SequenceNumber")),
+        "burst": str(rec.get("BurstUUID")),
+        "bracket_seq": str(rec.get("BracketSequence")),
+        "bracket_shot": str(rec.get("BracketShotNumber")),
+    }
+    return row, epoch_seconds(parts)
+
+
+def read_columns(records, by_time=False):
+    """Single pass over `records` -> (rows, cols); see module docstring."""
+    rows = []
+    times = []
+    values = {k: [] for k in FLOAT_COLUMNS}
+    for rec in records:
+        row, epoch = parse_record(rec)
+        if row is None:
+            continue
+        rows.append(row)
+        times.append(epoch)
+        for k in FLOAT_COLUMNS:
+            v = row[k]
+            values[k].append(np.nan if v is None else v)
+    cols = {"time": np.array(times, dtype=np.float64)}
+    for k in FLOAT_COLUMNS:
+        # float64 like columns_from_rows: a float32 -0.3 EV (-0.30000001) would
+        # land on the other side of group_engine's 0.6 EV thresholds
+        cols[k] = np.array(values[k], dtype=np.float64)
+    if by_time:
+        order = np.argsort(cols["time"], kind="stable")
+        rows = [rows[i] for i in order.tolist()]
+        cols = {k: v[order] for k, v in cols.items()}
+    return rows, cols
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Header-only EXIF reader for grouping.
+
+Grouping needs a dozen tags (capture time, exposure, aperture, focal length,
+dimensions, body). For TIFF-based RAWs (ARW, CR2, NEF, NRW, DNG, PEF, SRW,
+ORF) and JPEG they sit in the first few KB, so we read a small head of the
+file, walk IFD0 and the EXIF sub-IFD and stop. RAF keeps its EXIF in the
+embedded JPEG, whose offset is in the fixed RAF header.
+
+Records use exiftool's tag names and -n (numeric) values, so make_row()
+works unchanged. Files that cannot be parsed here (CR3/ISOBMFF, RW2,
+anything malformed) are sent to exiftool in one batch.
+
+The bracket sequence tags live in maker notes. The plain (unenciphered)
+ones are decoded here, so exact sequence grouping needs no subprocess:
+- Canon: SequenceNumber (ShotInfo[9]), BracketShotNumber (FileInfo[5])
+- Fujifilm: SequenceNumber (0x1101)
+- Sony: SequenceNumber (0xB04A; newer bodies encipher it, see below)
+- Apple: BurstUUID (0x000B)
+EXIF_SEQUENCE_TAGS=1 additionally asks exiftool (one batched call, only
+those tags) for natively read files of SEQUENCE_MAKES that came back
+without any of them, e.g. Sony bodies that only store the enciphered copy.
+
+    python3 exif_header.py <files...>      # dump records as JSON
+"""
+
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from exiftool_session import ExifToolError, exiftool_json
+
+HEADER_BYTES = int(os.getenv("EXIF_HEADER_BYTES", str(256 * 1024)))
+READ_WORKERS = int(os.getenv("EXIF_READ_WORKERS", "0")) or min(16, (os.cpu_count() or 2) * 4)
+READERS = ("native", "exiftool")
+THUMB_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_READER = os.getenv("EXIF_READER", "native")
+SEQUENCE_TAGS = ("SequenceNumber", "BurstUUID", "BracketSequence", "BracketShotNumber")
+# makes whose maker notes can carry SEQUENCE_TAGS; only these go to the optional exiftool pass
+SEQUENCE_MAKES = ("CANON", "FUJIFILM", "SONY", "APPLE", "PANASONIC")
+READ_SEQUENCE_TAGS = os.getenv("EXIF_SEQUENCE_TAGS", "0") == "1"
+
+NATIVE_EXTS = {".arw", ".cr2", ".nef", ".nrw", ".dng", ".pef", ".srw", ".orf", ".raf", ".jpg", ".jpeg"}
+
+# TIFF field type -> byte size
+_TYPE_SIZE = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+IFD0_TAGS = {
+    0x0100: "ImageWidth",
+    0x0101: "ImageHeight",
+    0x010F: "Make",
+    0x0110: "Model",
+    0x0112: "Orientation",
+}
+EXIF_TAGS = {
+    0x829A: "ExposureTime",
+    0x829D: "FNumber",
+    0x8827: "ISO",
+    0x9003: "DateTimeOriginal",
+    0x9004: "CreateDate",
+    0x9204: "ExposureBiasValue",
+    0x920A: "FocalLength",
+    0x9291: "SubSecTimeOriginal",
+    0xA002: "ExifImageWidth",
+    0xA003: "ExifImageHeight",
+    0xA431: "SerialNumber",
+    0xA434: "LensModel",
+}
+EXIF_IFD = 0x8769
+SUB_IFDS = 0x014A
+MAKER_NOTE = 0x927C
+
+class HeaderError(Exception):
+    pass
+
+
+class _Source:
+    """File head in memory; reads past it go to os.pread."""
+
+    def __init__(self, fd, head):
+        self.fd = fd
+        self.head = head
+
+    def read(self, offset, size):
+        end = offset + size
+        if end <= len(self.head):
+            return self.head[offset:end]
+        data = os.pread(self.fd, size, offset)
+        if len(data) < size:
+            raise HeaderError("truncated file")
+        return data
+
+
+class _Tiff:
+    def __init__(self, src, base, order=None):
+        """TIFF structure at `base`; with `order` (b"II" / b"MM") there is no header
+        to check, only IFDs whose offsets count from `base` (maker notes)."""
+        self.src = src
+        self.base = base
+        if order is not None:
+            self.e = "<" if order == b"II" else ">"
+            self.ifd0 = None
+            return
+        order = src.read(base, 2)
+        if order == b"II":
+            self.e = "<"
+        elif order == b"MM":
+            self.e = ">"
+        else:
+            raise HeaderError("not a TIFF header")
+        # 42 = TIFF, 0x4F52/0x5352 = Olympus ORF
+        magic, ifd0 = struct.unpack(self.e + "HI", src.read(base + 2, 6))
+        if magic not in (42, 0x4F52, 0x5352):
+            raise HeaderError(f"unknown TIFF magic {magic:#x}")
+        self.ifd0 = ifd0
+
+    def next_ifd(self, offset):
+        """Offset of the IFD chained after the one at `offset` (0 = none)."""
+        (n,) = struct.unpack(self.e + "H", self.src.read(self.base + offset, 2))
+        (nxt,) = struct.unpack(self.e + "I", self.src.read(self.base + offset + 2 + n * 12, 4))
+        return nxt
+
+    def entries(self, offset, pointers=()):
+        """Yield (tag, type, count, value_bytes) for one IFD; for tags in
+        `pointers` an out-of-line value is not read, its 4-byte offset is yielded."""
+        e = self.e
+        (n,) = struct.unpack(e + "H", self.src.read(self.base + offset, 2))
+        if n > 1000:
+            raise HeaderError("implausible IFD size")
+        raw = self.src.read(self.base + offset + 2, n * 12)
+        for i in range(n):
+            tag, typ, count, value = struct.unpack_from(e + "HHI4s", raw, i * 12)
+            size = _TYPE_SIZE.get(typ)
+            if size is None:
+                continue
+            total = size * count
+            if total > 4:
+                if tag in pointers:
+                    yield tag, typ, count, value
+                    continue
+                (ptr,) = struct.unpack(e + "I", value)
+                if total > 1 << 16:
+                    continue
+                value = self.src.read(self.base + ptr, total)
+            yield tag, typ, count, value[:total]
+
+    def value(self, typ, count, data):
+        e = self.e
+        if typ == 2:
+            return data.split(b"\0", 1)[0].decode("latin-1").strip()
+        if typ in (1, 7):
+            return data
+        fmt = {3: "H", 4: "I", 8: "h", 9: "i", 11: "f", 12: "d", 13: "I"}.get(typ)
+        if fmt:
+            vals = struct.unpack(f"{e}{count}{fmt}", data)
+        elif typ in (5, 10):
+            pairs = struct.unpack(f"{e}{count * 2}{'I' if typ == 5 else 'i'}", data)
+            vals = tuple(a / b if b else None for a, b in zip(pairs[::2], pairs[1::2]))
+        else:
+            return None
+        return vals[0] if count == 1 else vals
+
+
+def _walk(tiff):
+    rec = {}
+    sub_ifds = []
+    exif_ptr = None
+    for tag, typ, count, data in tiff.entries(tiff.ifd0):
+        if tag in IFD0_TAGS:
+            rec[IFD0_TAGS[tag]] = tiff.value(typ, count, data)
+        elif tag == EXIF_IFD:
+            exif_ptr = tiff.value(typ, 1, data[:4])
+        elif tag == SUB_IFDS:
+            v = tiff.value(typ, count, data)
+            sub_ifds = list(v) if isinstance(v, tuple) else [v]
+    maker_ptr = None
+    if exif_ptr:
+        for tag, typ, count, data in tiff.entries(exif_ptr, pointers=(MAKER_NOTE,)):
+            if tag in EXIF_TAGS:
+                rec[EXIF_TAGS[tag]] = tiff.value(typ, count, data)
+            elif tag == MAKER_NOTE and count > 4:
+                (maker_ptr,) = struct.unpack(tiff.e + "I", data)
+    decode = _MAKER_NOTES.get(_make_key(rec.get("Make")))
+    if decode and maker_ptr:
+        try:
+            rec.update(decode(tiff, maker_ptr))
+        except (HeaderError, struct.error):
+            pass  # odd maker note: the record is still good without the sequence tags
+
+    # DNG / NEF: IFD0 is often a thumbnail; the raw frame lives in a SubIFD.
+    w, h = rec.get("ImageWidth"), rec.get("ImageHeight")
+    for ptr in sub_ifds[:4]:
+        try:
+            dims = {t: tiff.value(ty, c, d) for t, ty, c, d in tiff.entries(ptr) if t in (0x0100, 0x0101)}
+        except (HeaderError, struct.error):
+            continue
+        sw, sh = dims.get(0x0100), dims.get(0x0101)
+        if isinstance(sw, int) and isinstance(sh, int) and sw * sh > (w or 0) * (h or 0):
+            w, h = sw, sh
+    rec["ImageWidth"], rec["ImageHeight"] = w, h
+    return rec
+
+
+def _make_key(make):
+    return make.split()[0].upper() if isinstance(make, str) and make.strip() else None
+
+
+def _int16s(v):
+    return v - 0x10000 if isinstance(v, int) and v >= 0x8000 else v
+
+
+def _canon_sequence(tiff, ptr):
+    """Canon: a plain IFD, offsets from the TIFF header; int16s arrays."""
+    out = {}
+    for tag, typ, count, data in tiff.entries(ptr):
+        if tag == 0x0004 and count > 9:  # ShotInfo
+            out["SequenceNumber"] = _int16s(tiff.value(typ, count, data)[9])
+        elif tag == 0x0093 and count > 5:  # FileInfo
+            out["BracketShotNumber"] = _int16s(tiff.value(typ, count, data)[5])
+    return out
+
+
+def _fuji_sequence(tiff, ptr):
+    """Fujifilm: "FUJIFILM" + IFD offset; little-endian, offsets from the maker note."""
+    base = tiff.base + ptr
+    if tiff.src.read(base, 8) != b"FUJIFILM":
+        return {}
+    (ifd,) = struct.unpack("<I", tiff.src.read(base + 8, 4))
+    mn = _Tiff(tiff.src, base, order=b"II")
+    for tag, typ, count, data in mn.entries(ifd):
+        if tag == 0x1101:
+            return {"SequenceNumber": mn.value(typ, count, data)}
+    return {}
+
+
+def _sony_sequence(tiff, ptr):
+    """Sony: optional 12-byte "SONY DSC" header, then an IFD with offsets from the TIFF header."""
+    if tiff.src.read(tiff.base + ptr, 4) == b"SONY":
+        ptr += 12
+    for tag, typ, count, data in tiff.entries(ptr):
+        if tag == 0xB04A:
+            return {"SequenceNumber": tiff.value(typ, count, data)}
+    return {}
+
+
+def _apple_sequence(tiff, ptr):
+    """Apple: "Apple iOS" + version + byte order, then an IFD with offsets from the maker note."""
+    base = tiff.base + ptr
+    head = tiff.src.read(base, 14)
+    if not head.startswith(b"Apple iOS\0") or head[12:] not in (b"II", b"MM"):
+        return {}
+    mn = _Tiff(tiff.src, base, order=head[12:])
+    for tag, typ, count, data in mn.entries(14):
+        if tag == 0x000B and typ == 2:
+            return {"BurstUUID": mn.value(typ, count, data)}
+    return {}
+
+
+# Make (first word, upper case) -> maker-note decoder returning sequence tags
+_MAKER_NOTES = {
+    "CANON": _canon_sequence,
+    "FUJIFILM": _fuji_sequence,
+    "SONY": _sony_sequence,
+    "APPLE": _apple_sequence,
+}
+
+
+def _jpeg_exif_offset(src, start=0):
+    """Offset of the TIFF header inside a JPEG's APP1 Exif segment."""
+    if src.read(start, 2) != b"\xff\xd8":
+        raise HeaderError("not a JPEG")
+    pos = start + 2
+    for _ in range(64):
+        marker, length = struct.unpack(">HH", src.read(pos, 4))
+        if marker == 0xFFE1 and src.read(pos + 4, 6) == b"Exif\0\0":
+            return pos + 10
+        if marker in (0xFFDA, 0xFFD9) or marker >> 8 != 0xFF:
+            break
+        pos += 2 + length
+    raise HeaderError("no Exif segment")
+
+
+def _tiff_base(src, ext):
+    head = src.read(0, 16)
+    if head.startswith(b"FUJIFILMCCD-RAW"):
+        (jpeg_off,) = struct.unpack(">I", src.read(84, 4))
+        return _jpeg_exif_offset(src, jpeg_off)
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg_exif_offset(src)
+    if head[:2] in (b"II", b"MM"):
+        return 0
+    raise HeaderError(f"unsupported container for {ext}")
+
+
+def _print_record(path, rec):
+    """Shape a raw tag dict like `exiftool -j -n` output."""
+    out = {
+        "SourceFile": path,
+        "Directory": os.path.dirname(path),
+        "FileName": os.path.basename(path),
+    }
+    for k in ("DateTimeOriginal", "CreateDate", "Make", "Model", "SerialNumber", "LensModel"):
+        v = rec.get(k)
+        if isinstance(v, str) and v:
+            out[k] = v
+    sub = rec.get("SubSecTimeOriginal")
+    if out.get("DateTimeOriginal") and isinstance(sub, str) and sub.strip().isdigit():
+        out["SubSecDateTimeOriginal"] = f"{out['DateTimeOriginal']}.{sub.strip()}"
+    for k in ("ExposureTime", "FNumber", "FocalLength", "ExposureBiasValue", "ISO"):
+        v = rec.get(k)
+        if isinstance(v, tuple):
+            v = v[0] if v else None
+        if isinstance(v, (int, float)):
+            out[k] = v
+    w = rec.get("ExifImageWidth") or rec.get("ImageWidth")
+    h = rec.get("ExifImageHeight") or rec.get("ImageHeight")
+    if isinstance(w, int) and isinstance(h, int):
+        out["ImageWidth"], out["ImageHeight"] = w, h
+    o = rec.get("Orientation")
+    if isinstance(o, int):
+        out["Orientation"] = o
+    for k in SEQUENCE_TAGS:
+        v = rec.get(k)
+        if isinstance(v, int) or (isinstance(v, str) and v):
+            out[k] = v
+    return out
+
+
+def parse_header(src, path):
+    """exiftool-style record from any source with read(offset, size) (local file or ranged GET)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in NATIVE_EXTS:
+        raise HeaderError(f"no native reader for {ext}")
+    try:
+        rec = _walk(_Tiff(src, _tiff_base(src, ext)))
+    except struct.error as e:
+        raise HeaderError(str(e))
+    if not rec.get("DateTimeOriginal") and not rec.get("CreateDate"):
+        raise HeaderError("no capture time in header")
+    return _print_record(path, rec)
+
+
+def read_header(path, header_bytes=HEADER_BYTES):
+    """exiftool-style record for one file; raises HeaderError if unsupported."""
+    if os.path.splitext(path)[1].lower() not in NATIVE_EXTS:
+        raise HeaderError(f"no native reader for {os.path.splitext(path)[1].lower()}")
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return parse_header(_Source(fd, os.pread(fd, header_bytes, 0)), path)
+    finally:
+        os.close(fd)
+
+
+def thumbnail_bytes(path, header_bytes=HEADER_BYTES):
+    """Smallest embedded JPEG referenced from IFD0/IFD1 (the EXIF thumbnail
+    for JPEG, CR2, ARW, RAF), or None. No image data is decoded."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in NATIVE_EXTS:
+        return None
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        src = _Source(fd, os.pread(fd, header_bytes, 0))
+        tiff = _Tiff(src, _tiff_base(src, ext))
+        best = None
+        ifd = tiff.ifd0
+        for _ in range(2):
+            tags = {t: tiff.value(ty, c, d) for t, ty, c, d in tiff.entries(ifd) if t in (0x0201, 0x0202)}
+            off, size = tags.get(0x0201), tags.get(0x0202)
+            if isinstance(off, int) and isinstance(size, int) and 0 < size <= THUMB_MAX_BYTES:
+                if best is None or size < best[1]:
+                    best = (off, size)
+            ifd = tiff.next_ifd(ifd)
+            if not ifd:
+                break
+        if best is None:
+            return None
+        data = src.read(tiff.base + best[0], best[1])
+        return data if data[:2] == b"\xff\xd8" else None
+    except (HeaderError, struct.error, OSError):
+        return None
+    finally:
+        os.close(fd)
+
+
+def _try_read(path):
+    try:
+        return read_header(path)
+    except (HeaderError, OSError):
+        return None
+
+
+def read_exif_records(files, fields, reader=DEFAULT_READER, workers=READ_WORKERS):
+    """Records for `files` in input order; native where possible, exiftool for the rest."""
+    files = list(files)
+    if reader == "exiftool" or not files:
+        return exiftool_json(files, fields)
+    if reader not in READERS:
+        raise ValueError(f"unknown EXIF reader {reader!r}, expected one of {READERS}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        native = list(pool.map(_try_read, files))
+    rest = [p for p, rec in zip(files, native) if rec is None]
+    fallback = {}
+    if rest:
+        # CR3 / RW2 / 解析失败的文件：一次性交给常驻 exiftool
+        for rec in exiftool_json(rest, fields):
+            fallback[rec.get("SourceFile")] = rec
+    wanted = [f for f in fields if f.lstrip("-") in SEQUENCE_TAGS]
+    if wanted and READ_SEQUENCE_TAGS:
+        _add_sequence_tags([rec for rec in native if rec is not None and _lacks_sequence_tags(rec)], wanted)
+    out = []
+    for p, rec in zip(files, native):
+        rec = rec if rec is not None else fallback.get(p)
+        if rec is not None:
+            out.append(rec)
+    return out
+
+
+def _lacks_sequence_tags(rec):
+    return _make_key(rec.get("Make")) in SEQUENCE_MAKES and not any(k in rec for k in SEQUENCE_TAGS)
+
+
+def _add_sequence_tags(records, wanted):
+    """Maker-note sequence tags for natively read records, from one batched exiftool call."""
+    if not records:
+        return
+    # -n like the native records; -fast: the image data is never scanned
+    args = ["-n", "-fast"] + wanted
+    try:
+        found = {rec.get("SourceFile"): rec for rec in exiftool_json([r["SourceFile"] for r in records], args)}
+    except (ExifToolError, OSError) as e:
+        print(f"⚠️ Maker-note sequence tags unavailable ({e}); grouping falls back to time gaps", file=sys.stderr)
+        return
+    for rec in records:
+        extra = found.get(rec["SourceFile"]) or {}
+        for tag in SEQUENCE_TAGS:
+            if tag in extra:
+                rec[tag] = extra[tag]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Usage: python3 exif_header.py <files...>")
+        return 1
+    for p in argv:
+        try:
+            print(json.dumps(read_header(p), ensure_ascii=False))
+        except (HeaderError, OSError) as e:
+            print(json.dumps({"SourceFile": p, "Error": str(e)}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
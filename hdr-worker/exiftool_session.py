@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-lived exiftool processes (`exiftool -stay_open True -@ -`).
+
+Arguments are streamed to exiftool's stdin as an argfile, one per line, so
+large shoots never hit ARG_MAX and we pay the Perl start-up cost once per
+process instead of once per call. Files are sent in chunks; a pool of
+sessions can work on several chunks in parallel so one slow file only holds
+up its own chunk.
+
+Usage from the shell pipeline:
+    python3 exiftool_session.py previews --subdir jpg <group_dir> [<group_dir> ...]
+"""
+
+import argparse
+import atexit
+import collections
+import json
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+EXIFTOOL_BIN = os.getenv("EXIFTOOL_BIN", "exiftool")
+EXIFTOOL_WORKERS = int(os.getenv("EXIFTOOL_WORKERS", "1"))
+EXIFTOOL_CHUNK = int(os.getenv("EXIFTOOL_CHUNK", "200"))
+EXIFTOOL_TIMEOUT = float(os.getenv("EXIFTOOL_TIMEOUT", "120"))
+
+RAW_PREVIEW_EXTS = {
+    ".arw", ".cr2", ".cr3", ".nef", ".dng", ".rw2", ".orf", ".raf",
+}
+
+
+class ExifToolError(RuntimeError):
+    pass
+
+
+class ExifToolTimeout(ExifToolError):
+    pass
+
+
+class ExifTool:
+    """One `-stay_open` exiftool process. Not thread-safe; use ExifToolPool."""
+
+    def __init__(self, executable=EXIFTOOL_BIN):
+        self.executable = executable
+        self._proc = None
+        self._seq = 0
+        self.stderr_tail = collections.deque(maxlen=50)
+
+    def start(self):
+        self._proc = subprocess.Popen(
+            [self.executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # Drain stderr so per-file warnings can never fill the pipe and stall us.
+        t = threading.Thread(target=self._drain_stderr, args=(self._proc,), daemon=True)
+        t.start()
+
+    def _drain_stderr(self, proc):
+        for line in proc.stderr:
+            self.stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    @property
+    def running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def close(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.write(b"-stay_open\nFalse\n")
+            proc.stdin.flush()
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+            proc.wait()
+
+    def kill(self):
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, args, timeout=None):
+        """Run one batch of arguments and return exiftool's raw stdout."""
+        if not self.running:
+            self.start()
+        for a in args:
+            if "\n" in a:
+                raise ValueError(f"exiftool argument contains a newline: {a!r}")
+
+        self._seq += 1
+        marker = f"{{ready{self._seq}}}".encode()
+        payload = "\n".join(list(args) + [f"-execute{self._seq}"]) + "\n"
+        self._proc.stdin.write(payload.encode("utf-8"))
+        self._proc.stdin.flush()
+
+        fd = self._proc.stdout.fileno()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buf = bytearray()
+        scanned = 0
+        while True:
+            idx = buf.find(marker, max(0, scanned - len(marker)))
+            if idx != -1:
+                return bytes(buf[:idx])
+            scanned = len(buf)
+
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    self.kill()
+                    raise ExifToolTimeout(f"exiftool did not answer within {timeout}s")
+            ready, _, _ = select.select([fd], [], [], wait)
+            if not ready:
+                continue
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                self.kill()
+                raise ExifToolError("exiftool exited unexpectedly: " + " | ".join(self.stderr_tail))
+            buf += chunk
+
+    def execute_json(self, args, timeout=None):
+        out = self.execute(["-json"] + list(args), timeout=timeout)
+        out = out.strip()
+        if not out:
+            return []
+        return json.loads(out)
+
+
+class ExifToolPool:
+    """A fixed set of ExifTool sessions fed by a thread pool."""
+
+    def __init__(self, size=EXIFTOOL_WORKERS, executable=EXIFTOOL_BIN, timeout=EXIFTOOL_TIMEOUT):
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._sessions = [ExifTool(executable) for _ in range(self.size)]
+        for s in self._sessions:
+            self._idle.put(s)
+        self._executor = ThreadPoolExecutor(max_workers=self.size)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for s in self._sessions:
+            s.close()
+
+    def _with_session(self, fn):
+        session = self._idle.get()
+        try:
+            return fn(session)
+        finally:
+            self._idle.put(session)
+
+    def _json_chunk(self, args, chunk):
+        def run(session):
+            try:
+                return session.execute_json(args + chunk, timeout=self.timeout)
+            except ExifToolTimeout:
+                if len(chunk) == 1:
+                    print(f"⚠️ exiftool timed out on {chunk[0]}, skipping", file=sys.stderr)
+                    return []
+            # Retry file by file so only the slow file is dropped.
+            records = []
+            for f in chunk:
+                try:
+                    records.extend(session.execute_json(args + [f], timeout=self.timeout))
+                except ExifToolTimeout:
+                    print(f"⚠️ exiftool timed out on {f}, skipping", file=sys.stderr)
+            return records
+
+        return self._with_session(run)
+
+    def iter_json(self, files, args=(), chunk_size=EXIFTOOL_CHUNK):
+        """Yield per-file JSON records chunk by chunk, in input order."""
+        args = list(args)
+        files = list(files)
+        chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+        futures = [self._executor.submit(self._json_chunk, args, c) for c in chunks]
+        for fut in futures:
+            for rec in fut.result():
+                yield rec
+
+    def read_binary_tag(self, path, tags):
+        """Return the first non-empty binary tag (e.g. PreviewImage) of `path`."""
+        def run(session):
+            for tag in tags:
+                data = session.execute(["-b", f"-{tag}", path], timeout=self.timeout)
+                if data:
+                    return data
+            return b""
+
+        return self._with_session(run)
+
+    def extract_previews(self, pairs, tags=("PreviewImage", "JpgFromRaw")):
+        """Write the embedded JPEG of each (src, dst) pair. Returns dst paths written."""
+        def one(pair):
+            src, dst = pair
+            data = self.read_binary_tag(src, tags)
+            if not data:
+                print(f"⚠️ No embedded JPEG in {src}", file=sys.stderr)
+                return None
+            with open(dst, "wb") as f:
+                f.write(data)
+            return dst
+
+        return [d for d in self._executor.map(one, pairs) if d]
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool():
+    """Process-wide pool so grouping and preview extraction reuse the same exiftools."""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = ExifToolPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
+
+
+def iter_exiftool_json(files, fields=(), chunk_size=EXIFTOOL_CHUNK):
+    return shared_pool().iter_json(files, fields, chunk_size=chunk_size)
+
+
+def exiftool_json(files, fields=(), chunk_size=EXIFTOOL_CHUNK):
+    return list(iter_exiftool_json(files, fields, chunk_size=chunk_size))
+
+
+def _preview_pairs(group_dirs, subdir):
+    pairs = []
+    for g in group_dirs:
+        if not os.path.isdir(g):
+            continue
+        dst_dir = os.path.join(g, subdir)
+        os.makedirs(dst_dir, exist_ok=True)
+        for fn in sorted(os.listdir(g)):
+            stem, ext = os.path.splitext(fn)
+            if ext.lower() in RAW_PREVIEW_EXTS:
+                pairs.append((os.path.join(g, fn), os.path.join(dst_dir, stem + ".jpg")))
+    return pairs
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("previews", help="extract embedded JPEGs for every RAW in each folder")
+    p.add_argument("folders", nargs="+")
+    p.add_argument("--subdir", default="jpg")
+    args = ap.parse_args(argv)
+
+    pairs = _preview_pairs(args.folders, args.subdir)
+    written = shared_pool().extract_previews(pairs)
+    # Missing previews are reported per group by the caller, not fatal here.
+    print(f"Extracted {len(written)}/{len(pairs)} previews")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
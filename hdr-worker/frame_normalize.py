@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Canvas normalisation before alignment, in memory.
+
+Replaces the `magick identify` + `magick -auto-orient -extent` passes of the
+shell pipeline (two decodes, two encodes, 2N processes per group):
+- size and EXIF orientation come from the JPEG headers (SOF + IFD0), so the
+  common canvas is known before anything is decoded
+- every frame is decoded once; when the canvas is capped (HDR_MAX_SIDE) the
+  JPEG is decoded at reduced DCT scale (Pillow draft) and then resized
+- orientation is applied with NumPy flips / transposes, frames are padded
+  black and centred on the canvas, and uint8 H x W x 3 arrays are returned
+- load_frame() + place() split the same work for callers that decode each
+  frame as it arrives and only learn the group (canvas) afterwards
+
+Embedded previews written by raw_preview carry no EXIF of their own; pass
+the RAW's orientation as `orientations` and it is used when the JPEG has
+none.
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from exif_header import HeaderError, _jpeg_exif_offset, _Tiff
+from raw_preview import _MapSource, jpeg_size
+
+try:
+    from PIL import Image
+except ImportError:  # only needed to decode
+    Image = None
+
+MAX_SIDE = int(os.getenv("HDR_MAX_SIDE", "0"))
+ORIENTATION_TAG = 0x0112
+
+
+def _orientation_value(v):
+    try:
+        v = int(float(v))
+    except (TypeError, ValueError):
+        return None
+    return v if 1 <= v <= 8 else None
+
+
+def frame_header(path):
+    """(width, height, orientation) of a JPEG from its headers; orientation None if absent."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        dims = jpeg_size(mm)
+        if dims is None:
+            raise HeaderError(f"not a viewable JPEG: {path}")
+        orientation = None
+        try:
+            src = _MapSource(mm)
+            tiff = _Tiff(src, _jpeg_exif_offset(src))
+            for tag, typ, count, data in tiff.entries(tiff.ifd0):
+                if tag == ORIENTATION_TAG:
+                    orientation = _orientation_value(tiff.value(typ, count, data))
+                    break
+        except (HeaderError, struct.error):
+            pass
+        return dims[0], dims[1], orientation
+    finally:
+        mm.close()
+
+
+def oriented_size(w, h, orientation):
+    return (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+
+
+def apply_orientation(a, orientation):
+    """EXIF orientation (1-8) applied to an H x W x C array, as -auto-orient does."""
+    if orientation == 2:
+        return a[:, ::-1]
+    if orientation == 3:
+        return a[::-1, ::-1]
+    if orientation == 4:
+        return a[::-1]
+    if orientation == 5:
+        return a.transpose(1, 0, 2)
+    if orientation == 6:
+        return np.rot90(a, -1)
+    if orientation == 7:
+        return a.transpose(1, 0, 2)[::-1, ::-1]
+    if orientation == 8:
+        return np.rot90(a, 1)
+    return a
+
+
+def decode(path, size=None):
+    """uint8 RGB array of a JPEG, decoded at reduced DCT scale when `size` (w, h) is smaller."""
+    if Image is None:
+        raise RuntimeError("normalisation needs Pillow (pip install pillow)")
+    with Image.open(path) as im:
+        if size is not None and size != im.size:
+            im.draft("RGB", size)
+        im = im.convert("RGB")
+        if size is not None and im.size != size:
+            im = im.resize(size, Image.LANCZOS)
+        return np.asarray(im)
+
+
+def canvas_size(headers, max_side=MAX_SIDE):
+    """(W, H, scale): largest oriented size of the group and the scale applied to fit max_side."""
+    cw = max(oriented_size(w, h, o)[0] for w, h, o in headers)
+    ch = max(oriented_size(w, h, o)[1] for w, h, o in headers)
+    scale = 1.0
+    if max_side and max(cw, ch) > max_side:
+        scale = max_side / max(cw, ch)
+        cw, ch = max(1, round(cw * scale)), max(1, round(ch * scale))
+    return cw, ch, scale
+
+
+def _header(path, orientation=None):
+    w, h, o = frame_header(path)
+    if o is None:
+        o = _orientation_value(orientation)
+    return w, h, o or 1
+
+
+def _decode_oriented(path, header, scale):
+    w, h, o = header
+    size = None if scale == 1.0 else (max(1, round(w * scale)), max(1, round(h * scale)))
+    return apply_orientation(decode(path, size), o)
+
+
+def _pad(a, cw, ch):
+    fh, fw = min(a.shape[0], ch), min(a.shape[1], cw)
+    out = np.zeros((ch, cw, 3), dtype=np.uint8)
+    y0, x0 = (ch - fh) // 2, (cw - fw) // 2
+    out[y0:y0 + fh, x0:x0 + fw] = a[:fh, :fw]
+    return out
+
+
+def normalize(paths, orientations=None, max_side=MAX_SIDE):
+    """Oriented, centred, black-padded uint8 frames sharing one canvas (in `paths` order)."""
+    headers = [_header(p, None if orientations is None else orientations[i]) for i, p in enumerate(paths)]
+    cw, ch, scale = canvas_size(headers, max_side)
+    return [_pad(_decode_oriented(p, hdr, scale), cw, ch) for p, hdr in zip(paths, headers)]
+
+
+def load_frame(path, orientation=None, max_side=MAX_SIDE):
+    """(oriented uint8 frame, header) of one JPEG, before the rest of its group is known.
+
+    The frame is decoded as if it were alone on the canvas; place() finishes
+    the job once the group is complete.
+    """
+    header = _header(path, orientation)
+    return _decode_oriented(path, header, canvas_size([header], max_side)[2]), header
+
+
+def place(frames, headers, max_side=MAX_SIDE):
+    """Frames from load_frame on their group's common canvas, as normalize() lays them out.
+
+    Identical pixels unless a mixed-size group is capped by max_side, where
+    the smaller frames are resampled a second time.
+    """
+    cw, ch, scale = canvas_size(headers, max_side)
+    out = []
+    for a, (w, h, o) in zip(frames, headers):
+        if scale != 1.0:
+            tw, th = oriented_size(max(1, round(w * scale)), max(1, round(h * scale)), o)
+            if a.shape[:2] != (th, tw):
+                a = np.asarray(Image.fromarray(a).resize((tw, th), Image.LANCZOS))
+        out.append(_pad(a, cw, ch))
+    return out
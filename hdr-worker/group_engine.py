@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Column-oriented bracket grouping core.
+
+Rows are turned into NumPy columns once; time deltas, the dynamic allowed
+gap and setup (aperture / focal length) breaks are array expressions, and
+group ids are a cumulative sum over the break mask. Only clusters longer
+than MAX_BRACKET frames go through the sequential exposure-direction split.
+
+The rules are the same ones group_rows used to apply row by row:
+- consecutive frames belong together if the gap is within
+  max(TIME_GAP_SEC, BASE_GAP_SEC + EXP_GAP_FACTOR * longest shutter)
+- and aperture / focal length did not jump (missing or zero values never break)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+TIME_GAP_SEC = 3.0
+BASE_GAP_SEC = 1.2
+EXP_GAP_FACTOR = 2.5
+FNUM_TOL = 0.2
+FOCAL_TOL = 2.0
+MAX_BRACKET = 7
+# EVs and EV steps are rounded before the 0.4 / 0.6 EV thresholds, like the time
+# gaps: 1.7 - 1.1 or a float32 -0.3 must not flip a step that sits on the limit.
+EV_DECIMALS = 6
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _float_column(rows, key):
+    try:
+        return np.array([r.get(key) for r in rows], dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    out = np.full(len(rows), np.nan, dtype=np.float64)
+    for i, r in enumerate(rows):
+        v = r.get(key)
+        if v is None:
+            continue
+        try:
+            out[i] = float(v)
+        except (TypeError, ValueError):
+            pass
+    return out
+
+
+def time_column(rows, key="time"):
+    """Epoch seconds (float64) from datetime-like values or plain numbers."""
+    values = [r[key] for r in rows]
+    if values and isinstance(values[0], (int, float)):
+        return np.asarray(values, dtype=np.float64)
+    return np.fromiter(((v - _EPOCH).total_seconds() for v in values), np.float64, len(values))
+
+
+def columns_from_rows(rows):
+    """Pull the columns the grouping rules need out of make_row() dicts."""
+    return {
+        "time": time_column(rows),
+        "ev": _float_column(rows, "ev"),
+        "shutter": _float_column(rows, "shutter"),
+        "fnum": _float_column(rows, "fnum"),
+        "focal": _float_column(rows, "focal"),
+    }
+
+
+def exposure_values(ev, shutter):
+    """EV when known, otherwise log2(shutter); NaN when neither is usable."""
+    ev = np.asarray(ev, dtype=np.float64)
+    shutter = np.asarray(shutter, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_shutter = np.where(shutter > 0, np.log2(np.where(shutter > 0, shutter, 1.0)), np.nan)
+    return np.round(np.where(np.isfinite(ev), ev, from_shutter), EV_DECIMALS)
+
+
+def allowed_gaps(shutter_a, shutter_b):
+    longest = np.maximum(np.nan_to_num(shutter_a, nan=0.0), np.nan_to_num(shutter_b, nan=0.0))
+    return np.maximum(TIME_GAP_SEC, BASE_GAP_SEC + EXP_GAP_FACTOR * longest)
+
+
+def _jumps(a, b, tol):
+    with np.errstate(invalid="ignore"):
+        return (a != 0) & (b != 0) & (np.abs(a - b) > tol)
+
+
+def pair_breaks(cols, a, b):
+    """True where frames a[k] -> b[k] (index arrays, b later) would not share a group."""
+    t = cols["time"]
+    # Round to microseconds so float epoch noise cannot flip a gap sitting on the limit.
+    dt = np.round(t[b] - t[a], 6)
+    shutter, fnum, focal = cols["shutter"], cols["fnum"], cols["focal"]
+    too_far = dt > allowed_gaps(shutter[a], shutter[b])
+    return too_far | _jumps(fnum[a], fnum[b], FNUM_TOL) | _jumps(focal[a], focal[b], FOCAL_TOL)
+
+
+def break_mask(cols):
+    """True where a sorted frame starts a new time cluster (first frame always)."""
+    n = len(cols["time"])
+    brk = np.ones(n, dtype=bool)
+    if n < 2:
+        return brk
+    brk[1:] = pair_breaks(cols, np.arange(n - 1), np.arange(1, n))
+    return brk
+
+
+def is_break(prev, cur):
+    """Scalar pair_breaks for two make_row dicts (used by the streaming grouper)."""
+    dt = round((cur["time"] - prev["time"]).total_seconds(), 6)
+    sa, sb = _num(prev.get("shutter")), _num(cur.get("shutter"))
+    longest = max(0.0 if sa != sa else sa, 0.0 if sb != sb else sb)
+    if dt > max(TIME_GAP_SEC, BASE_GAP_SEC + EXP_GAP_FACTOR * longest):
+        return True
+    for key, tol in (("fnum", FNUM_TOL), ("focal", FOCAL_TOL)):
+        a, b = _num(prev.get(key)), _num(cur.get(key))
+        if a != 0 and b != 0 and abs(a - b) > tol:
+            return True
+    return False
+
+
+def _num(v):
+    try:
+        return float(v) if v is not None else float("nan")
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def split_cluster(rows):
+    """Bracket-split one time cluster (capture order); clusters of <= MAX_BRACKET stay whole."""
+    if len(rows) <= MAX_BRACKET:
+        return [rows]
+    cols = columns_from_rows(rows)
+    exp = [None if v != v else v for v in exposure_values(cols["ev"], cols["shutter"]).tolist()]
+    bounds = [0] + _split_starts(exp, 0, len(rows)) + [len(rows)]
+    return [rows[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _split_starts(exp, start, stop):
+    """Sequential bracket split of one long cluster; returns extra group starts."""
+    starts = []
+    cur_len = 1
+    direction = 0
+    start_exp = exp[start]
+    lo = hi = start_exp
+
+    for i in range(start + 1, stop):
+        e = exp[i]
+        if cur_len >= MAX_BRACKET:
+            starts.append(i)
+            cur_len, direction, start_exp, lo, hi = 1, 0, e, e, e
+            continue
+
+        prev_e = exp[i - 1]
+        if e is not None and prev_e is not None:
+            delta = round(e - prev_e, EV_DECIMALS)
+            if direction == 0 and abs(delta) >= 0.4:
+                direction = 1 if delta > 0 else -1
+            exp_range = round(hi - lo, EV_DECIMALS) if lo is not None else 0.0
+            sign_flip = (direction > 0 and delta < -0.6) or (direction < 0 and delta > 0.6)
+            back_to_start = start_exp is not None and round(abs(e - start_exp), EV_DECIMALS) <= 0.4
+            if cur_len >= 2 and sign_flip and (back_to_start or exp_range >= 0.6):
+                starts.append(i)
+                cur_len, direction, start_exp, lo, hi = 1, 0, e, e, e
+                continue
+
+        cur_len += 1
+        if e is not None:
+            lo = e if lo is None or e < lo else lo
+            hi = e if hi is None or e > hi else hi
+    return starts
+
+
+def assign_groups(cols):
+    """Sort by time and label groups.
+
+    Returns (order, gid): `order` is the stable time sort of the input rows and
+    `gid[k]` is the 0-based group of row `order[k]`.
+    """
+    order = np.argsort(cols["time"], kind="stable")
+    if len(order) == 0:
+        return order, np.zeros(0, dtype=np.int64)
+    s = {k: v[order] for k, v in cols.items()}
+    starts = break_mask(s)
+
+    bounds = np.flatnonzero(starts)
+    ends = np.append(bounds[1:], len(order))
+    long_clusters = np.flatnonzero(ends - bounds > MAX_BRACKET)
+    if len(long_clusters):
+        exp = exposure_values(s["ev"], s["shutter"])
+        exp = [None if v != v else v for v in exp.tolist()]
+        for c in long_clusters:
+            starts[_split_starts(exp, bounds[c], ends[c])] = True
+
+    gid = np.cumsum(starts) - 1
+    return order, gid
+
+
+def group_indices(cols):
+    """List of groups, each a list of input row indices in capture order."""
+    order, gid = assign_groups(cols)
+    if len(order) == 0:
+        return []
+    bounds = (np.flatnonzero(np.diff(gid)) + 1).tolist()
+    order = order.tolist()
+    return [order[a:b] for a, b in zip([0] + bounds, bounds + [len(order)])]
+
+
+def group_row_dicts(rows):
+    """Group make_row() dicts; returns lists of the same dict objects."""
+    if not rows:
+        return []
+    return [[rows[i] for i in g] for g in group_indices(columns_from_rows(rows))]
+
+
+# === Exact grouping from maker-note sequence fields ===
+# Identifier fields: every frame of one bracket carries the same value.
+SEQUENCE_ID_FIELDS = (("burst", "burst_uuid"), ("bracket_seq", "bracket_sequence"))
+# Counter fields: 1, 2, 3, ... within a bracket, back to 1 for the next one.
+SEQUENCE_COUNTER_FIELDS = (("bracket_shot", "bracket_shot_number"), ("seq", "sequence_number"))
+TIME_STRATEGY = "time_gap"
+
+
+_NO_IDENT = ("", "None", "nan", "0", "Single")
+
+
+def _ident_column(rows, key):
+    """(stripped strings, valid mask) of an identifier field; same rules as str(v).strip()."""
+    s = np.char.strip(np.array([str(r.get(key)) for r in rows]))
+    return s, ~np.isin(s, _NO_IDENT)
+
+
+def _counter_column(rows, key):
+    """Maker-note shot counters as float64, NaN where absent or not a positive integer."""
+    f = _float_column(rows, key)
+    with np.errstate(invalid="ignore"):
+        ok = (f >= 1) & (f == np.floor(f))
+    return np.where(ok, f, np.nan)
+
+
+def sequence_columns(rows, cols=None):
+    """columns_from_rows plus the maker-note sequence fields, for group_by_sequence.
+
+    `cols` may hold typed columns already built for the same rows (e.g. by
+    exif_columns.read_columns); they are reused instead of re-read from the dicts.
+    """
+    cols = columns_from_rows(rows) if cols is None else dict(cols)
+    for key, _ in SEQUENCE_ID_FIELDS:
+        cols[key], cols[key + "_ok"] = _ident_column(rows, key)
+    for key, _ in SEQUENCE_COUNTER_FIELDS:
+        cols[key] = _counter_column(rows, key)
+    return cols
+
+
+def _segments(starts):
+    """(start, stop) pairs of the runs delimited by a boolean start mask."""
+    bounds = np.flatnonzero(starts)
+    return bounds, np.append(bounds[1:], len(starts))
+
+
+def _sequence_index_groups(cols):
+    """group_by_sequence on precomputed columns.
+
+    Returns (members, bounds, strategies): group k is members[bounds[k]:bounds[k + 1]]
+    (row indices, capture order), in no particular group order.
+    """
+    n = len(cols["time"])
+    brk = break_mask(cols)
+    taken = np.zeros(n, dtype=bool)
+    found, names = [], []
+
+    for key, name in SEQUENCE_ID_FIELDS:
+        idx = np.flatnonzero(cols[key + "_ok"] & ~taken)
+        if len(idx) < 2:
+            continue
+        _, inv = np.unique(cols[key][idx], return_inverse=True)
+        order = np.argsort(inv, kind="stable")
+        members, bucket = idx[order], inv[order]
+        starts, stops = _segments(np.r_[True, bucket[1:] != bucket[:-1]])
+        # consecutive members of one bucket must not be split by a time / setup break
+        bad = np.r_[0, np.cumsum((bucket[1:] == bucket[:-1]) & pair_breaks(cols, members[:-1], members[1:]))]
+        keep = (stops - starts >= 2) & (stops - starts <= MAX_BRACKET) & (bad[stops - 1] == bad[starts])
+        for st, sp in zip(starts[keep].tolist(), stops[keep].tolist()):
+            found.append(members[st:sp])
+            names.append(name)
+            taken[members[st:sp]] = True
+
+    for key, name in SEQUENCE_COUNTER_FIELDS:
+        c = np.where(taken, np.nan, cols[key])
+        valid = np.isfinite(c)
+        # a run is 1, 2, 3, ... on consecutive frames with no break in between
+        cont = np.zeros(n, dtype=bool)
+        if n > 1:
+            with np.errstate(invalid="ignore"):
+                cont[1:] = valid[1:] & valid[:-1] & (c[1:] == c[:-1] + 1) & ~brk[1:]
+        starts, stops = _segments(~cont)
+        keep = (c[starts] == 1) & (stops - starts >= 2) & (stops - starts <= MAX_BRACKET)
+        for st, sp in zip(starts[keep].tolist(), stops[keep].tolist()):
+            found.append(np.arange(st, sp))
+            names.append(name)
+            taken[st:sp] = True
+
+    sizes = [len(g) for g in found]
+    rest = np.flatnonzero(~taken)
+    if len(rest):
+        order, gid = assign_groups({k: cols[k][rest] for k in ("time", "ev", "shutter", "fnum", "focal")})
+        found.append(rest[order])
+        sizes.extend(np.bincount(gid).tolist())
+        names.extend([TIME_STRATEGY] * (int(gid[-1]) + 1))
+    members = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+    return members, np.r_[0, np.cumsum(sizes, dtype=np.int64)], names
+
+
+def _ordered_indices(times, members, bounds, names):
+    """Index groups -> (order, gid, names), groups ordered by first capture time (stable)."""
+    first = np.argsort(times[members[bounds[:-1]]], kind="stable")
+    rank = np.empty_like(first)
+    rank[first] = np.arange(len(first))
+    gid = rank[np.repeat(np.arange(len(first)), np.diff(bounds))]
+    by_group = np.argsort(gid, kind="stable")
+    return members[by_group], gid[by_group], [names[k] for k in first.tolist()]
+
+
+def _row_groups(rows, order, gid):
+    """(order, gid) -> lists of row dicts."""
+    bounds = (np.flatnonzero(np.diff(gid)) + 1).tolist()
+    order = order.tolist()
+    return [[rows[i] for i in order[a:b]] for a, b in zip([0] + bounds, bounds + [len(order)])]
+
+
+def _ordered_groups(rows, times, members, bounds, names):
+    """Index groups -> row-dict groups, ordered by first capture time (stable)."""
+    order, gid, names = _ordered_indices(times, members, bounds, names)
+    return _row_groups(rows, order, gid), names
+
+
+def group_by_sequence(rows, cols=None):
+    """Group time-sorted make_row dicts, exact where maker notes allow.
+
+    Frames sharing a BurstUUID / BracketSequence, or forming a 1, 2, 3, ...
+    run of BracketShotNumber / SequenceNumber, are grouped directly when the
+    result is a plausible bracket (2..MAX_BRACKET frames, no time or setup
+    break inside). Everything else goes through the time-gap heuristic.
+    Bucketing and run detection are array ops over sequence_columns(rows)
+    (pass them in as `cols` when already built).
+
+    Returns (groups, strategies): groups ordered by first capture time and,
+    per group, the name of the rule that decided it.
+    """
+    if not rows:
+        return [], []
+    cols = sequence_columns(rows) if cols is None else cols
+    return _ordered_groups(rows, cols["time"], *_sequence_index_groups(cols))
+
+
+# === Per-camera partitions ===
+GROUP_WORKERS = int(os.getenv("GROUP_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_MIN_ROWS = int(os.getenv("GROUP_PARALLEL_MIN_ROWS", "20000"))
+
+
+def camera_key(row):
+    return (str(row.get("model")), str(row.get("serial")))
+
+
+def group_by_camera(rows, workers=GROUP_WORKERS, cols=None):
+    """group_by_sequence per (Model, SerialNumber), merged by first capture time.
+
+    Two bodies shooting the same room interleave in time; grouping each body
+    on its own keeps their brackets apart. Columns are built once for the
+    whole catalog (or taken from `cols`, see sequence_columns) and sliced per
+    body; partitions run on a process pool once the catalog is large enough
+    to pay for it.
+    """
+    if not rows:
+        return [], []
+    order, gid, names = camera_index_groups(rows, cols, workers)
+    return _row_groups(rows, order, gid), names
+
+
+def camera_index_groups(rows, cols=None, workers=GROUP_WORKERS):
+    """group_by_camera on row indices, in score_groups / bracket_order layout.
+
+    Returns (order, gid, strategies): `order` lists row indices group by
+    group (groups by first capture time, members in capture order) and
+    `gid[k]` is the group of row `order[k]`. Rows must be time-sorted;
+    `cols`, when given, are typed columns aligned with them.
+    """
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), []
+    cols = sequence_columns(rows, cols)
+    # bodies numbered in order of first appearance, so ties in the merge keep catalog order
+    bodies = {}
+    code = np.fromiter((bodies.setdefault(camera_key(r), len(bodies)) for r in rows), np.int64, len(rows))
+    order = np.argsort(code, kind="stable")
+    starts, stops = _segments(np.r_[True, code[order][1:] != code[order][:-1]])
+    parts = [order[a:b] for a, b in zip(starts.tolist(), stops.tolist())]
+    jobs = [{k: v[p] for k, v in cols.items()} for p in parts] if len(parts) > 1 else [cols]
+
+    if len(parts) > 1 and workers > 1 and len(rows) >= PARALLEL_MIN_ROWS:
+        with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as pool:
+            results = list(pool.map(_sequence_index_groups, jobs))
+    else:
+        results = [_sequence_index_groups(j) for j in jobs]
+
+    members = np.concatenate([p[m] for p, (m, _, _) in zip(parts, results)])
+    offsets = np.cumsum([0] + [len(m) for m, _, _ in results[:-1]])
+    bounds = np.concatenate([b[:-1] + off for (_, b, _), off in zip(results, offsets)] + [[len(members)]])
+    names = [name for _, _, n in results for name in n]
+    return _ordered_indices(cols["time"], members, bounds, names)
+
+
+# === Confidence scoring ===
+AUTO_APPROVE_SCORE = 0.85
+REVIEW_SCORE = 0.65
+HDR_EV_SPAN = 0.6
+FNUM_STD_MAX = 0.1
+FOCAL_STD_MAX = 1.0
+
+
+def _segment_std(values, gid, n_groups):
+    """Sample std (ddof=1) per group ignoring NaN; NaN when fewer than 2 values."""
+    valid = np.isfinite(values)
+    x = np.where(valid, values, 0.0)
+    cnt = np.bincount(gid, weights=valid, minlength=n_groups)
+    total = np.bincount(gid, weights=x, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / cnt
+        dev = np.where(valid, x - mean[gid], 0.0)
+        ss = np.bincount(gid, weights=dev * dev, minlength=n_groups)
+        return np.where(cnt >= 2, np.sqrt(ss / (cnt - 1)), np.nan)
+
+
+def score_groups(cols, order, gid):
+    """Score every group in one pass over the time-sorted rows.
+
+    Same rules and weights as the old per-group scoring: EV span, shot count,
+    time gaps, aperture and focal length spread. Returns a dict of per-group
+    arrays (index = gid).
+    """
+    n_groups = int(gid[-1]) + 1 if len(gid) else 0
+    s = {k: v[order] for k, v in cols.items()}
+    starts = np.flatnonzero(np.r_[True, np.diff(gid) != 0]) if len(gid) else np.zeros(0, dtype=np.int64)
+    shot_count = np.bincount(gid, minlength=n_groups)
+
+    ev = np.round(s["ev"].astype(np.float64), EV_DECIMALS)
+    ev_ok = np.isfinite(ev)
+    ev_cnt = np.bincount(gid, weights=ev_ok, minlength=n_groups)
+    ev_span = np.zeros(n_groups)
+    if n_groups:
+        ev_hi = np.maximum.reduceat(np.where(ev_ok, ev, -np.inf), starts)
+        ev_lo = np.minimum.reduceat(np.where(ev_ok, ev, np.inf), starts)
+        ev_span = np.where(ev_cnt >= 2, np.round(ev_hi - ev_lo, EV_DECIMALS), 0.0)
+
+    gap_bad = np.zeros(n_groups, dtype=bool)
+    if len(gid) > 1:
+        dt = np.round(np.diff(s["time"]), 6)
+        over = (dt > allowed_gaps(s["shutter"][:-1], s["shutter"][1:])) & (gid[1:] == gid[:-1])
+        gap_bad = np.bincount(gid[1:][over], minlength=n_groups) > 0
+    gap_ok = (shot_count > 1) & ~gap_bad
+
+    fnum_std = _segment_std(s["fnum"], gid, n_groups)
+    focal_std = _segment_std(s["focal"], gid, n_groups)
+
+    ev_ok_span = ev_span >= HDR_EV_SPAN
+    count_ok = (shot_count == 3) | (shot_count == 5)
+    out_of_range = (shot_count < 2) | (shot_count > 7)
+    with np.errstate(invalid="ignore"):
+        same_aperture = fnum_std < FNUM_STD_MAX
+        same_focal = focal_std < FOCAL_STD_MAX
+
+    # Accumulate in the same order as the old scalar code so rounding matches.
+    score = np.zeros(n_groups)
+    score = score + np.where(ev_ok_span, 0.35, 0.0)
+    score = score + np.where(count_ok, 0.25, 0.0)
+    score = score - np.where(out_of_range, 0.20, 0.0)
+    score = score + np.where(gap_ok, 0.20, 0.0)
+    score = score + np.where(same_aperture, 0.10, 0.0)
+    score = score + np.where(same_focal, 0.10, 0.0)
+    score = np.clip(score, 0.0, 1.0)
+
+    return {
+        "score": score,
+        "shot_count": shot_count,
+        "ev_span": ev_span,
+        "gap_ok": gap_ok,
+        "fnum_std": fnum_std,
+        "focal_std": focal_std,
+        "is_hdr_candidate": ev_ok_span,
+        "count_ok": count_ok,
+        "out_of_range": out_of_range,
+        "same_aperture": same_aperture,
+        "same_focal": same_focal,
+    }
+
+
+def confidence_records(scores):
+    """Per-group confidence dicts in the _confidence.json layout."""
+    records = []
+    for g in range(len(scores["score"])):
+        reasons = []
+        if scores["is_hdr_candidate"][g]:
+            reasons.append("ev_range_ok")
+        if scores["count_ok"][g]:
+            reasons.append(f"shot_count_{int(scores['shot_count'][g])}")
+        if scores["out_of_range"][g]:
+            reasons.append("shot_count_out_of_range")
+        if scores["gap_ok"][g]:
+            reasons.append("time_gap_ok")
+        if scores["same_aperture"][g]:
+            reasons.append("same_aperture")
+        if scores["same_focal"][g]:
+            reasons.append("same_focal_length")
+        score = float(scores["score"][g])
+        records.append({
+            "confidence_score": round(score, 3),
+            "auto_approved": score >= AUTO_APPROVE_SCORE,
+            "needs_review": REVIEW_SCORE <= score < AUTO_APPROVE_SCORE,
+            "auto_hold": score < REVIEW_SCORE,
+            "is_hdr_candidate": bool(scores["is_hdr_candidate"][g]),
+            "reason": reasons,
+        })
+    return records
+
+
+def bracket_order(cols, order, gid):
+    """Within each group order members by EV, else shutter, else time.
+
+    Groups with any EV sort by EV (missing last); otherwise by shutter when any
+    is known; otherwise they keep capture order. Returns row indices.
+    """
+    s = {k: v[order] for k, v in cols.items()}
+    n_groups = int(gid[-1]) + 1 if len(gid) else 0
+    has_ev = np.bincount(gid, weights=np.isfinite(s["ev"]), minlength=n_groups) > 0
+    has_sh = np.bincount(gid, weights=np.isfinite(s["shutter"]), minlength=n_groups) > 0
+    pos = np.arange(len(order), dtype=np.float64)
+    key = np.where(has_ev[gid], s["ev"], np.where(has_sh[gid], s["shutter"], pos))
+    key = np.where(np.isnan(key), np.inf, key)
+    return order[np.lexsort((pos, key, gid))]
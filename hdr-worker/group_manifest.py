@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consolidated grouping manifest.
+
+One record per group: its name, ordered members (darkest to brightest),
+exposure values and confidence score. Written as JSON Lines (default) or
+Parquet (one row per member, needs pyarrow). Later stages read source files
+in place from the manifest instead of from per-group folders.
+
+    python3 group_manifest.py list <manifest>   # "<group>\t<path>" per member
+"""
+
+import json
+import math
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from group_engine import bracket_order, columns_from_rows, confidence_records, exposure_values, score_groups
+
+MANIFEST_NAME = "_groups.jsonl"
+MEMBER_FIELDS = ("path", "time", "ev", "shutter", "iso", "fnum", "focal", "model", "serial")
+
+
+def _plain(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, (np.floating, float)):
+        v = float(v)
+        return None if math.isnan(v) else v
+    if isinstance(v, np.integer):
+        return int(v)
+    if isinstance(v, np.bool_):
+        return bool(v)
+    return v
+
+
+def group_arrays(groups):
+    """Flatten grouped rows into (rows, cols, order, gid) for group_engine's segment ops."""
+    flat = [r for g in groups for r in g]
+    cols = columns_from_rows(flat)
+    order = np.arange(len(flat))
+    gid = np.repeat(np.arange(len(groups)), [len(g) for g in groups])
+    return flat, cols, order, gid
+
+
+def build_manifest(groups, names, strategies=None):
+    """Manifest records for `groups` (lists of make_row dicts, any member order).
+
+    `strategies` (optional, one per group) records which rule formed the group.
+    """
+    if not groups:
+        return []
+    groups = [sorted(g, key=lambda r: r["time"]) for g in groups]
+    flat, cols, order, gid = group_arrays(groups)
+    confidences = confidence_records(score_groups(cols, order, gid))
+    exposure = exposure_values(cols["ev"], cols["shutter"])
+    members = bracket_order(cols, order, gid)
+
+    records = []
+    pos = 0
+    for i, (g, name) in enumerate(zip(groups, names)):
+        idx = members[pos:pos + len(g)]
+        pos += len(g)
+        ms = []
+        for k in idx:
+            r = flat[k]
+            m = {f: _plain(r.get(f)) for f in MEMBER_FIELDS if f in r}
+            m["exposure"] = _plain(exposure[k])
+            ms.append(m)
+        records.append({
+            "group_id": i + 1,
+            "name": name,
+            "start_time": _plain(g[0]["time"]),
+            "count": len(g),
+            "members": ms,
+            "exposures": [m["exposure"] for m in ms],
+            "confidence": confidences[i],
+        })
+        if strategies is not None:
+            records[-1]["strategy"] = strategies[i]
+    return records
+
+
+def write_manifest(path, records):
+    if str(path).endswith(".parquet"):
+        return _write_parquet(path, records)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+    return path
+
+
+def _write_parquet(path, records):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet manifest needs pyarrow (pip install pyarrow), or use a .jsonl path")
+    rows = []
+    for rec in records:
+        conf = rec["confidence"]
+        for order, m in enumerate(rec["members"]):
+            rows.append({
+                "group_id": rec["group_id"],
+                "name": rec["name"],
+                "member_order": order,
+                "strategy": rec.get("strategy"),
+                **m,
+                "confidence_score": conf["confidence_score"],
+                "auto_approved": conf["auto_approved"],
+                "needs_review": conf["needs_review"],
+                "auto_hold": conf["auto_hold"],
+                "is_hdr_candidate": conf["is_hdr_candidate"],
+            })
+    pq.write_table(pa.Table.from_pylist(rows), path)
+    return path
+
+
+def read_manifest(path):
+    """Load manifest records (JSON Lines or Parquet) back into per-group dicts."""
+    if str(path).endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        records = {}
+        for row in pq.read_table(path).to_pylist():
+            rec = records.setdefault(row["group_id"], {
+                "group_id": row["group_id"],
+                "name": row["name"],
+                "members": [],
+                "strategy": row.get("strategy"),
+                "confidence": {k: row[k] for k in (
+                    "confidence_score", "auto_approved", "needs_review", "auto_hold", "is_hdr_candidate",
+                )},
+            })
+            rec["members"].append(row)
+        out = []
+        for rec in records.values():
+            rec["members"].sort(key=lambda m: m["member_order"])
+            rec["count"] = len(rec["members"])
+            rec["exposures"] = [m.get("exposure") for m in rec["members"]]
+            out.append(rec)
+        return out
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] != "list":
+        print("Usage: python3 group_manifest.py list <manifest>")
+        return 1
+    for rec in read_manifest(argv[1]):
+        for m in rec["members"]:
+            print(f"{rec['name']}\t{m['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
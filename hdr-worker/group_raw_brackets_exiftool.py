@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, sys, json, shutil, re, argparse, subprocess, csv, math
+import os, sys, shutil, argparse
 from datetime import datetime
-import pandas as pd
+
+from exif_columns import NUMERIC_ARG, parse_record, read_columns, record_time
+from exif_header import DEFAULT_READER, READERS, read_exif_records
+from group_engine import group_by_camera
+from materialize import DEFAULT_LINK_MODE, LINK_MODES, materialize
+from group_manifest import MANIFEST_NAME, build_manifest, write_manifest
+from metadata_store import MetadataStore, regroup_tail
+from phash_validate import validate_groups
 
 RAW_EXTS = {
     ".arw", ".cr2", ".cr3", ".nef", ".dng", ".rw2", ".orf", ".raf",
@@ -11,6 +18,7 @@ RAW_EXTS = {
 }
 
 EXIF_FIELDS = [
+    NUMERIC_ARG,
     "-DateTimeOriginal",
     "-CreateDate",
     "-SubSecDateTimeOriginal",
@@ -43,57 +51,22 @@ def list_files(folder):
         if os.path.splitext(f)[1].lower() in RAW_EXTS
     )
 
-def run_exiftool_json(files):
-    cmd = ["exiftool", "-json"] + EXIF_FIELDS + files
-    out = subprocess.check_output(cmd)
-    return json.loads(out)
+def run_exiftool_json(files, reader=DEFAULT_READER):
+    # 默认先用纯 Python 读文件头（线程池，不起子进程），CR3 等读不了的
+    # 再交给常驻 exiftool 进程 + argfile 分批
+    return read_exif_records(files, EXIF_FIELDS, reader=reader)
 
 def parse_time(rec):
-    for k in ("SubSecDateTimeOriginal", "DateTimeOriginal", "CreateDate"):
-        v = rec.get(k)
-        if not v:
-            continue
-        s = str(v).strip()
-        for fmt in ("%Y:%m:%d %H:%M:%S.%f", "%Y:%m:%d %H:%M:%S"):
-            try:
-                return datetime.strptime(s, fmt)
-            except Exception:
-                pass
-    return None
-
-_num_re = re.compile(r"[-+]?\d+(?:\.\d+)?")
-
-def parse_num(v):
-    if v is None:
+    # 固定格式切片解析 "YYYY:MM:DD HH:MM:SS[.fff]"，不再逐个 strptime 试格式
+    parts = record_time(rec)
+    try:
+        return datetime(*parts) if parts else None
+    except ValueError:
         return None
-    s = str(v).strip()
-    if "/" in s:
-        try:
-            a, b = s.split("/", 1)
-            return float(a) / float(b)
-        except Exception:
-            return None
-    m = _num_re.search(s.replace("+", ""))
-    return float(m.group(0)) if m else None
 
 def ensure_dir(p):
     os.makedirs(p, exist_ok=True)
 
-def safe_copy(src, dst_folder):
-    ensure_dir(dst_folder)
-    base = os.path.basename(src)
-    dst = os.path.join(dst_folder, base)
-    if os.path.exists(dst):
-        name, ext = os.path.splitext(base)
-        i = 1
-        while True:
-            cand = os.path.join(dst_folder, f"{name}_{i}{ext}")
-            if not os.path.exists(cand):
-                dst = cand
-                break
-            i += 1
-    shutil.copy2(src, dst)
-
 def aspect_ratio(w, h):
     try:
         return float(w) / float(h)
@@ -107,220 +80,85 @@ def ratio_close(a, b, tol):
     return a is None or b is None or min(a, b) == 0 or max(a, b) / min(a, b) <= tol
 
 def make_row(r):
-    dt = parse_time(r)
-    if not dt:
-        return None
-    return {
-        "path": os.path.join(r.get("Directory",""), r.get("FileName","")),
-        "time": dt,
-        "ev": parse_num(r.get("ExposureBiasValue") or r.get("ExposureCompensation")),
-        "shutter": parse_num(r.get("ExposureTime") or r.get("ShutterSpeed")),
-        "iso": parse_num(r.get("ISO")),
-        "fnum": parse_num(r.get("FNumber") or r.get("Aperture")),
-        "focal": parse_num(r.get("FocalLength")),
-        "width": parse_num(r.get("ImageWidth")),
-        "height": parse_num(r.get("ImageHeight")),
-        "orientation": str(r.get("Orientation")),
-        "model": str(r.get("Model")),
-        "serial": str(r.get("SerialNumber")),
-        "seq": parse_num(r.get("SequenceNumber")),
-        "burst": str(r.get("BurstUUID")),
-        "bracket_seq": str(r.get("BracketSequence")),
-        "bracket_shot": str(r.get("BracketShotNumber")),
-    }
-
-def ev_range(gdf):
-    evs = gdf["ev"].dropna()
-    if len(evs) < 2:
-        return 0.0
-    try:
-        return float(evs.max() - evs.min())
-    except Exception:
-        return 0.0
-
-def shutter_ratio(a, b):
-    if a is None or b is None:
-        return 1.0
-    try:
-        if pd.isna(a) or pd.isna(b):
-            return 1.0
-        a = float(a)
-        b = float(b)
-        if a == 0 or b == 0:
-            return 1.0
-        return max(a, b) / min(a, b)
-    except Exception:
-        return 1.0
-
-def safe_num(v, default=0.0):
-    if v is None:
-        return default
-    try:
-        if pd.isna(v):
-            return default
-    except Exception:
-        pass
-    try:
-        return float(v)
-    except Exception:
-        return default
-
-def group_rows(rows, args):
-    df = pd.DataFrame(rows).sort_values("time").reset_index(drop=True)
-    if df.empty:
-        return []
-
-    TIME_GAP_SEC = 3.0
-    BASE_GAP_SEC = 1.2
-    EXP_GAP_FACTOR = 2.5
-
-    def allowed_gap_sec(a, b):
-        exp_a = safe_num(a.get("shutter"), 0.0)
-        exp_b = safe_num(b.get("shutter"), 0.0)
-        max_exp = max(exp_a, exp_b)
-        dynamic = BASE_GAP_SEC + (EXP_GAP_FACTOR * max_exp)
-        return max(TIME_GAP_SEC, dynamic)
-
-    def same_setup(a, b):
-        if a.get("fnum") and b.get("fnum") and abs(a["fnum"] - b["fnum"]) > 0.2:
-            return False
-        if a.get("focal") and b.get("focal") and abs(a["focal"] - b["focal"]) > 2.0:
-            return False
-        return True
-
-    def exposure_value(item):
-        if item.get("ev") is not None:
-            return safe_num(item.get("ev"), None)
-        shutter = safe_num(item.get("shutter"), None)
-        if shutter is not None and shutter > 0:
-            return float(math.log2(shutter))
-        return None
-
-    def split_exposure_cluster(cluster):
-        if len(cluster) <= 1:
-            return [cluster]
-        if len(cluster) <= 7:
-            return [cluster]
-        ordered = sorted(cluster, key=lambda x: x["time"])
-        groups = []
-        current = []
-        direction = 0
-        start_exp = None
-        min_exp = None
-        max_exp = None
-
-        def push_current():
-            nonlocal current, direction, start_exp, min_exp, max_exp
-            if current:
-                groups.append(current)
-            current = []
-            direction = 0
-            start_exp = None
-            min_exp = None
-            max_exp = None
-
-        def update_range(exp):
-            nonlocal min_exp, max_exp
-            if exp is None:
-                return
-            if min_exp is None or exp < min_exp:
-                min_exp = exp
-            if max_exp is None or exp > max_exp:
-                max_exp = exp
-
-        for item in ordered:
-            if not current:
-                current = [item]
-                exp = exposure_value(item)
-                start_exp = exp
-                update_range(exp)
-                continue
-
-            prev = current[-1]
-            dt = (item["time"] - prev["time"]).total_seconds()
-            if dt > allowed_gap_sec(prev, item) or not same_setup(prev, item):
-                push_current()
-                current = [item]
-                exp = exposure_value(item)
-                start_exp = exp
-                update_range(exp)
-                continue
-
-            if len(current) >= 7:
-                push_current()
-                current = [item]
-                exp = exposure_value(item)
-                start_exp = exp
-                update_range(exp)
-                continue
-
-            exp = exposure_value(item)
-            prev_exp = exposure_value(prev)
-            if exp is not None and prev_exp is not None:
-                delta = exp - prev_exp
-                if direction == 0 and abs(delta) >= 0.4:
-                    direction = 1 if delta > 0 else -1
-
-                exp_range = 0.0
-                if min_exp is not None and max_exp is not None:
-                    exp_range = max_exp - min_exp
-
-                sign_flip = direction != 0 and ((direction > 0 and delta < -0.6) or (direction < 0 and delta > 0.6))
-                back_to_start = start_exp is not None and abs(exp - start_exp) <= 0.4
-
-                if len(current) >= 2 and sign_flip and (back_to_start or exp_range >= 0.6):
-                    push_current()
-                    current = [item]
-                    start_exp = exp
-                    update_range(exp)
-                    continue
-
-            current.append(item)
-            update_range(exp)
-
-        if current:
-            groups.append(current)
-        return groups
-
-    time_groups = []
-    cur = []
-    for _, row in df.iterrows():
-        if not cur:
-            cur = [row.to_dict()]
-            continue
-        prev = cur[-1]
-        dt = (row["time"] - prev["time"]).total_seconds()
-        if dt <= allowed_gap_sec(prev, row) and same_setup(prev, row):
-            cur.append(row.to_dict())
-        else:
-            time_groups.append(cur)
-            cur = [row.to_dict()]
-    if cur:
-        time_groups.append(cur)
-
-    groups = []
-    for cluster in time_groups:
-        groups.extend(split_exposure_cluster(cluster))
-
-    return groups
+    # exiftool -n 输出的数值直接转 float，一条记录只解析一遍
+    return parse_record(r)[0]
+
+def read_rows(meta):
+    # 一遍解析出行 + float64 类型化列（时间戳、EV、快门、光圈、焦距），都按拍摄时间排好序；
+    # 分组直接用这份列，不再从行字典里的 datetime 重建
+    return read_columns(meta, by_time=True)
+
+def group_rows(rows, args, cols=None):
+    # 先按机身 (Model, SerialNumber) 拆开，多机身交错拍摄互不干扰，各机身并行分组；
+    # 有机身序号字段（BurstUUID / BracketSequence / BracketShotNumber / SequenceNumber）
+    # 且前后一致的直接按序号分组；剩下的才走列式 NumPy 时间差 / 动态间隔分组。
+    # rows 要按时间排好序；cols 是 read_rows 给的同序列（可省略）。
+    # 返回 (groups, strategies)，strategies 记录每组是哪条规则定的
+    return group_by_camera(rows, cols=cols)
 
 # === 主函数 ===
 def main(inp, out, args):
     files = list_files(inp)
-    meta = run_exiftool_json(files)
 
-    rows = [make_row(r) for r in meta if make_row(r)]
-    rows = sorted(rows, key=lambda x: x["time"])
-
-    groups = group_rows(rows, args)
+    if args.store:
+        # 增量模式：只对新增/改动的文件跑 exiftool，只重分时间轴尾部受影响的部分，
+        # 没变的组保留原来的组号
+        with MetadataStore(args.store) as store:
+            meta, dirty = store.scan(files, EXIF_FIELDS, reader=args.reader)
+            rows, cols = read_rows(meta)
+            dirty_times = [t for t in map(parse_time, dirty) if t]
+            groups, ids, next_id, strategies = regroup_tail(
+                rows,
+                min(dirty_times) if dirty_times else None,
+                store.previous_groups(),
+                store.next_group_id(),
+                store.previous_strategies(),
+                cols=cols,
+            )
+            assignment = {r["path"]: gid for g, gid in zip(groups, ids) for r in g}
+            store.save_groups(
+                assignment, next_id, {os.path.dirname(p) for p in files}, dict(zip(ids, strategies))
+            )
+    else:
+        meta = run_exiftool_json(files, args.reader)
+        rows, cols = read_rows(meta)
+        groups, strategies = group_rows(rows, args, cols)
+        if args.phash:
+            # 可选：用内嵌缩略图的 dHash 复核，内容明显不同的拆开、同一场景被时间切断的合并
+            groups, strategies = validate_groups(groups, strategies)
+        ids = range(1, len(groups) + 1)
 
     ensure_dir(out)
-    for i, g in enumerate(groups, 1):
+    names = []
+    for i, g in zip(ids, groups):
         ts = g[0]["time"].strftime("%Y%m%d_%H%M%S")
-        folder = os.path.join(out, f"group_{i:04d}_{ts}_{len(g)}files")
+        names.append(f"group_{i:04d}_{ts}_{len(g)}files")
+
+    # 汇总清单：组、组内顺序、曝光值和置信度，一个文件
+    manifest_path = args.manifest or os.path.join(out, MANIFEST_NAME)
+    write_manifest(manifest_path, build_manifest(groups, names, strategies))
+
+    if args.manifest_only:
+        # 只写清单，不建组目录；下游直接按清单读取原始文件
+        print(f"Done. Groups: {len(groups)}. Manifest: {manifest_path}")
+        return
+
+    if args.store:
+        # 组号不变的组目录名也不变，已存在就跳过；已经不存在的旧组目录清掉
+        current = set(names)
+        for d in os.listdir(out):
+            if d.startswith("group_") and d not in current and os.path.isdir(os.path.join(out, d)):
+                shutil.rmtree(os.path.join(out, d))
+
+    jobs = []
+    for name, g in zip(names, groups):
+        folder = os.path.join(out, name)
+        if args.store and os.path.isdir(folder):
+            continue
         ensure_dir(folder)
-        for r in g:
-            safe_copy(r["path"], folder)
+        jobs.extend((r["path"], folder) for r in g)
+    # 同一文件系统优先硬链接/reflink，只有跨盘才真正复制（多线程）
+    materialize(jobs, mode=args.link)
 
     print(f"Done. Groups: {len(groups)}")
 
@@ -336,5 +174,18 @@ if __name__ == "__main__":
     ap.add_argument("--iso_ratio", type=float, default=2.2)
     ap.add_argument("--focal_tol", type=float, default=6.0)
     ap.add_argument("--score_thr", type=int, default=6)
+    ap.add_argument("--link", choices=LINK_MODES, default=DEFAULT_LINK_MODE)
+    ap.add_argument("--manifest", default=None, help=f"manifest path (.jsonl or .parquet), default <out>/{MANIFEST_NAME}")
+    ap.add_argument("--manifest-only", action="store_true", help="write the manifest only, no group folders")
+    ap.add_argument("--reader", choices=READERS, default=DEFAULT_READER, help="native header reader with exiftool fallback, or exiftool only")
+    ap.add_argument("--phash", action="store_true", default=None,
+                    help="check groups against embedded thumbnails (split/merge by perceptual hash; not with --store)")
+    ap.add_argument("--store", default=None, help="SQLite metadata store for incremental reruns")
     args = ap.parse_args()
+    if args.phash and args.store:
+        # 增量模式下组号要跨次保持稳定，拆分/合并会打乱；明确报错，不再悄悄忽略
+        ap.error("--phash cannot be combined with --store")
+    if args.phash is None:
+        # 环境变量 GROUP_PHASH=1 只对完整分组生效
+        args.phash = os.getenv("GROUP_PHASH") == "1" and not args.store
     sys.exit(main(args.input_folder, args.output_folder, args))
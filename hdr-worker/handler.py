@@ -1,12 +1,20 @@
 
 import os
 import json
-import subprocess
+import time
+import fnmatch
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from boto3.s3.transfer import TransferConfig
 import requests
 import runpod
 
+import hdr_pipeline
+from hdr_stream import STREAM_MAX_FRAMES, HdrStream
+from materialize import resolve_names
+from object_cache import CACHE_MAX_BYTES, ObjectCache
+
 # Environment Variables
 R2_ENDPOINT = os.getenv("R2_ENDPOINT")
 R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
@@ -14,6 +22,19 @@ R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 R2_RAW_BUCKET = os.getenv("R2_RAW_BUCKET", "mvai-raw")
 R2_OUT_BUCKET = os.getenv("R2_OUT_BUCKET", "mvai-hdr")
 
+# Transfer tuning
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+MULTIPART_THRESHOLD = int(os.getenv("MULTIPART_THRESHOLD_MB", "16")) * 1024 * 1024
+MULTIPART_CHUNKSIZE = int(os.getenv("MULTIPART_CHUNKSIZE_MB", "8")) * 1024 * 1024
+TRANSFER_CONCURRENCY = int(os.getenv("TRANSFER_CONCURRENCY", "4"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "4"))
+# Final artifacts only (relative to output_dir); intermediates such as
+# RAW_GROUPED/*/aligned/aligned_*.tif are never uploaded
+UPLOAD_ALLOW = [p.strip() for p in os.getenv(
+    "UPLOAD_ALLOW", "HDR_FINAL/*.jpg,HDR_FINAL/*.jpeg,HDR_FINAL/*.tif"
+).split(",") if p.strip()]
+
 # Boto3 Client
 s3 = boto3.client(
     "s3",
@@ -22,12 +43,38 @@ s3 = boto3.client(
     aws_secret_access_key=R2_SECRET_ACCESS_KEY,
 )
 
-def download_files(files, input_dir):
-    """
-    Download files from R2 to input_dir.
-    'files' is a list of dicts: { "r2_key": "...", "r2_bucket": "..." }
-    """
-    print(f"📥 Downloading {len(files)} files...")
+# Large objects are fetched as parallel ranged GETs (multipart on upload)
+transfer_config = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=TRANSFER_CONCURRENCY,
+)
+
+# Source frames stay on local disk between jobs while the pod is warm,
+# keyed by (bucket, key, ETag) and revalidated per job (see object_cache.py)
+object_cache = ObjectCache(s3, transfer_config=transfer_config) if CACHE_MAX_BYTES > 0 else None
+
+def _download_one(bucket, key, dst):
+    """Download one object with retries; a failed attempt never leaves a partial file."""
+    for attempt in range(1, DOWNLOAD_RETRIES + 1):
+        try:
+            if object_cache:
+                object_cache.fetch(bucket, key, dst)
+            else:
+                s3.download_file(bucket, key, dst, Config=transfer_config)
+            return dst
+        except Exception as e:
+            if os.path.exists(dst):
+                os.remove(dst)
+            if attempt == DOWNLOAD_RETRIES:
+                print(f"❌ Failed to download {key}: {e}")
+                raise
+            print(f"⚠️ Download of {key} failed (attempt {attempt}/{DOWNLOAD_RETRIES}): {e}")
+            time.sleep(2 ** (attempt - 1))
+
+def _plan_downloads(files, input_dir):
+    """[(bucket, key, dst)]: keys from the job input, de-duplicated local names."""
+    jobs = []
     for f in files:
         key = f.get("r2_key") or f.get("r2_key_raw")
         bucket = f.get("r2_bucket") or R2_RAW_BUCKET
@@ -35,17 +82,40 @@ def download_files(files, input_dir):
         if not key:
             print("⚠️ Skipping file with no key:", f)
             continue
-            
-        print(f"   Downloading s3://{bucket}/{key}")
-        # Preserve filename from key
-        filename = os.path.basename(key)
-        dst = os.path.join(input_dir, filename)
-        
-        try:
-            s3.download_file(bucket, key, dst)
-        except Exception as e:
-            print(f"❌ Failed to download {key}: {e}")
-            raise e
+        jobs.append((bucket, key))
+
+    # Preserve filename from key, de-duplicated within input_dir
+    planned = resolve_names([(key, input_dir) for _, key in jobs])
+    return [(bucket, key, dst) for (bucket, key), (_, dst) in zip(jobs, planned)]
+
+def _run_downloads(planned):
+    with ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_WORKERS)) as pool:
+        futures = {}
+        for bucket, key, dst in planned:
+            print(f"   Downloading s3://{bucket}/{key}")
+            futures[pool.submit(_download_one, bucket, key, dst)] = key
+        for fut in as_completed(futures):
+            # re-raises the first failure after its retries are exhausted
+            yield fut.result()
+
+def iter_downloads(files, input_dir):
+    """
+    Download files from R2 to input_dir, yielding each local path as soon
+    as it is complete (completion order).
+    'files' is a list of dicts: { "r2_key": "...", "r2_bucket": "..." }
+    Downloads run in parallel (DOWNLOAD_WORKERS); two keys with the same
+    basename get distinct local names (IMG_1.ARW, IMG_1_1.ARW, ...).
+    """
+    print(f"📥 Downloading {len(files)} files...")
+    yield from _run_downloads(_plan_downloads(files, input_dir))
+
+def download_files(files, input_dir):
+    """Download everything (see iter_downloads); returns the local paths in input order."""
+    print(f"📥 Downloading {len(files)} files...")
+    planned = _plan_downloads(files, input_dir)
+    for _ in _run_downloads(planned):
+        pass
+    return [dst for _, _, dst in planned]
 
 def upload_file(local_path, r2_key):
     """
@@ -53,12 +123,102 @@ def upload_file(local_path, r2_key):
     """
     print(f"📤 Uploading {local_path} to s3://{R2_OUT_BUCKET}/{r2_key}")
     try:
-        s3.upload_file(local_path, R2_OUT_BUCKET, r2_key)
+        s3.upload_file(local_path, R2_OUT_BUCKET, r2_key, Config=transfer_config)
         return r2_key
     except Exception as e:
         print(f"❌ Failed to upload {r2_key}: {e}")
         raise e
 
+def _upload_allowed(rel):
+    return any(fnmatch.fnmatch(rel.lower(), pat.lower()) for pat in UPLOAD_ALLOW)
+
+def collect_results(output_dir):
+    """Final artifacts under output_dir matching UPLOAD_ALLOW, sorted by path."""
+    found = []
+    for root, _, out_files in os.walk(output_dir):
+        for name in out_files:
+            rel = os.path.relpath(os.path.join(root, name), output_dir).replace(os.sep, "/")
+            if name.startswith("aligned_"):
+                continue
+            if _upload_allowed(rel):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+def upload_results(paths, key_prefix):
+    """
+    Upload result files concurrently (multipart above MULTIPART_THRESHOLD).
+    Returns the R2 keys in the order of `paths`.
+    """
+    keys = [f"{key_prefix}/{os.path.basename(p)}" for p in paths]
+    with ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS)) as pool:
+        futures = {pool.submit(upload_file, p, k): k for p, k in zip(paths, keys)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            fut.result()
+            print(f"   ✅ [{done}/{len(keys)}] {futures[fut]}")
+    return keys
+
+def process_batch(files, input_dir, output_dir, key_prefix):
+    """
+    Download everything, run hdr_pipeline (one process per group, hard
+    per-group timeout), then upload the final artifacts.
+    Returns (per-group statuses, uploaded R2 keys).
+    """
+    download_files(files, input_dir)
+
+    print("⚙️ Running HDR pipeline...")
+    try:
+        statuses = hdr_pipeline.run(input_dir, output_dir)
+    except Exception as e:
+        print(f"❌ Processing failed: {e}")
+        raise RuntimeError(f"HDR pipeline failed: {e}") from e
+
+    # Only final artifacts (HDR_FINAL/*.jpg by default, see UPLOAD_ALLOW)
+    results = collect_results(output_dir)
+    print(f"📤 Uploading {len(results)} results...")
+    try:
+        return statuses, upload_results(results, key_prefix)
+    except Exception as e:
+        raise RuntimeError(f"Upload failed: {e}") from e
+
+def process_streaming(files, input_dir, output_dir, key_prefix):
+    """
+    Pipelined job with one concurrency limit per phase:
+    - downloads (DOWNLOAD_WORKERS): each finished file goes straight to
+    - CPU stages (HDR_CPU_WORKERS, see hdr_stream.py): preview extraction and
+      decode per frame, then grouping + alignment + fusion once the last
+      frame is in
+    - uploads (UPLOAD_WORKERS): each group's JPEG starts uploading as soon
+      as it is written
+    Returns (per-group statuses, uploaded R2 keys in group order).
+    """
+    uploads = {}
+    with ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS)) as upload_pool:
+        def on_result(res):
+            out = res.get("output")
+            if not out or not _upload_allowed(os.path.relpath(out, output_dir).replace(os.sep, "/")):
+                return
+            uploads[res["group"]] = upload_pool.submit(upload_file, out, f"{key_prefix}/{os.path.basename(out)}")
+
+        with HdrStream(output_dir, on_result=on_result) as stream:
+            for path in iter_downloads(files, input_dir):
+                stream.add(path)
+            print("⚙️ All frames in, fusing...")
+            try:
+                statuses = stream.finish()
+            except Exception as e:
+                print(f"❌ Processing failed: {e}")
+                raise RuntimeError(f"HDR pipeline failed: {e}") from e
+
+        keys = []
+        try:
+            for res in statuses:
+                if res["group"] in uploads:
+                    keys.append(uploads[res["group"]].result())
+                    print(f"   ✅ [{len(keys)}/{len(uploads)}] {keys[-1]}")
+        except Exception as e:
+            raise RuntimeError(f"Upload failed: {e}") from e
+    return statuses, keys
+
 def handler(job):
     """
     Main RunPod Handler
@@ -92,41 +252,24 @@ def handler(job):
         os.makedirs(input_dir, exist_ok=True)
         os.makedirs(output_dir, exist_ok=True)
 
-        # 1. Download
+        # 1-3. Download -> Process (HDR) -> Upload
+        # Up to HDR_STREAM_MAX_FRAMES files the phases overlap (see
+        # process_streaming); bigger jobs run them one after the other on
+        # hdr_pipeline's isolated group processes. Either way one failed
+        # bracket does not fail the others; per-group status is in
+        # output_dir/_hdr_status.json.
+        # R2 Key: jobs/{jobId}/hdr/{groupId}/{name}
+        key_prefix = f"jobs/{job_id}/hdr/{group_id}"
+        run_job = process_streaming if len(files) <= STREAM_MAX_FRAMES else process_batch
         try:
-            download_files(files, input_dir)
+            statuses, uploaded_results = run_job(files, input_dir, output_dir, key_prefix)
         except Exception as e:
             return _send_error(callback_url, job_id, group_id, str(e))
-
-        # 2. Process (HDR)
-        # We assume the shell script aligns and merges ALL files in input_dir 
-        # into a single output or multiple outputs in output_dir.
-        # For a single group, we expect ONE main HDR output usually.
-        script_path = "/app/one_click_group_align_hdr.sh"
-        if not os.path.exists(script_path):
-             return _send_error(callback_url, job_id, group_id, "Worker script not found")
-
-        print("⚙️ Executing HDR script...")
-        try:
-            subprocess.check_call([script_path, input_dir, output_dir])
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Processing failed: {e}")
-            return _send_error(callback_url, job_id, group_id, f"HDR script failed: {e}")
-
-        # 3. Upload Results
-        # Find the JPG result. 
-        # We expect the script to produce something like `result.jpg` or `input_name_hdr.jpg`.
-        # We will upload ALL jpgs found in output_dir.
-        
-        uploaded_results = []
-        for root, _, out_files in os.walk(output_dir):
-            for name in out_files:
-                if name.lower().endswith('.jpg') or name.lower().endswith('.jpeg') or name.lower().endswith('.tif'):
-                    local_path = os.path.join(root, name)
-                    # Construct R2 Key: jobs/{jobId}/hdr/{groupId}/{name}
-                    target_key = f"jobs/{job_id}/hdr/{group_id}/{name}"
-                    upload_file(local_path, target_key)
-                    uploaded_results.append(target_key)
+        if object_cache:
+            print(f"🗄️ Object cache: {object_cache.stats()}")
+        failed = [s for s in statuses if s["status"] not in ("ok", "single")]
+        if failed and len(failed) == len(statuses):
+            return _send_error(callback_url, job_id, group_id, f"HDR failed: {failed[0].get('error')}")
 
         if not uploaded_results:
              return _send_error(callback_url, job_id, group_id, "No HDR output produced")
@@ -152,6 +295,9 @@ def handler(job):
             except Exception as e:
                 print(f"⚠️ Callback failed: {e}")
 
+        if object_cache:
+            # worker output only; the callback payload is unchanged
+            return dict(payload, cache=object_cache.stats())
         return payload
 
 def _send_error(url, job_id, group_id, error_msg):
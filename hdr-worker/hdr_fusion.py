@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process exposure fusion on float32 NumPy arrays.
+
+Replaces `magick aligned_*.tif -evaluate-sequence mean -contrast-stretch
+0.5%x0.5%` with two methods:
+- mean     plain per-pixel average of the stack (what the shell script did);
+           the default, so the delivered look is unchanged
+- mertens  Mertens et al. exposure fusion (opt-in, HDR_FUSION=mertens):
+           per-pixel weights from contrast (|Laplacian| of grey), saturation
+           (std of RGB) and well-exposedness (Gaussian around mid grey),
+           blended through Laplacian / Gaussian pyramids so weight changes
+           leave no halos; ~15x the cost of mean (about 25 s for 3 x 12 MP),
+           so large groups need a longer HDR_GROUP_TIMEOUT
+
+followed by a percentile tone stretch (0.5% / 99.5% by default) whose
+black and white points are taken from a subsample of the fused image.
+
+The stack is processed in overlapping tiles: each tile is fused with a
+context margin and cross-faded into the output over the overlap, so peak
+memory is the uint8 inputs + one uint16 result + a few float32 tiles,
+not N float32 full-size pyramids (~60 MP x 3 x 4 B = 720 MB per frame).
+For mertens every tile uses the whole image's pyramid depth, its context
+starts on the coarsest level's sampling grid and the margin grows with
+that level (4 coarse pixels, 256 px at 7 levels), so the tiled result
+matches fusing the whole image at once.
+
+    python3 hdr_fusion.py out.jpg aligned_0000.tif aligned_0001.tif ... [--method mertens]
+"""
+
+import argparse
+import os
+import sys
+from functools import partial
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:  # only needed to read / write files
+    Image = None
+
+FUSION_METHODS = ("mean", "mertens")
+FUSION_METHOD = os.getenv("HDR_FUSION", "mean")
+TILE = int(os.getenv("HDR_FUSION_TILE", "2048"))
+OVERLAP = int(os.getenv("HDR_FUSION_OVERLAP", "128"))
+PYRAMID_LEVELS = int(os.getenv("HDR_FUSION_LEVELS", "7"))
+STRETCH_LOW_PCT = float(os.getenv("HDR_STRETCH_LOW", "0.5"))
+STRETCH_HIGH_PCT = float(os.getenv("HDR_STRETCH_HIGH", "99.5"))
+STRETCH_SAMPLE_PIXELS = 1_000_000
+JPEG_QUALITY = int(os.getenv("HDR_JPEG_QUALITY", "92"))
+
+# Mertens weight exponents and the well-exposedness width
+W_CONTRAST = 1.0
+W_SATURATION = 1.0
+W_EXPOSURE = 1.0
+EXPOSURE_SIGMA = 0.2
+
+_KERNEL = np.array([1, 4, 6, 4, 1], dtype=np.float32) / 16
+
+
+# === Pyramids ===
+def _blur(a):
+    """Separable 5-tap binomial blur over the first two axes (reflect borders)."""
+    pad = ((2, 2), (2, 2)) + ((0, 0),) * (a.ndim - 2)
+    p = np.pad(a, pad, mode="reflect")
+    k = _KERNEL
+    t = k[0] * p[:-4] + k[1] * p[1:-3] + k[2] * p[2:-2] + k[3] * p[3:-1] + k[4] * p[4:]
+    return k[0] * t[:, :-4] + k[1] * t[:, 1:-3] + k[2] * t[:, 2:-2] + k[3] * t[:, 3:-1] + k[4] * t[:, 4:]
+
+
+def _down(a):
+    """_blur(a)[::2, ::2] without computing the rows / columns that are dropped."""
+    h, w = a.shape[:2]
+    pad = ((2, 2), (2, 2)) + ((0, 0),) * (a.ndim - 2)
+    p = np.pad(a, pad, mode="reflect")
+    k = _KERNEL
+    t = sum(k[i] * p[i:i + h:2] for i in range(5))
+    return sum(k[i] * t[:, i:i + w:2] for i in range(5))
+
+
+def _up(a, shape):
+    out = np.zeros(tuple(shape[:2]) + a.shape[2:], dtype=np.float32)
+    out[::2, ::2] = a
+    return 4 * _blur(out)
+
+
+def _levels(h, w, cap=PYRAMID_LEVELS):
+    # keep the coarsest level at >= 8 px so the reflect padding stays valid
+    n = 1
+    while n < cap and min(h, w) >> n >= 8:
+        n += 1
+    return n
+
+
+def gaussian_pyramid(a, levels):
+    pyr = [a]
+    for _ in range(levels - 1):
+        pyr.append(_down(pyr[-1]))
+    return pyr
+
+
+def laplacian_pyramid(a, levels):
+    g = gaussian_pyramid(a, levels)
+    return [g[i] - _up(g[i + 1], g[i].shape) for i in range(levels - 1)] + [g[-1]]
+
+
+def collapse(pyr):
+    img = pyr[-1]
+    for lap in reversed(pyr[:-1]):
+        img = _up(img, lap.shape) + lap
+    return img
+
+
+# === Fusion of one tile ===
+def mertens_weights(img):
+    """Unnormalised Mertens weight map (h x w) of one float32 RGB image in [0, 1]."""
+    grey = img.mean(axis=2)
+    p = np.pad(grey, 1, mode="edge")
+    contrast = np.abs(4 * grey - p[:-2, 1:-1] - p[2:, 1:-1] - p[1:-1, :-2] - p[1:-1, 2:])
+    saturation = img.std(axis=2)
+    exposed = np.exp(-((img - 0.5) ** 2) / (2 * EXPOSURE_SIGMA ** 2)).prod(axis=2)
+    return (contrast ** W_CONTRAST) * (saturation ** W_SATURATION) * (exposed ** W_EXPOSURE) + 1e-12
+
+
+def fuse_mertens(tiles, levels=None):
+    """Mertens fusion of same-size float32 RGB tiles; returns float32 RGB (unclipped).
+
+    `levels` defaults to the deepest pyramid the tile size allows.
+    """
+    weights = [mertens_weights(t) for t in tiles]
+    total = np.sum(weights, axis=0)
+    levels = levels or _levels(*tiles[0].shape[:2])
+    blended = None
+    for t, w in zip(tiles, weights):
+        gw = gaussian_pyramid(w / total, levels)
+        lp = laplacian_pyramid(t, levels)
+        parts = [l * g[..., None] for l, g in zip(lp, gw)]
+        blended = parts if blended is None else [b + p for b, p in zip(blended, parts)]
+    return collapse(blended)
+
+
+def fuse_mean(tiles):
+    return np.mean(tiles, axis=0, dtype=np.float32)
+
+
+_FUSERS = {"mertens": fuse_mertens, "mean": fuse_mean}
+
+
+# === Tiled driver ===
+def _spans(size, tile, overlap):
+    """(start, stop) of the fewest equal tiles of <= `tile` px overlapping by >= `overlap`."""
+    if size <= tile:
+        return [(0, size)]
+    step = max(1, tile - overlap)
+    n = -(-(size - overlap) // step)
+    length = -(-(size - overlap) // n) + overlap
+    return [(i * (size - length) // (n - 1), i * (size - length) // (n - 1) + length) for i in range(n)]
+
+
+def _ramp(n, width, first):
+    """Cross-fade weights along one axis of a tile: 0 -> 1 over the leading overlap."""
+    r = np.ones(n, dtype=np.float32)
+    if not first and width > 0:
+        w = min(width, n)
+        r[:w] = (np.arange(w, dtype=np.float32) + 0.5) / w
+    return r
+
+
+def fuse_stack(frames, method=FUSION_METHOD, tile=TILE, overlap=OVERLAP):
+    """Fuse same-size uint8 (or float in [0, 1]) H x W x 3 frames; returns uint16 H x W x 3."""
+    if method not in _FUSERS:
+        raise ValueError(f"unknown fusion method {method!r} (expected one of {FUSION_METHODS})")
+    if not frames:
+        raise ValueError("no frames to fuse")
+    h, w = frames[0].shape[:2]
+    for f in frames:
+        if f.shape[:2] != (h, w):
+            raise ValueError(f"frame sizes differ: {f.shape[:2]} vs {(h, w)}")
+    fuser = _FUSERS[method]
+    scale = np.float32(1 / 255) if frames[0].dtype == np.uint8 else np.float32(1)
+    if method == "mertens":
+        # A fused pixel depends on ~2 pixels either side at every pyramid level, i.e.
+        # ~4 * 2**(levels - 1) px at full resolution. Contexts also start on the coarsest
+        # level's grid so each tile decimates the same pixels as the whole image would.
+        levels = _levels(h, w)
+        fuser = partial(fuse_mertens, levels=levels)
+        grid = 2 ** (levels - 1)
+        margin = max(overlap, 4 * grid)
+    else:
+        # mean is a per-pixel op: no context margin needed
+        grid, margin = 1, 0
+    out = np.zeros((h, w, 3), dtype=np.uint16)
+
+    # equal tiles rather than full-size ones plus a last tile that mostly repeats its neighbour
+    for iy, (y0, y1) in enumerate(_spans(h, tile, overlap)):
+        for ix, (x0, x1) in enumerate(_spans(w, tile, overlap)):
+            # fuse with a context margin, keep only the tile itself
+            cy0, cy1 = max(0, y0 - margin) // grid * grid, min(h, y1 + margin)
+            cx0, cx1 = max(0, x0 - margin) // grid * grid, min(w, x1 + margin)
+            tiles = [f[cy0:cy1, cx0:cx1, :3].astype(np.float32) * scale for f in frames]
+            fused = fuser(tiles)[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+            fused = np.clip(fused, 0.0, 1.0) * 65535.0
+
+            a = _ramp(y1 - y0, overlap, iy == 0)[:, None] * _ramp(x1 - x0, overlap, ix == 0)[None, :]
+            if a.min() < 1.0:
+                prev = out[y0:y1, x0:x1].astype(np.float32)
+                fused = prev + (fused - prev) * a[..., None]
+            out[y0:y1, x0:x1] = (fused + 0.5).astype(np.uint16)
+    return out
+
+
+def tone_stretch(img16, low_pct=STRETCH_LOW_PCT, high_pct=STRETCH_HIGH_PCT, sample_pixels=STRETCH_SAMPLE_PIXELS):
+    """uint16 -> uint8 with black / white points at the given percentiles of a subsample."""
+    h, w = img16.shape[:2]
+    stride = max(1, int((h * w / sample_pixels) ** 0.5))
+    lo, hi = np.percentile(img16[::stride, ::stride], [low_pct, high_pct])
+    if hi <= lo:
+        lo, hi = 0.0, 65535.0
+    lut = np.clip((np.arange(65536, dtype=np.float32) - lo) * (255.0 / (hi - lo)) + 0.5, 0, 255).astype(np.uint8)
+    return lut[img16]
+
+
+# === Files ===
+def load_frames(paths):
+    """uint8 RGB arrays of `paths` (alpha / 16-bit TIFFs are converted)."""
+    if Image is None:
+        raise RuntimeError("fusion needs Pillow (pip install pillow)")
+    frames = []
+    for p in paths:
+        with Image.open(p) as im:
+            frames.append(np.asarray(im.convert("RGB")))
+    return frames
+
+
+def fuse_to_file(frames, out_path, method=FUSION_METHOD, quality=JPEG_QUALITY):
+    """Fuse in-memory frames, stretch and write the JPEG."""
+    if Image is None:
+        raise RuntimeError("fusion needs Pillow (pip install pillow)")
+    img = tone_stretch(fuse_stack(frames, method))
+    Image.fromarray(img).save(out_path, quality=quality)
+    return out_path
+
+
+def fuse_files(paths, out_path, method=FUSION_METHOD, quality=JPEG_QUALITY):
+    return fuse_to_file(load_frames(paths), out_path, method, quality)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("output")
+    ap.add_argument("frames", nargs="+")
+    ap.add_argument("--method", choices=FUSION_METHODS, default=FUSION_METHOD)
+    ap.add_argument("--quality", type=int, default=JPEG_QUALITY)
+    args = ap.parse_args()
+    fuse_files(args.frames, args.output, args.method, args.quality)
+    print(f"✅ {args.method} fusion of {len(args.frames)} frames -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
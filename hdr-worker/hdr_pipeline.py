@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HDR orchestrator: the one_click_group_align_hdr.sh pipeline in Python.
+
+Stages per job:
+1. grouping      header reader + group_rows (same as group_raw_brackets_exiftool.py)
+2. per group, on a process pool:
+   extraction    largest embedded JPEG of every RAW via mmap (raw_preview)
+   normalization header size / orientation, one decode, pad (frame_normalize)
+   alignment     skipped for tripod-stable groups (thumbnail shift check),
+                 else align_image_stack (ALIGN_METHOD=hugin, default) or
+                 the in-process pyramid aligner (frame_align)
+   fusion        hdr_fusion (mean, or Mertens with HDR_FUSION=mertens)
+                 + percentile stretch
+
+Groups run in separate processes sized to the cores and memory available,
+each with a hard timeout (the group's whole process tree is killed), and
+every group reports its own status, so one bad bracket does not fail the
+job. Layout matches the shell script:
+
+    <out>/RAW_GROUPED/_groups.jsonl          manifest
+    <out>/RAW_GROUPED/<group>/jpg            extracted previews
+    <out>/RAW_GROUPED/<group>/aligned        ALIGN_METHOD=hugin only
+    <out>/HDR_FINAL/<group>.jpg
+    <out>/_hdr_status.json                   per-group status
+
+    python3 hdr_pipeline.py <input_folder> <output_folder> [--workers N] [--timeout SEC] [--align-skip-px PX]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import traceback
+from multiprocessing.connection import wait
+
+from PIL import Image
+
+from frame_align import ALIGN_METHOD, ALIGN_METHODS, SKIP_PX, align_stack, is_stable, measure_shifts
+from frame_normalize import normalize
+from group_manifest import MANIFEST_NAME, build_manifest, write_manifest
+from group_raw_brackets_exiftool import DEFAULT_READER, group_rows, list_files, read_rows, run_exiftool_json
+from hdr_fusion import FUSION_METHOD, fuse_to_file, load_frames
+from materialize import resolve_names
+from raw_preview import extract_preview
+
+GROUP_TIMEOUT_SEC = float(os.getenv("HDR_GROUP_TIMEOUT", "600"))
+MEM_PER_GROUP_MB = int(os.getenv("HDR_MEM_PER_GROUP_MB", "3072"))
+HDR_WORKERS = int(os.getenv("HDR_WORKERS", "0"))
+JPEG_EXTS = (".jpg", ".jpeg")
+
+
+# === Sizing ===
+def available_memory_mb():
+    """Memory this container may still use: cgroup limit if set, else MemAvailable."""
+    limit = None
+    for path, used_path in (
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+    ):
+        try:
+            with open(path) as f:
+                raw = f.read().strip()
+            if raw == "max" or int(raw) >= 1 << 60:
+                continue
+            with open(used_path) as f:
+                limit = (int(raw) - int(f.read().strip())) // (1024 * 1024)
+            break
+        except (OSError, ValueError):
+            continue
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    avail = int(line.split()[1]) // 1024
+                    return min(avail, limit) if limit is not None else avail
+    except OSError:
+        pass
+    return limit
+
+
+def default_workers():
+    if HDR_WORKERS > 0:
+        return HDR_WORKERS
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    mem = available_memory_mb()
+    by_mem = max(1, mem // MEM_PER_GROUP_MB) if mem else cores
+    return max(1, min(cores, by_mem))
+
+
+# === Stages ===
+def _run(cmd, cwd=None):
+    subprocess.run(cmd, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def preview_name(src):
+    return os.path.splitext(os.path.basename(src))[0] + ".jpg"
+
+
+def extract_frame(src, dst):
+    """JPEG for one member: a native JPEG as is, a RAW's embedded preview written to dst."""
+    if os.path.splitext(src)[1].lower() in JPEG_EXTS:
+        return src
+    if extract_preview(src, dst) is None:
+        print(f"⚠️ No embedded JPEG in {src}", file=sys.stderr)
+        return None
+    return dst
+
+
+def extract_frames(members, jpg_dir):
+    """[(member, jpeg)]: native JPEGs as is, RAWs via their embedded preview.
+
+    Preview names are unique within the call (IMG_1.CR2 and IMG_1.NEF ->
+    IMG_1.jpg, IMG_1_1.jpg); previews of an earlier run are overwritten.
+    """
+    os.makedirs(jpg_dir, exist_ok=True)
+    planned = resolve_names([(preview_name(src), jpg_dir) for src in members], {jpg_dir: set()})
+    out = []
+    for src, (_, dst) in zip(members, planned):
+        jpeg = extract_frame(src, dst)
+        if jpeg:
+            out.append((src, jpeg))
+    return out
+
+
+def normalize_frames(extracted, orientations):
+    """Oriented frames on the largest canvas of the group, as uint8 arrays."""
+    return normalize([j for _, j in extracted], [orientations.get(src) for src, _ in extracted])
+
+
+def align_frames(frames, align_dir, method=ALIGN_METHOD, skip_px=SKIP_PX):
+    """(aligned arrays, info): align_image_stack ("hugin"), or the in-process pyramid aligner.
+
+    Tripod-stable groups (every frame within skip_px on the thumbnail check)
+    are returned unaligned; info records the decision and measured shifts.
+    """
+    if skip_px > 0:
+        shifts = measure_shifts(frames)
+        check = {"tolerance_px": skip_px, "shifts": shifts}
+        if is_stable(shifts, skip_px):
+            return frames, {"method": "none", "skipped": True, "check": check}
+    else:
+        check = None
+    if method == "hugin":
+        return _align_hugin(frames, align_dir), {"method": "hugin", "skipped": False, "check": check}
+    if method != "pyramid":
+        raise ValueError(f"unknown ALIGN_METHOD {method!r} (expected one of {ALIGN_METHODS})")
+    aligned, transforms = align_stack(frames)
+    return aligned, {"method": "pyramid", "skipped": False, "check": check, "transforms": transforms}
+
+
+def _align_hugin(frames, align_dir):
+    os.makedirs(align_dir, exist_ok=True)
+    align_bin = shutil.which("align_image_stack")
+    if not align_bin:
+        raise RuntimeError("align_image_stack not found")
+    # the external aligner needs files: uncompressed TIFF, no re-encode
+    inputs = []
+    for idx, a in enumerate(frames, 1):
+        p = os.path.join(align_dir, f"in_{idx:03d}.tif")
+        Image.fromarray(a).save(p)
+        inputs.append(p)
+    _run([align_bin, "-m", "-a", "aligned_", *inputs], cwd=align_dir)
+    aligned = sorted(
+        os.path.join(align_dir, f) for f in os.listdir(align_dir)
+        if f.startswith("aligned_") and f.endswith(".tif")
+    )
+    if not aligned:
+        raise RuntimeError("alignment produced no frames")
+    return load_frames(aligned)
+
+
+def fuse_frames(aligned, out_path):
+    return fuse_to_file(aligned, out_path, FUSION_METHOD)
+
+
+def _stage(result, label, fn, *args):
+    t = time.perf_counter()
+    value = fn(*args)
+    result["stages"][label] = round(time.perf_counter() - t, 3)
+    return value
+
+
+def hdr_stages(result, fixed, group_dir, out_path, align_skip_px=SKIP_PX):
+    """Align + fuse normalised frames of one group into out_path; timings and info go to result."""
+    aligned, result["align"] = _stage(
+        result, "align", align_frames, fixed, os.path.join(group_dir, "aligned"), ALIGN_METHOD, align_skip_px,
+    )
+    _stage(result, "fuse", fuse_frames, aligned, out_path)
+    result["fusion"] = FUSION_METHOD
+
+
+def error_text(e):
+    text = f"{type(e).__name__}: {e}"
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+        text += " | " + e.stderr.decode(errors="replace").strip()[-500:]
+    return text
+
+
+def process_group(task):
+    """Run all per-group stages; returns a status dict (never raises)."""
+    name, members, group_dir, final_dir = task["name"], task["members"], task["group_dir"], task["final_dir"]
+    out_path = os.path.join(final_dir, f"{name}.jpg")
+    result = {"group": name, "frames": len(members), "output": None, "stages": {}}
+    start = time.perf_counter()
+
+    try:
+        extracted = _stage(result, "extract", extract_frames, members, os.path.join(group_dir, "jpg"))
+        if not extracted:
+            raise RuntimeError("JPG extract failed")
+        if len(members) == 1:
+            shutil.copyfile(extracted[0][1], out_path)
+            result["status"] = "single"
+        else:
+            fixed = _stage(result, "normalize", normalize_frames, extracted, task.get("orientations") or {})
+            hdr_stages(result, fixed, group_dir, out_path, task.get("align_skip_px", SKIP_PX))
+            result["status"] = "ok"
+        result["output"] = out_path
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = error_text(e)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# === Scheduling ===
+def _child(task, conn):
+    # own process group, so a timeout kills magick / align_image_stack too
+    os.setpgrp()
+    try:
+        conn.send(process_group(task))
+    except Exception:
+        conn.send({"group": task["name"], "status": "failed", "error": traceback.format_exc(limit=3)})
+    finally:
+        conn.close()
+
+
+def _kill_tree(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        proc.kill()
+
+
+def run_groups(tasks, workers=None, timeout=GROUP_TIMEOUT_SEC, on_result=None):
+    """Process `tasks` on up to `workers` processes; returns results in task order."""
+    workers = workers or default_workers()
+    ctx = mp.get_context("spawn")
+    pending = list(enumerate(tasks))
+    running = {}
+    results = [None] * len(tasks)
+
+    def finish(i, res):
+        results[i] = res
+        if on_result:
+            on_result(res)
+
+    while pending or running:
+        while pending and len(running) < workers:
+            i, task = pending.pop(0)
+            recv, send = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_child, args=(task, send), daemon=True)
+            proc.start()
+            send.close()
+            running[proc.sentinel] = (i, task, proc, recv, time.monotonic())
+
+        ready = wait(list(running), timeout=0.5)
+        now = time.monotonic()
+        for sentinel in list(running):
+            i, task, proc, recv, started = running[sentinel]
+            if sentinel in ready:
+                res = None
+                try:
+                    if recv.poll():
+                        res = recv.recv()
+                except (EOFError, OSError):
+                    res = None
+                proc.join()
+                if res is None:
+                    res = {"group": task["name"], "status": "failed", "error": f"worker exited with {proc.exitcode}"}
+                del running[sentinel]
+                finish(i, res)
+            elif timeout and now - started > timeout:
+                _kill_tree(proc)
+                proc.join()
+                del running[sentinel]
+                finish(i, {"group": task["name"], "status": "timeout", "error": f"timed out after {timeout:.0f}s"})
+    return results
+
+
+# === Job ===
+def group_names(groups):
+    return [
+        f"group_{i:04d}_{g[0]['time'].strftime('%Y%m%d_%H%M%S')}_{len(g)}files"
+        for i, g in enumerate(groups, 1)
+    ]
+
+
+def group_and_record(rows, grouped_dir, cols=None):
+    """Group header rows and write the manifest; returns [(name, rows)].
+
+    With `cols` (read_rows) the rows are already time-sorted and their typed
+    columns are reused.
+    """
+    if cols is None:
+        rows = sorted(rows, key=lambda x: x["time"])
+    groups, strategies = group_rows(rows, None, cols)
+    names = group_names(groups)
+    os.makedirs(grouped_dir, exist_ok=True)
+    write_manifest(os.path.join(grouped_dir, MANIFEST_NAME), build_manifest(groups, names, strategies))
+    return list(zip(names, groups))
+
+
+def plan_groups(input_dir, grouped_dir, reader=DEFAULT_READER):
+    """Group the input folder and write the manifest; returns [(name, rows)]."""
+    files = list_files(input_dir)
+    rows, cols = read_rows(run_exiftool_json(files, reader))
+    return group_and_record(rows, grouped_dir, cols)
+
+
+def report(res):
+    extra = f" ({res['error']})" if res.get("error") else ""
+    if (res.get("align") or {}).get("skipped"):
+        extra += " [alignment skipped: tripod-stable]"
+    print(f"==> {res['group']}: {res['status']} in {res.get('seconds', '?')}s{extra}")
+
+
+def write_status(output_dir, results, final_dir):
+    with open(os.path.join(output_dir, "_hdr_status.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    ok = sum(r["status"] in ("ok", "single") for r in results)
+    print(f"✅ Done. {ok}/{len(results)} groups produced output in {final_dir}")
+
+
+def run(input_dir, output_dir, workers=None, timeout=GROUP_TIMEOUT_SEC, reader=DEFAULT_READER, align_skip_px=SKIP_PX):
+    """Whole job in-process. Returns the per-group status list (also written to _hdr_status.json)."""
+    grouped_dir = os.path.join(output_dir, "RAW_GROUPED")
+    final_dir = os.path.join(output_dir, "HDR_FINAL")
+    os.makedirs(final_dir, exist_ok=True)
+
+    planned = plan_groups(input_dir, grouped_dir, reader)
+    workers = workers or default_workers()
+    print(f"Processing {len(planned)} groups on {workers} workers -> HDR / single")
+    tasks = [
+        {
+            "name": name,
+            "members": [r["path"] for r in g],
+            "orientations": {r["path"]: r.get("orientation") for r in g},
+            "group_dir": os.path.join(grouped_dir, name),
+            "final_dir": final_dir,
+            "align_skip_px": align_skip_px,
+        }
+        for name, g in planned
+    ]
+
+    results = run_groups(tasks, workers, timeout, on_result=report)
+    write_status(output_dir, results, final_dir)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("input_folder")
+    ap.add_argument("output_folder")
+    ap.add_argument("--workers", type=int, default=None, help="parallel groups (default: by cores and memory)")
+    ap.add_argument("--timeout", type=float, default=GROUP_TIMEOUT_SEC, help="per-group timeout in seconds")
+    ap.add_argument("--reader", default=DEFAULT_READER)
+    ap.add_argument("--align-skip-px", type=float, default=SKIP_PX,
+                    help="skip alignment when every frame is within this many pixels (0 = always align)")
+    args = ap.parse_args()
+    results = run(args.input_folder, args.output_folder, args.workers, args.timeout, args.reader, args.align_skip_px)
+    return 0 if any(r["status"] in ("ok", "single") for r in results) or not results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
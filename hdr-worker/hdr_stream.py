@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming HDR stages for the RunPod handler.
+
+hdr_pipeline.run starts once every frame is on disk. Here each frame is
+handed over as soon as its download completes:
+- add(path) queues the per-frame work on the CPU pool right away: header
+  row for grouping, largest embedded JPEG (raw_preview), one decode to an
+  oriented uint8 frame (frame_normalize.load_frame). Previews share
+  RAW_GROUPED/jpg (groups are not known yet); their names are claimed in
+  add() order with materialize.resolve_names, so equal stems do not collide
+- finish() is called after the last frame: the job is grouped with the
+  same rules and manifest as hdr_pipeline, and each group's canvas,
+  alignment and fusion are queued on the same pool (at most GROUP_WORKERS
+  groups at a time, sized like hdr_pipeline's group processes)
+- on_result(status) fires as each group finishes, so the caller can start
+  uploading its JPEG while other groups are still fusing
+
+Stages run on threads: Pillow decodes and the NumPy stages release the
+GIL, and decoded frames stay in memory until fusion instead of being
+pickled to a worker process. There is no per-group hard kill as in
+hdr_pipeline.run_groups, and every decoded frame of the job is held until
+its group is fused, so large jobs (> STREAM_MAX_FRAMES) should go through
+hdr_pipeline.run instead. Output layout and _hdr_status.json match
+hdr_pipeline.
+"""
+
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from exif_header import read_exif_records
+from frame_align import SKIP_PX
+from frame_normalize import load_frame, place
+from group_raw_brackets_exiftool import DEFAULT_READER, EXIF_FIELDS, make_row
+from hdr_pipeline import (_stage, default_workers, error_text, extract_frame, group_and_record, hdr_stages,
+                          preview_name, report, write_status)
+from materialize import resolve_names
+
+CPU_WORKERS = int(os.getenv("HDR_CPU_WORKERS", "0")) or (os.cpu_count() or 1)
+GROUP_WORKERS = int(os.getenv("HDR_GROUP_WORKERS", "0"))
+STREAM_MAX_FRAMES = int(os.getenv("HDR_STREAM_MAX_FRAMES", "32"))
+
+
+class HdrStream:
+    def __init__(self, output_dir, on_result=None, workers=CPU_WORKERS, group_workers=GROUP_WORKERS,
+                 reader=DEFAULT_READER, align_skip_px=SKIP_PX):
+        self.output_dir = output_dir
+        self.grouped_dir = os.path.join(output_dir, "RAW_GROUPED")
+        self.final_dir = os.path.join(output_dir, "HDR_FINAL")
+        os.makedirs(self.final_dir, exist_ok=True)
+        self.on_result = on_result
+        self.reader = reader
+        self.align_skip_px = align_skip_px
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._groups = threading.BoundedSemaphore(group_workers or default_workers())
+        self._frames = []
+        self._jpg_dir = os.path.join(self.grouped_dir, "jpg")
+        os.makedirs(self._jpg_dir, exist_ok=True)
+        self._preview_names = {self._jpg_dir: set()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def add(self, path):
+        """Queue extraction + decode of one downloaded frame."""
+        # names are claimed here, on the caller's thread, not in the racing _prepare calls
+        (_, jpeg), = resolve_names([(preview_name(path), self._jpg_dir)], self._preview_names)
+        self._frames.append(self._pool.submit(self._prepare, path, jpeg))
+
+    def _prepare(self, path, jpeg):
+        start = time.perf_counter()
+        recs = read_exif_records([path], EXIF_FIELDS, reader=self.reader, workers=1)
+        row = make_row(recs[0]) if recs else None
+        if row is None:
+            # unreadable header: dropped from grouping, as in plan_groups
+            return None
+        frame = {"row": row, "jpeg": None, "image": None, "header": None}
+        try:
+            frame["jpeg"] = extract_frame(path, jpeg)
+            if frame["jpeg"]:
+                frame["image"], frame["header"] = load_frame(frame["jpeg"], row.get("orientation"))
+        except Exception as e:
+            frame["error"] = error_text(e)
+        frame["seconds"] = time.perf_counter() - start
+        return frame
+
+    def finish(self):
+        """After the last add(): group, fuse every group and return their statuses in group order."""
+        frames = [f for f in (fut.result() for fut in self._frames) if f]
+        by_path = {f["row"]["path"]: f for f in frames}
+        planned = group_and_record([f["row"] for f in frames], self.grouped_dir)
+        print(f"Processing {len(planned)} groups -> HDR / single")
+        futures = [
+            self._pool.submit(self._group, name, [by_path[r["path"]] for r in g])
+            for name, g in planned
+        ]
+        results = [fut.result() for fut in futures]
+        write_status(self.output_dir, results, self.final_dir)
+        return results
+
+    def _group(self, name, frames):
+        with self._groups:
+            result = self._fuse_group(name, frames)
+        report(result)
+        if self.on_result:
+            self.on_result(result)
+        return result
+
+    def _fuse_group(self, name, frames):
+        out_path = os.path.join(self.final_dir, f"{name}.jpg")
+        # per-frame work already ran while the downloads were in flight
+        result = {
+            "group": name, "frames": len(frames), "output": None,
+            "stages": {"prepare": round(sum(f["seconds"] for f in frames), 3)},
+        }
+        start = time.perf_counter()
+        usable = [f for f in frames if f["image"] is not None]
+        try:
+            if len(frames) == 1:
+                if not frames[0]["jpeg"]:
+                    raise RuntimeError(frames[0].get("error") or "JPG extract failed")
+                shutil.copyfile(frames[0]["jpeg"], out_path)
+                result["status"] = "single"
+            else:
+                if not usable:
+                    errors = [f["error"] for f in frames if f.get("error")]
+                    raise RuntimeError(errors[0] if errors else "JPG extract failed")
+                fixed = _stage(result, "normalize", place, [f["image"] for f in usable], [f["header"] for f in usable])
+                hdr_stages(result, fixed, os.path.join(self.grouped_dir, name), out_path, self.align_skip_px)
+                result["status"] = "ok"
+            result["output"] = out_path
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = error_text(e)
+        finally:
+            for f in frames:
+                f["image"] = None
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Put grouped RAWs into their group folders without copying them when we can.
+
+Modes:
+- auto     hardlink when source and destination share a filesystem, else try a
+           reflink (copy-on-write clone), else fall back to a real copy
+- hardlink / reflink / symlink / copy   force one method (hardlink and reflink
+           still fall back to copy if the filesystem refuses)
+
+Real copies run on a thread pool and use copy_file_range / sendfile so the
+data never passes through Python buffers. Destination names are resolved in
+memory (one listdir per folder) instead of probing os.path.exists for every
+candidate name.
+"""
+
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+LINK_MODES = ("auto", "hardlink", "reflink", "symlink", "copy")
+DEFAULT_LINK_MODE = os.getenv("GROUP_LINK_MODE", "auto")
+COPY_WORKERS = int(os.getenv("GROUP_COPY_WORKERS", "0")) or min(8, (os.cpu_count() or 2) * 2)
+
+# <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def resolve_names(jobs, used=None):
+    """Map (src, dst_folder) jobs to unique destination paths.
+
+    Same rule as the old safe_copy: keep the basename, and on a clash append
+    _1, _2, ... before the extension. Existing folder contents are listed once.
+    `used` maps folder -> names already taken (a folder missing from it is
+    listed); it is updated in place, so names stay unique across calls that
+    share it.
+    """
+    used = {} if used is None else used
+    out = []
+    for src, folder in jobs:
+        names = used.get(folder)
+        if names is None:
+            try:
+                names = set(os.listdir(folder))
+            except FileNotFoundError:
+                names = set()
+            used[folder] = names
+        base = os.path.basename(src)
+        cand = base
+        if cand in names:
+            stem, ext = os.path.splitext(base)
+            i = 1
+            while f"{stem}_{i}{ext}" in names:
+                i += 1
+            cand = f"{stem}_{i}{ext}"
+        names.add(cand)
+        out.append((src, os.path.join(folder, cand)))
+    return out
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(infd, outfd, offset, size):
+    while offset < size:
+        n = os.copy_file_range(infd, outfd, min(size - offset, 1 << 30), offset, offset)
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def _sendfile(infd, outfd, offset, size):
+    os.lseek(outfd, offset, os.SEEK_SET)
+    while offset < size:
+        n = os.sendfile(outfd, infd, offset, min(size - offset, 1 << 30))
+        if n == 0:
+            break
+        offset += n
+    return offset
+
+
+def _fast_copy(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        infd, outfd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(infd).st_size
+        offset = 0
+        for name, copier in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile)):
+            if not hasattr(os, name) or (name == "sendfile" and sys.platform == "darwin"):
+                continue
+            try:
+                offset = copier(infd, outfd, offset, size)
+                break
+            except OSError:
+                continue
+        if offset < size:
+            fsrc.seek(offset)
+            fdst.seek(offset)
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+
+def _place(src, dst, mode, same_dev):
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return "symlink"
+    if mode in ("auto", "hardlink") and same_dev:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    if mode in ("auto", "reflink") and sys.platform.startswith("linux"):
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except OSError:
+            pass
+    _fast_copy(src, dst)
+    return "copy"
+
+
+def materialize(jobs, mode=DEFAULT_LINK_MODE, workers=COPY_WORKERS):
+    """Place every (src, dst_folder) job; returns [(src, dst, method), ...]."""
+    if mode not in LINK_MODES:
+        raise ValueError(f"unknown link mode {mode!r}, expected one of {LINK_MODES}")
+    jobs = list(jobs)
+    for folder in {f for _, f in jobs}:
+        os.makedirs(folder, exist_ok=True)
+
+    planned = resolve_names(jobs)
+    dev_cache = {}
+
+    def dev(path):
+        d = dev_cache.get(path)
+        if d is None:
+            d = dev_cache[path] = os.stat(path).st_dev
+        return d
+
+    same = [dev(os.path.dirname(os.path.abspath(s))) == dev(os.path.dirname(d)) for s, d in planned]
+
+    def one(args):
+        (src, dst), same_dev = args
+        return src, dst, _place(src, dst, mode, same_dev)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(one, zip(planned, same)))
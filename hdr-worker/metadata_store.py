@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent EXIF store for incremental grouping.
+
+exiftool records are cached in SQLite keyed by (path, size, mtime), so a
+rerun only sends new or modified files to exiftool. The previous group
+assignment is stored too: on a rerun only the tail of the catalog from the
+first changed frame onwards is regrouped, and groups whose members did not
+change keep their group id.
+"""
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from exif_header import DEFAULT_READER, read_exif_records
+from group_engine import (
+    BASE_GAP_SEC, EXP_GAP_FACTOR, TIME_GAP_SEC, TIME_STRATEGY, columns_from_rows, group_by_camera, time_column,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exif (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    record   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS groups (
+    path     TEXT PRIMARY KEY,
+    group_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS group_strategy (
+    group_id INTEGER PRIMARY KEY,
+    strategy TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class MetadataStore:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, files, fields, reader=DEFAULT_READER):
+        """Return (records, dirty) for `files`.
+
+        `records` are exiftool JSON dicts for every file (cached or fresh);
+        `dirty` holds the old and new records of every file that was added,
+        modified or removed since the last scan of the same folders.
+        """
+        stats = {}
+        for p in files:
+            st = os.stat(p)
+            stats[p] = (st.st_size, st.st_mtime_ns)
+
+        folders = {os.path.dirname(p) for p in files}
+        cached = {}
+        for path, size, mtime_ns, record in self.db.execute("SELECT path, size, mtime_ns, record FROM exif"):
+            if os.path.dirname(path) in folders:
+                cached[path] = (size, mtime_ns, record)
+
+        stale = [p for p in files if p not in cached or cached[p][:2] != stats[p]]
+        removed = [p for p in cached if p not in stats]
+        dirty = [json.loads(cached[p][2]) for p in stale + removed if p in cached]
+
+        fresh = {}
+        if stale:
+            for rec in read_exif_records(stale, fields, reader=reader):
+                fresh[rec.get("SourceFile")] = rec
+
+        with self.db:
+            self.db.executemany("DELETE FROM exif WHERE path = ?", [(p,) for p in removed])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO exif (path, size, mtime_ns, record) VALUES (?, ?, ?, ?)",
+                [(p, *stats[p], json.dumps(fresh[p])) for p in stale if p in fresh],
+            )
+
+        records = []
+        for p in files:
+            if p in fresh:
+                records.append(fresh[p])
+            elif p in cached and p not in stale:
+                records.append(json.loads(cached[p][2]))
+        dirty.extend(fresh.values())
+        return records, dirty
+
+    def previous_groups(self):
+        return dict(self.db.execute("SELECT path, group_id FROM groups"))
+
+    def previous_strategies(self):
+        return dict(self.db.execute("SELECT group_id, strategy FROM group_strategy"))
+
+    def next_group_id(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'next_group_id'").fetchone()
+        return int(row[0]) if row else 1
+
+    def save_groups(self, assignment, next_id, folders, strategies=None):
+        """Replace the stored assignment for rows in `folders` with `assignment`.
+
+        strategies: {group_id: rule name} of the groups in `assignment`.
+        """
+        with self.db:
+            for path, _ in list(self.db.execute("SELECT path, group_id FROM groups")):
+                if os.path.dirname(path) in folders:
+                    self.db.execute("DELETE FROM groups WHERE path = ?", (path,))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO groups (path, group_id) VALUES (?, ?)",
+                list(assignment.items()),
+            )
+            self.db.execute("DELETE FROM group_strategy WHERE group_id NOT IN (SELECT group_id FROM groups)")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO group_strategy (group_id, strategy) VALUES (?, ?)",
+                list((strategies or {}).items()),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_group_id', ?)", (str(next_id),)
+            )
+
+
+def _time_breaks(cols):
+    """True where no bracket of any camera can span the gap before a frame.
+
+    The tail is regrouped per camera body, so the cut must not fall inside
+    an interleaved bracket of another body: only a time gap longer than the
+    largest allowed gap of the whole catalog qualifies (setup changes do
+    not, two bodies may simply use different apertures).
+    """
+    t, shutter = cols["time"], cols["shutter"]
+    longest = np.nanmax(shutter) if np.isfinite(shutter).any() else 0.0
+    limit = max(TIME_GAP_SEC, BASE_GAP_SEC + EXP_GAP_FACTOR * max(0.0, longest))
+    return np.r_[True, np.round(np.diff(t), 6) > limit]
+
+
+def regroup_tail(rows, dirty_since, previous, next_id, previous_strategies=None, cols=None):
+    """Group `rows` reusing the previous assignment before the first change.
+
+    rows: make_row dicts sorted by time. dirty_since: earliest capture time
+    touched by an added/modified/removed file (None = nothing changed).
+    previous: {path: group_id} from the last run, previous_strategies:
+    {group_id: rule name}. cols: typed columns aligned with rows
+    (exif_columns.read_columns), rebuilt from the dicts when omitted.
+
+    Returns (groups, ids, next_id, strategies): groups in time order with
+    one stable id and the deciding rule each. Rows before the last clear
+    time gap preceding `dirty_since` keep their old groups; only the tail
+    is regrouped, with the same per-camera / sequence rules as a full run
+    (group_by_camera). A tail group whose members exactly match an old
+    group keeps that group's id.
+    """
+    if not rows:
+        return [], [], next_id, []
+    previous_strategies = previous_strategies or {}
+    cols = columns_from_rows(rows) if cols is None else cols
+    n = len(rows)
+    cut = n
+    if dirty_since is not None or any(r["path"] not in previous for r in rows):
+        first = n
+        if dirty_since is not None:
+            first = int(np.searchsorted(cols["time"], time_column([{"time": dirty_since}])[0]))
+        for i, r in enumerate(rows[:first]):
+            if r["path"] not in previous:
+                first = i
+                break
+        # The frames just before the change may now bond with it, so start the
+        # tail after the last gap no bracket can span.
+        starts = np.flatnonzero(_time_breaks(cols)[:max(first, 1)])
+        cut = int(starts[-1]) if len(starts) else 0
+
+    head_groups = {}
+    for r in rows[:cut]:
+        head_groups.setdefault(previous[r["path"]], []).append(r)
+    groups = list(head_groups.values())
+    ids = list(head_groups.keys())
+    strategies = [previous_strategies.get(gid, TIME_STRATEGY) for gid in ids]
+
+    if cut < n:
+        old_members = {}
+        for path, gid in previous.items():
+            old_members.setdefault(gid, set()).add(path)
+        reusable = {frozenset(m): gid for gid, m in old_members.items() if gid not in head_groups}
+
+        tail_groups, tail_strategies = group_by_camera(rows[cut:], cols={k: v[cut:] for k, v in cols.items()})
+        for g, name in zip(tail_groups, tail_strategies):
+            key = frozenset(r["path"] for r in g)
+            if key in reusable:
+                ids.append(reusable.pop(key))
+            else:
+                ids.append(next_id)
+                next_id += 1
+            groups.append(g)
+            strategies.append(name)
+    return groups, ids, next_id, strategies
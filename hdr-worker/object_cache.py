@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Size-bounded on-disk cache of R2 objects for warm workers.
+
+Each job otherwise downloads its frames into a fresh temporary folder,
+including retries and re-renders of the same group. Here objects are kept
+under R2_CACHE_DIR, keyed by (bucket, key, ETag), for as long as the pod
+stays warm:
+
+    <R2_CACHE_DIR>/<sha1(bucket, key)>/<base64url(ETag)>
+
+- a cached object is revalidated with a conditional HEAD (If-None-Match:
+  ETag); 304 = hit, and the file is hard-linked (or copied) to the job
+- on a miss the HEAD's ETag is fetched with If-Match, so the stored bytes
+  always belong to the recorded ETag even if the object changes meanwhile;
+  older ETags of the same key are dropped
+- least recently used entries (mtime, touched on every hit) are evicted
+  once the total exceeds R2_CACHE_MAX_MB; the index is rebuilt from the
+  folder when a new process starts
+- stats() reports hits / misses / bytes / evictions since start
+
+R2_CACHE_MAX_MB=0 disables the cache.
+"""
+
+import base64
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+CACHE_DIR = os.getenv("R2_CACHE_DIR", "/tmp/mvai-r2-cache")
+CACHE_MAX_BYTES = int(os.getenv("R2_CACHE_MAX_MB", "8192")) * 1024 * 1024
+
+
+def _object_dir(root, bucket, key):
+    return os.path.join(root, hashlib.sha1(f"{bucket}\0{key}".encode()).hexdigest())
+
+
+def _etag_name(etag):
+    return base64.urlsafe_b64encode(etag.encode()).decode()
+
+
+def _etag_of(name):
+    return base64.urlsafe_b64decode(name.encode()).decode()
+
+
+def _not_modified(e):
+    return str(e.response.get("Error", {}).get("Code")) in ("304", "NotModified") or \
+        e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304
+
+
+class ObjectCache:
+    def __init__(self, client, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, transfer_config=None):
+        self.client = client
+        self.root = root
+        self.max_bytes = max_bytes
+        self.transfer_config = transfer_config
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "hit_bytes": 0, "miss_bytes": 0, "evictions": 0}
+        # path -> [size, last use]; rebuilt from disk so a restart keeps the cache
+        self._entries = {}
+        self._size = 0
+        os.makedirs(root, exist_ok=True)
+        for d in os.listdir(root):
+            obj_dir = os.path.join(root, d)
+            if not os.path.isdir(obj_dir):
+                continue
+            for name in os.listdir(obj_dir):
+                path = os.path.join(obj_dir, name)
+                if name.startswith("."):
+                    os.remove(path)  # download interrupted by a restart
+                    continue
+                st = os.stat(path)
+                self._entries[path] = [st.st_size, st.st_mtime]
+                self._size += st.st_size
+
+    def _cached(self, bucket, key):
+        """(path, etag) of the newest stored ETag of an object, or (None, None)."""
+        obj_dir = _object_dir(self.root, bucket, key)
+        with self._lock:
+            found = [p for p in self._entries if os.path.dirname(p) == obj_dir]
+            if not found:
+                return None, None
+            path = max(found, key=lambda p: self._entries[p][1])
+        return path, _etag_of(os.path.basename(path))
+
+    def fetch(self, bucket, key, dst):
+        """Object -> dst through the cache; returns "hit" or "miss"."""
+        path, etag = self._cached(bucket, key)
+        try:
+            head = self.client.head_object(Bucket=bucket, Key=key, **({"IfNoneMatch": etag} if etag else {}))
+        except ClientError as e:
+            if not (etag and _not_modified(e)):
+                raise
+            if self._deliver(path, dst):
+                self._count("hits", "hit_bytes", path)
+                return "hit"
+            head = self.client.head_object(Bucket=bucket, Key=key)
+
+        etag = head["ETag"]
+        obj_dir = _object_dir(self.root, bucket, key)
+        os.makedirs(obj_dir, exist_ok=True)
+        path = os.path.join(obj_dir, _etag_name(etag))
+        tmp = os.path.join(obj_dir, f".{uuid.uuid4().hex}")
+        try:
+            self.client.download_file(bucket, key, tmp, ExtraArgs={"IfMatch": etag}, Config=self.transfer_config)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._add(path)
+        if not self._deliver(path, dst):
+            raise RuntimeError(f"cache entry for {key} evicted before delivery")
+        self._count("misses", "miss_bytes", path)
+        return "miss"
+
+    def _deliver(self, path, dst):
+        """Hard-link (same filesystem) or copy a cached file to dst; False if it was evicted meanwhile."""
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(path, dst)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            try:
+                shutil.copyfile(path, dst)
+            except FileNotFoundError:
+                return False
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if path in self._entries:
+                self._entries[path][1] = now
+        return True
+
+    def _add(self, path):
+        size = os.path.getsize(path)
+        with self._lock:
+            stale = [p for p in self._entries if os.path.dirname(p) == os.path.dirname(path) and p != path]
+            old = self._entries.pop(path, None)
+            self._size -= old[0] if old else 0
+            self._entries[path] = [size, os.path.getmtime(path)]
+            self._size += size
+        # a new ETag supersedes the older ones of the same key
+        for p in stale:
+            self._remove(p)
+        self._evict(keep=path)
+
+    def _remove(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is None:
+                return
+            self._size -= entry[0]
+            self._counts["evictions"] += 1
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            order = sorted(self._entries, key=lambda p: self._entries[p][1])
+        for p in order:
+            if self._size <= self.max_bytes:
+                break
+            if p != keep:
+                self._remove(p)
+
+    def _count(self, counter, bytes_counter, path):
+        with self._lock:
+            self._counts[counter] += 1
+            entry = self._entries.get(path)
+            self._counts[bytes_counter] += entry[0] if entry else 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, entries=len(self._entries), bytes=self._size, max_bytes=self.max_bytes)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optional content check for EXIF-based groups.
+
+Each frame's embedded EXIF thumbnail (a ~160x120 JPEG, no RAW decode) is
+decoded at reduced DCT scale to a 9x9 grey patch and turned into a 128-bit
+difference hash: the sign of the horizontal and vertical gradients. Gradient
+signs do not change when the whole frame gets brighter or darker, so the
+frames of one bracket hash alike across exposures; a different room does not.
+
+- split: inside a group, a frame whose hash is far from every frame of the
+  current run starts a new group (handheld reshoot of another view)
+- merge: consecutive groups of the same camera body (Model, SerialNumber)
+  closer than MERGE_WINDOW_SEC that look alike, fit in one bracket
+  (<= MAX_BRACKET) and do not repeat an exposure are joined (a bracket cut
+  in two by a slow card write); groups of two bodies shooting the same room
+  are never joined
+
+Hashing is batched (N x 9 x 9 array -> N x 16 bytes) and distances are
+XOR + popcount over NumPy matrices, one small matrix per group / window.
+Frames without a usable thumbnail (missing, or too flat to carry gradients)
+are never split off or used to merge.
+"""
+
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from exif_header import thumbnail_bytes
+from exiftool_session import shared_pool
+from group_engine import MAX_BRACKET, _float_column, camera_key, exposure_values, is_break
+
+try:
+    from PIL import Image
+except ImportError:  # optional: the stage is off unless asked for
+    Image = None
+
+HASH_SIZE = 8
+HASH_BITS = 2 * HASH_SIZE * HASH_SIZE
+SPLIT_DIST = int(os.getenv("PHASH_SPLIT_DIST", "44"))
+MERGE_DIST = int(os.getenv("PHASH_MERGE_DIST", "32"))
+MERGE_WINDOW_SEC = float(os.getenv("PHASH_MERGE_WINDOW_SEC", "15"))
+REPEAT_EV = 0.3
+# flat (near black / blown out) thumbnails carry no gradient signal
+MIN_CONTRAST = float(os.getenv("PHASH_MIN_CONTRAST", "12"))
+THUMB_WORKERS = int(os.getenv("PHASH_WORKERS", "0")) or min(16, (os.cpu_count() or 2) * 4)
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _thumb_patch(data):
+    """9x9 float32 grey patch from JPEG bytes, decoded at 1/8 scale when possible."""
+    im = Image.open(io.BytesIO(data))
+    im.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+    im = im.convert("L").resize((HASH_SIZE + 1, HASH_SIZE + 1), Image.BOX)
+    return np.asarray(im, dtype=np.float32)
+
+
+def _load_patch(path):
+    data = thumbnail_bytes(path)
+    if data is None:
+        # NEF / DNG keep an uncompressed thumbnail, CR3 a different container
+        try:
+            data = shared_pool().read_binary_tag(path, ("ThumbnailImage", "PreviewImage"))
+        except Exception:
+            data = None
+    if not data:
+        return None
+    try:
+        return _thumb_patch(data)
+    except Exception:
+        return None
+
+
+def dhash_batch(patches):
+    """Packed 128-bit hashes (N x 16 uint8) for an N x 9 x 9 stack of patches."""
+    p = np.log1p(np.asarray(patches, dtype=np.float32))
+    horiz = p[:, :HASH_SIZE, 1:] > p[:, :HASH_SIZE, :-1]
+    vert = p[:, 1:, :HASH_SIZE] > p[:, :-1, :HASH_SIZE]
+    bits = np.concatenate([horiz.reshape(len(p), -1), vert.reshape(len(p), -1)], axis=1)
+    return np.packbits(bits, axis=1)
+
+
+def hamming_matrix(a, b):
+    """Pairwise Hamming distances between packed hashes a (N x 16) and b (M x 16)."""
+    x = np.bitwise_xor(a[:, None, :], b[None, :, :])
+    return _POPCOUNT[x].sum(axis=2, dtype=np.int32)
+
+
+def frame_hashes(paths, workers=THUMB_WORKERS):
+    """{path: packed hash} for every path with a decodable thumbnail."""
+    if Image is None:
+        raise RuntimeError("phash validation needs Pillow (pip install pillow)")
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        patches = list(pool.map(_load_patch, paths))
+    ok = [i for i, p in enumerate(patches) if p is not None and np.ptp(p) >= MIN_CONTRAST]
+    if not ok:
+        return {}
+    hashes = dhash_batch(np.stack([patches[i] for i in ok]))
+    return {paths[i]: hashes[k] for k, i in enumerate(ok)}
+
+
+def _split(group, hashes):
+    """Split one time-ordered group where content changes; returns sub-groups."""
+    idx = [i for i, r in enumerate(group) if r["path"] in hashes]
+    if len(idx) < 2:
+        return [group]
+    h = np.stack([hashes[group[i]["path"]] for i in idx])
+    dist = hamming_matrix(h, h)
+
+    starts = [0]
+    run = [0]
+    for k in range(1, len(idx)):
+        if dist[k, run].min() > SPLIT_DIST:
+            starts.append(idx[k])
+            run = [k]
+        else:
+            run.append(k)
+    if len(starts) == 1:
+        return [group]
+    bounds = starts + [len(group)]
+    return [group[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _signature(group, hashes):
+    hs = [hashes[r["path"]] for r in group if r["path"] in hashes]
+    return np.stack(hs) if hs else None
+
+
+def validate_groups(groups, strategies=None, hashes=None):
+    """Split / merge time-ordered `groups` by thumbnail content.
+
+    Returns (groups, strategies) with "+phash_split" / "+phash_merge" appended
+    to the strategy of every group the stage changed (strategies may be None).
+    """
+    if hashes is None:
+        hashes = frame_hashes(r["path"] for g in groups for r in g)
+    strategies = list(strategies) if strategies is not None else [None] * len(groups)
+
+    split_groups, split_strats = [], []
+    for g, s in zip(groups, strategies):
+        g = sorted(g, key=lambda r: r["time"])
+        parts = _split(g, hashes)
+        tag = "+phash_split" if len(parts) > 1 else ""
+        for part in parts:
+            split_groups.append(part)
+            split_strats.append(f"{s or 'time_gap'}{tag}" if tag else s)
+
+    out, out_strats = [], []
+    last = {}  # camera_key -> index in out of that body's latest group
+    for g, s in zip(split_groups, split_strats):
+        body = camera_key(g[0])
+        k = last.get(body)
+        if k is not None:
+            prev = out[k]
+            dt = (g[0]["time"] - prev[-1]["time"]).total_seconds()
+            if (
+                0 <= dt <= MERGE_WINDOW_SEC
+                and len(prev) + len(g) <= MAX_BRACKET
+                and not _setup_changed(prev[-1], g[0])
+                and not _repeats_exposure(prev + g)
+            ):
+                a, b = _signature(prev, hashes), _signature(g, hashes)
+                if a is not None and b is not None and hamming_matrix(a, b).min() <= MERGE_DIST:
+                    out[k] = prev + g
+                    base = out_strats[k] or "time_gap"
+                    out_strats[k] = base if base.endswith("+phash_merge") else base + "+phash_merge"
+                    continue
+        last[body] = len(out)
+        out.append(g)
+        out_strats.append(s)
+    return out, out_strats
+
+
+def _repeats_exposure(rows):
+    # a bracket never shoots the same exposure twice; a reshoot of the room does
+    exp = exposure_values(_float_column(rows, "ev"), _float_column(rows, "shutter"))
+    exp = np.sort(exp[np.isfinite(exp)])
+    return bool(len(exp) > 1 and np.diff(exp).min() < REPEAT_EV)
+
+
+def _setup_changed(a, b):
+    # aperture / focal jumps still separate groups; only the time rule is relaxed
+    return is_break({**a, "time": b["time"]}, b)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python3 phash_validate.py <file_a> <file_b> [...]   # pairwise Hamming distances")
+        return 1
+    hashes = frame_hashes(argv)
+    paths = [p for p in argv if p in hashes]
+    if not paths:
+        print("No thumbnails found.")
+        return 1
+    h = np.stack([hashes[p] for p in paths])
+    dist = hamming_matrix(h, h)
+    for i, p in enumerate(paths):
+        print(os.path.basename(p), " ".join(f"{d:3d}" for d in dist[i]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Embedded JPEG extraction from RAWs without subprocesses.
+
+The RAW is memory-mapped and every JPEG it references is collected:
+- TIFF-based (ARW, CR2, NEF, NRW, DNG, PEF, SRW, ORF): JPEGInterchangeFormat
+  (0x0201/0x0202) and single-strip StripOffsets (0x0111/0x0117) of IFD0, the
+  chained IFDs and the SubIFDs (NEF JpgFromRaw, CR2 full-size JPEG, DNG
+  previews)
+- RAF: the JPEG whose offset / length sit in the fixed RAF header
+- CR3 (ISOBMFF): the PRVW box in the preview uuid box and the first track's
+  sample (the full-size JPEG) via moov/trak/.../stsz + co64
+
+Candidates must start with SOI and carry a baseline / progressive SOF, so
+lossless-JPEG raw data (CR2, DNG) is never mistaken for a preview; the
+largest by pixel count wins. largest_jpeg() returns it as a memoryview slice
+of the mapping (no copy); write_largest_jpeg() writes that slice straight to
+a file. Anything not found natively (RW2, MakerNote-only previews, odd files)
+falls back to the shared exiftool process, and so does any file the native
+parser trips over: a malformed RAW costs an exiftool call, never the group.
+
+    python3 raw_preview.py previews --subdir jpg <group_dir> [<group_dir> ...]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from exif_header import SUB_IFDS, HeaderError, _Tiff
+from exiftool_session import _preview_pairs, shared_pool
+
+PREVIEW_TAGS = ("PreviewImage", "JpgFromRaw")
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "0")) or min(8, (os.cpu_count() or 2) * 2)
+MAX_IFDS = 32
+
+# CR3: uuid of the top-level box holding PRVW
+_CR3_PREVIEW_UUID = bytes.fromhex("eaf42b5e1c984b88b9fbb7dc406e4d16")
+_JPEG_PAIRS = ((0x0201, 0x0202), (0x0111, 0x0117))
+_WANTED = {0x0201, 0x0202, 0x0111, 0x0117, SUB_IFDS}
+
+
+class _MapSource:
+    """read(offset, size) over an mmap; small reads are copied, the JPEG itself is not."""
+
+    def __init__(self, mm):
+        self.mm = mm
+
+    def read(self, offset, size):
+        end = offset + size
+        if offset < 0 or end > len(self.mm):
+            raise HeaderError("truncated file")
+        return self.mm[offset:end]
+
+
+def jpeg_size(buf, start=0, limit=None):
+    """(width, height) from the SOF of a viewable JPEG at `start`, else None.
+
+    Lossless (SOF3) and other non-baseline frames return None.
+    """
+    end = len(buf) if limit is None else min(len(buf), start + limit)
+    if buf[start:start + 2] != b"\xff\xd8":
+        return None
+    pos = start + 2
+    for _ in range(512):
+        if pos + 4 > end or buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        (length,) = struct.unpack(">H", buf[pos + 2:pos + 4])
+        if marker in (0xC0, 0xC1, 0xC2):
+            if pos + 9 > end:
+                return None
+            h, w = struct.unpack(">HH", buf[pos + 5:pos + 9])
+            return (w, h) if w and h else None
+        if (0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC)) or marker in (0xD9, 0xDA):
+            return None
+        pos += 2 + length
+    return None
+
+
+# === Containers ===
+def _tiff_candidates(src, base=0):
+    tiff = _Tiff(src, base)
+    out = []
+    seen = set()
+    stack = [tiff.ifd0]
+    while stack and len(seen) < MAX_IFDS:
+        ifd = stack.pop()
+        if not ifd or ifd in seen:
+            continue
+        seen.add(ifd)
+        try:
+            tags = {t: tiff.value(ty, c, d) for t, ty, c, d in tiff.entries(ifd) if t in _WANTED}
+            stack.append(tiff.next_ifd(ifd))
+        except (HeaderError, struct.error):
+            continue
+        for off_tag, len_tag in _JPEG_PAIRS:
+            off, n = tags.get(off_tag), tags.get(len_tag)
+            # multi-strip images are never JPEG previews
+            if isinstance(off, int) and isinstance(n, int) and n > 0:
+                out.append((tiff.base + off, n))
+        sub = tags.get(SUB_IFDS)
+        if sub:
+            stack.extend(sub if isinstance(sub, tuple) else (sub,))
+    return out
+
+
+def _raf_candidates(src):
+    off, n = struct.unpack(">II", src.read(84, 8))
+    return [(off, n)]
+
+
+def _boxes(src, start, end):
+    """(type, payload_start, box_end) of the ISOBMFF boxes in [start, end)."""
+    pos = start
+    while pos + 8 <= end:
+        size, typ = struct.unpack(">I4s", src.read(pos, 8))
+        hdr = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", src.read(pos + 8, 8))
+            hdr = 16
+        elif size == 0:
+            size = end - pos
+        if size < hdr or pos + size > end:
+            return
+        yield typ, pos + hdr, pos + size
+        pos += size
+
+
+def _child(src, start, end, typ):
+    for t, a, b in _boxes(src, start, end):
+        if t == typ:
+            return a, b
+    return None
+
+
+def _first_track_sample(src, trak):
+    """(offset, size) of the first sample of a CR3 track (track 1 = full-size JPEG)."""
+    box = trak
+    for typ in (b"mdia", b"minf", b"stbl"):
+        box = _child(src, *box, typ)
+        if box is None:
+            return None
+    stsz = _child(src, *box, b"stsz")
+    co = _child(src, *box, b"co64")
+    wide = co is not None
+    co = co or _child(src, *box, b"stco")
+    if stsz is None or co is None:
+        return None
+    sample_size, count = struct.unpack(">II", src.read(stsz[0] + 4, 8))
+    if not sample_size and count:
+        (sample_size,) = struct.unpack(">I", src.read(stsz[0] + 12, 4))
+    (n,) = struct.unpack(">I", src.read(co[0] + 4, 4))
+    if not n or not sample_size:
+        return None
+    (off,) = struct.unpack(">Q" if wide else ">I", src.read(co[0] + 8, 8 if wide else 4))
+    return off, sample_size
+
+
+def _cr3_candidates(src):
+    out = []
+    size = len(src.mm)
+    for typ, a, b in _boxes(src, 0, size):
+        if typ == b"uuid" and src.read(a, 16) == _CR3_PREVIEW_UUID:
+            # uuid, 8 bytes, then the PRVW box: 16 bytes of fields before SOI
+            for t, pa, pb in _boxes(src, a + 24, b):
+                if t == b"PRVW":
+                    out.append((pa + 16, pb - pa - 16))
+        elif typ == b"moov":
+            trak = _child(src, a, b, b"trak")
+            if trak:
+                sample = _first_track_sample(src, trak)
+                if sample:
+                    out.append(sample)
+    return out
+
+
+def _candidates(src):
+    head = src.read(0, 16)
+    if head.startswith(b"FUJIFILMCCD-RAW"):
+        return _raf_candidates(src)
+    if head[4:12] == b"ftypcrx ":
+        return _cr3_candidates(src)
+    if head[:2] in (b"II", b"MM"):
+        return _tiff_candidates(src)
+    raise HeaderError("unsupported container")
+
+
+# === Public API ===
+def _map(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _best(mm):
+    src = _MapSource(mm)
+    best = None
+    for off, n in _candidates(src):
+        if off < 0 or n <= 0 or off + n > len(mm):
+            continue
+        dims = jpeg_size(mm, off, n)
+        if dims is None:
+            continue
+        key = (dims[0] * dims[1], n)
+        if best is None or key > best[0]:
+            best = (key, off, n, dims)
+    return best
+
+
+def preview_info(path):
+    """(offset, size, width, height) of the largest embedded JPEG, or None."""
+    try:
+        mm = _map(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        best = _best(mm)
+    except Exception:
+        return None
+    finally:
+        mm.close()
+    if best is None:
+        return None
+    _, off, n, (w, h) = best
+    return off, n, w, h
+
+
+def largest_jpeg(path):
+    """Largest embedded JPEG as a zero-copy memoryview over the mapped file, or None.
+
+    The mapping lives as long as the view; call .release() when done.
+    """
+    try:
+        mm = _map(path)
+    except (OSError, ValueError):
+        return None
+    try:
+        best = _best(mm)
+    except Exception:
+        # malformed file (bad offsets, truncated boxes, ...): never leak the mapping
+        best = None
+    if best is None:
+        mm.close()
+        return None
+    _, off, n, _ = best
+    return memoryview(mm)[off:off + n]
+
+
+def write_largest_jpeg(path, dst):
+    """Write the largest embedded JPEG of `path` to `dst`; False if none was found."""
+    view = largest_jpeg(path)
+    if view is None:
+        return False
+    try:
+        with open(dst, "wb") as f:
+            f.write(view)
+    finally:
+        view.release()
+    return True
+
+
+def extract_preview(src, dst, tags=PREVIEW_TAGS):
+    """Embedded JPEG of `src` -> `dst`: natively, else via exiftool. Returns the method or None."""
+    try:
+        if write_largest_jpeg(src, dst):
+            return "native"
+    except Exception as e:
+        print(f"⚠️ Native preview extraction failed for {src}, using exiftool: {e}", file=sys.stderr)
+    data = shared_pool().read_binary_tag(src, tags)
+    if not data:
+        if os.path.exists(dst):
+            # partial native write
+            os.remove(dst)
+        return None
+    with open(dst, "wb") as f:
+        f.write(data)
+    return "exiftool"
+
+
+def extract_previews(pairs, workers=PREVIEW_WORKERS):
+    """extract_preview over (src, dst) pairs; returns the dst paths written."""
+    def one(pair):
+        src, dst = pair
+        if extract_preview(src, dst) is None:
+            print(f"⚠️ No embedded JPEG in {src}", file=sys.stderr)
+            return None
+        return dst
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return [d for d in pool.map(one, pairs) if d]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("previews", help="extract embedded JPEGs for every RAW in each folder")
+    p.add_argument("folders", nargs="+")
+    p.add_argument("--subdir", default="jpg")
+    p = sub.add_parser("info", help="print the largest embedded JPEG of each file")
+    p.add_argument("files", nargs="+")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "info":
+        for f in args.files:
+            info = preview_info(f)
+            print(f, "none" if info is None else "offset=%d size=%d %dx%d" % info)
+        return 0
+    pairs = _preview_pairs(args.folders, args.subdir)
+    written = extract_previews(pairs)
+    # Missing previews are reported per group by the caller, not fatal here.
+    print(f"Extracted {len(written)}/{len(pairs)} previews")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
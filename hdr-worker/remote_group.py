@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Group brackets straight from R2 without downloading the RAWs.
+
+Each object's header is fetched with a ranged GET (first 64 KB, plus the odd
+extra range when an IFD points further in), parsed by exif_header and
+grouped by group_engine. Formats the native parser cannot read (CR3, RW2)
+get a larger head range that is handed to exiftool as a truncated file;
+metadata sits at the front of those containers, so that is enough.
+
+Ranged GETs that fail transiently (timeouts, dropped connections, 5xx /
+throttling) are retried RANGE_RETRIES times with backoff; a key that still
+fails takes the exiftool head path on its own, and is left out (with a
+warning) only if that fails too.
+
+Only the members of groups that are actually processed are downloaded in
+full (download_groups).
+
+    python3 remote_group.py <bucket> <prefix> [--manifest out.jsonl]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError, HTTPClientError, IncompleteReadError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+from exif_header import NATIVE_EXTS, HeaderError, parse_header
+from exiftool_session import exiftool_json
+from group_engine import group_by_camera
+from group_manifest import build_manifest, write_manifest
+from materialize import resolve_names
+from group_raw_brackets_exiftool import EXIF_FIELDS, RAW_EXTS, make_row
+
+R2_RAW_BUCKET = os.getenv("R2_RAW_BUCKET", "mvai-raw")
+RANGE_HEAD_BYTES = int(os.getenv("RANGE_HEAD_BYTES", str(64 * 1024)))
+RANGE_BLOCK_BYTES = int(os.getenv("RANGE_BLOCK_BYTES", str(64 * 1024)))
+FALLBACK_HEAD_BYTES = int(os.getenv("RANGE_FALLBACK_BYTES", str(1024 * 1024)))
+RANGE_WORKERS = int(os.getenv("RANGE_WORKERS", "32"))
+RANGE_RETRIES = int(os.getenv("RANGE_RETRIES", "3"))
+RANGE_RETRY_BACKOFF_SEC = float(os.getenv("RANGE_RETRY_BACKOFF_SEC", "0.5"))
+_TRANSIENT_CODES = {"SlowDown", "Throttling", "ThrottlingException", "RequestTimeout", "InternalError",
+                    "ServiceUnavailable", "TooManyRequests"}
+
+
+def r2_client():
+    """Same client settings as handler.py."""
+    return boto3.client(
+        "s3",
+        endpoint_url=os.getenv("R2_ENDPOINT"),
+        aws_access_key_id=os.getenv("R2_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("R2_SECRET_ACCESS_KEY"),
+    )
+
+
+def _transient(err):
+    """Worth retrying: connection / read failures, throttling and 5xx responses."""
+    if isinstance(err, (BotoConnectionError, HTTPClientError, IncompleteReadError)):
+        return True
+    if isinstance(err, ClientError):
+        status = err.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status >= 500 or status == 429 or err.response.get("Error", {}).get("Code") in _TRANSIENT_CODES
+    return False
+
+
+def get_range(client, bucket, key, start, size):
+    """Bytes [start, start + size) of an object; transient failures are retried."""
+    for attempt in range(1, RANGE_RETRIES + 1):
+        try:
+            resp = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{start + size - 1}")
+            return resp["Body"].read()
+        except (BotoCoreError, ClientError) as e:
+            if attempt >= RANGE_RETRIES or not _transient(e):
+                raise
+            time.sleep(RANGE_RETRY_BACKOFF_SEC * 2 ** (attempt - 1))
+
+
+class RangeSource:
+    """read(offset, size) over an object; the head is fetched once, other
+    reads are served from block-aligned ranged GETs cached per object."""
+
+    def __init__(self, client, bucket, key, head_bytes=RANGE_HEAD_BYTES):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.head = get_range(client, bucket, key, 0, head_bytes)
+        self.blocks = {}
+
+    def _block(self, n):
+        b = self.blocks.get(n)
+        if b is None:
+            b = self.blocks[n] = get_range(self.client, self.bucket, self.key, n * RANGE_BLOCK_BYTES, RANGE_BLOCK_BYTES)
+        return b
+
+    def read(self, offset, size):
+        end = offset + size
+        if end <= len(self.head):
+            return self.head[offset:end]
+        first, last = offset // RANGE_BLOCK_BYTES, (end - 1) // RANGE_BLOCK_BYTES
+        data = b"".join(self._block(n) for n in range(first, last + 1))
+        start = offset - first * RANGE_BLOCK_BYTES
+        out = data[start:start + size]
+        if len(out) < size:
+            raise HeaderError("truncated object")
+        return out
+
+
+def _objects(files):
+    """Normalise handler-style file dicts / plain keys to (bucket, key)."""
+    out = []
+    for f in files:
+        if isinstance(f, str):
+            out.append((R2_RAW_BUCKET, f))
+            continue
+        key = f.get("r2_key") or f.get("r2_key_raw")
+        if key:
+            out.append((f.get("r2_bucket") or R2_RAW_BUCKET, key))
+    return out
+
+
+def _native(client, bucket, key):
+    """Header record, or None to send this key down the exiftool head path."""
+    try:
+        return parse_header(RangeSource(client, bucket, key), key)
+    except (HeaderError, ClientError, BotoCoreError):
+        return None
+
+
+def _fetch_head(client, bucket, key, dst):
+    """Local copy of the object's head, or None when it cannot be fetched."""
+    try:
+        data = get_range(client, bucket, key, 0, FALLBACK_HEAD_BYTES)
+    except (ClientError, BotoCoreError) as e:
+        print(f"⚠️ Head fetch failed for s3://{bucket}/{key}: {e}", file=sys.stderr)
+        return None
+    with open(dst, "wb") as f:
+        f.write(data)
+    return dst
+
+
+def _exiftool_heads(client, objs, pool, tmp, fetched=None):
+    """exiftool over truncated head copies, for formats the native parser skips.
+
+    Head ranges are fetched on `pool`; `fetched` maps (bucket, key) to head
+    downloads already submitted there.
+    """
+    fetched = dict(fetched or {})
+    for i, (bucket, key) in enumerate(objs):
+        if (bucket, key) not in fetched:
+            p = os.path.join(tmp, f"r{i:06d}_{os.path.basename(key)}")
+            fetched[(bucket, key)] = pool.submit(_fetch_head, client, bucket, key, p)
+    if not fetched:
+        return {}
+    local = {fut.result(): key for (_, key), fut in fetched.items()}
+    local.pop(None, None)
+    if not local:
+        return {}
+    out = {}
+    for rec in exiftool_json(list(local), EXIF_FIELDS):
+        key = local.get(rec.get("SourceFile"))
+        if key is None:
+            continue
+        rec.update(SourceFile=key, Directory=os.path.dirname(key), FileName=os.path.basename(key))
+        out[key] = rec
+    return out
+
+
+def remote_records(files, client=None, workers=RANGE_WORKERS):
+    """exiftool-style records keyed by object key, read with ranged GETs only."""
+    client = client or r2_client()
+    objs = [o for o in _objects(files) if os.path.splitext(o[1])[1].lower() in RAW_EXTS]
+    # boto3 clients are thread-safe; one pool for all header fetches. Formats
+    # the native parser cannot read get their fallback head range right away,
+    # alongside the native reads, instead of after them.
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, tempfile.TemporaryDirectory() as tmp:
+        heads = {}
+        native_futs = []
+        for i, (bucket, key) in enumerate(objs):
+            if os.path.splitext(key)[1].lower() not in NATIVE_EXTS:
+                p = os.path.join(tmp, f"{i:06d}_{os.path.basename(key)}")
+                heads[(bucket, key)] = pool.submit(_fetch_head, client, bucket, key, p)
+                native_futs.append(None)
+            else:
+                native_futs.append(pool.submit(_native, client, bucket, key))
+        native = [f.result() if f else None for f in native_futs]
+        rest = [o for o, rec in zip(objs, native) if rec is None and o not in heads]
+        fallback = _exiftool_heads(client, rest, pool, tmp, heads)
+
+    records = []
+    for (bucket, key), rec in zip(objs, native):
+        rec = rec or fallback.get(key)
+        if rec is None:
+            print(f"⚠️ No metadata for s3://{bucket}/{key}", file=sys.stderr)
+            continue
+        rec["Bucket"] = bucket
+        records.append(rec)
+    return records
+
+
+def group_remote(files, client=None, workers=RANGE_WORKERS):
+    """Group R2 objects by header metadata, per camera body like the local path.
+
+    Returns (groups, strategies); rows carry "path" (= key) and "bucket".
+    """
+    rows = []
+    for rec in remote_records(files, client, workers):
+        row = make_row(rec)
+        if row:
+            row["bucket"] = rec["Bucket"]
+            rows.append(row)
+    rows.sort(key=lambda r: r["time"])
+    return group_by_camera(rows)
+
+
+def download_groups(groups, dest_dir, client=None, workers=8):
+    """Download the members of `groups` only; returns {key: local_path}."""
+    client = client or r2_client()
+    os.makedirs(dest_dir, exist_ok=True)
+    members = [r for g in groups for r in g]
+    planned = resolve_names([(r["path"], dest_dir) for r in members])
+    jobs = [(r.get("bucket") or R2_RAW_BUCKET, r["path"], dst) for r, (_, dst) in zip(members, planned)]
+
+    def one(job):
+        bucket, key, dst = job
+        client.download_file(bucket, key, dst)
+        return key, dst
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(pool.map(one, jobs))
+
+
+def list_keys(bucket, prefix, client=None):
+    client = client or r2_client()
+    keys = []
+    for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(o["Key"] for o in page.get("Contents", []))
+    return keys
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("bucket")
+    ap.add_argument("prefix")
+    ap.add_argument("--manifest", default=None, help="write the group manifest here (.jsonl or .parquet)")
+    args = ap.parse_args()
+
+    client = r2_client()
+    keys = list_keys(args.bucket, args.prefix, client)
+    groups, strategies = group_remote([{"r2_bucket": args.bucket, "r2_key": k} for k in keys], client)
+    names = [
+        f"group_{i:04d}_{g[0]['time'].strftime('%Y%m%d_%H%M%S')}_{len(g)}files"
+        for i, g in enumerate(groups, 1)
+    ]
+    if args.manifest:
+        write_manifest(args.manifest, build_manifest(groups, names, strategies))
+    for name, g in zip(names, groups):
+        print(name, " ".join(os.path.basename(r["path"]) for r in g))
+    print(f"Done. Objects: {len(keys)}. Groups: {len(groups)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,7 @@ fi
 PYTHON_BIN="${PYTHON_BIN:-python3}"
 ALIGN_BIN="$(command -v align_image_stack || true)"
 GROUP_SCRIPT="$(dirname "$0")/../group_raw_brackets_exiftool.py"
+PREVIEW_SCRIPT="$(dirname "$0")/../raw_preview.py"
 
 GROUPED_DIR="$OUT_DIR/RAW_GROUPED"
 FINAL_DIR="$OUT_DIR/HDR_FINAL"
@@ -24,6 +25,7 @@ command -v exiftool >/dev/null || { echo "❌ Missing exiftool"; exit 1; }
 command -v magick >/dev/null || { echo "❌ Missing ImageMagick (magick)"; exit 1; }
 [ -n "$ALIGN_BIN" ] || { echo "❌ Missing align_image_stack"; exit 1; }
 [ -f "$GROUP_SCRIPT" ] || { echo "❌ Missing group script: $GROUP_SCRIPT"; exit 1; }
+[ -f "$PREVIEW_SCRIPT" ] || { echo "❌ Missing preview helper: $PREVIEW_SCRIPT"; exit 1; }
 
 echo "IN_DIR : $IN_DIR"
 echo "OUT_DIR: $OUT_DIR"
@@ -33,9 +35,12 @@ echo "ALIGN_BIN: $ALIGN_BIN"
 # === 1) RAW 分组 ===
 "$PYTHON_BIN" "$GROUP_SCRIPT" "$IN_DIR" "$GROUPED_DIR" --mode A
 
+# === 2) 一次性导出所有组 RAW 的内嵌 JPG 到 <group>/jpg（mmap 直接取，取不到才走常驻 exiftool） ===
+"$PYTHON_BIN" "$PREVIEW_SCRIPT" previews --subdir jpg "$GROUPED_DIR"/group_*
+
 echo "Processing groups -> HDR / single"
 
-# === 2) 逐组处理 ===
+# === 3) 逐组处理 ===
 for g in "$GROUPED_DIR"/group_*; do
   [ -d "$g" ] || continue
   gname="$(basename "$g")"
@@ -44,9 +49,9 @@ for g in "$GROUPED_DIR"/group_*; do
   fix_dir="$g/fixed"
   align_dir="$g/aligned"
   mkdir -p "$jpg_dir" "$fix_dir" "$align_dir"
-  rm -f "$jpg_dir"/*.jpg "$fix_dir"/*.jpg "$align_dir"/*.tif 2>/dev/null || true
+  rm -f "$fix_dir"/*.jpg "$align_dir"/*.tif 2>/dev/null || true
 
-  files=$(find "$g" -maxdepth 1 -type f \( \
+  files=$(find "$g" -maxdepth 1 \( -type f -o -type l \) \( \
     -iname "*.arw" -o -iname "*.cr2" -o -iname "*.cr3" -o -iname "*.nef" -o -iname "*.dng" \
     -o -iname "*.rw2" -o -iname "*.orf" -o -iname "*.raf" \
     -o -iname "*.jpg" -o -iname "*.jpeg" \
@@ -62,22 +67,19 @@ for g in "$GROUPED_DIR"/group_*; do
     if echo "$f" | grep -Eiq '\.(jpg|jpeg)$'; then
       cp -f "$f" "$FINAL_DIR/${gname}.jpg"
     else
-      exiftool -PreviewImage -b "$f" > "$FINAL_DIR/${gname}.jpg" 2>/dev/null || \
-      exiftool -JpgFromRaw -b "$f" > "$FINAL_DIR/${gname}.jpg"
+      cp -f "$jpg_dir/$(basename "${f%.*}").jpg" "$FINAL_DIR/${gname}.jpg" || \
+        echo "  !! JPG extract failed"
     fi
     continue
   fi
 
   echo "==> $gname (HDR, images=$count)"
 
-  # === 导出 JPG ===
+  # === 导出 JPG（RAW 已在第 2 步批量导出，这里只需复制原生 JPG） ===
   for f in $files; do
     name="$(basename "${f%.*}")"
     if echo "$f" | grep -Eiq '\.(jpg|jpeg)$'; then
       cp -f "$f" "$jpg_dir/$name.jpg"
-    else
-      exiftool -PreviewImage -b "$f" > "$jpg_dir/$name.jpg" 2>/dev/null || \
-      exiftool -JpgFromRaw -b "$f" > "$jpg_dir/$name.jpg"
     fi
   done
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online bracket grouping.
+
+Feed rows (make_row dicts) roughly in capture order; a group is emitted as
+soon as a later frame falls outside the dynamic time gap or changes setup,
+so HDR work can start on early groups while the rest of the shoot is still
+uploading. A small reorder window absorbs frames that arrive slightly out
+of order (parallel uploads finish in any order). Each camera body
+(group_engine.camera_key) keeps its own open cluster, so two bodies shooting
+the same room interleave without cutting or joining each other's brackets.
+
+    grouper = StreamingGrouper()
+    for row in rows:
+        for group in grouper.push(row):
+            start_hdr(group)
+    for group in grouper.flush():
+        start_hdr(group)
+"""
+
+import heapq
+import itertools
+import sys
+
+from group_engine import camera_key, is_break, split_cluster
+
+REORDER_WINDOW_SEC = 5.0
+
+
+class StreamingGrouper:
+    def __init__(self, reorder_window_sec=REORDER_WINDOW_SEC):
+        self.window = reorder_window_sec
+        self._heap = []
+        self._tie = itertools.count()
+        self._newest = None
+        self._released = None
+        self._clusters = {}
+
+    def push(self, row):
+        """Add one frame; returns the groups that became final because of it."""
+        if self._released is not None and row["time"] < self._released:
+            return self._late(row)
+        heapq.heappush(self._heap, (row["time"], next(self._tie), row))
+        if self._newest is None or row["time"] > self._newest:
+            self._newest = row["time"]
+
+        closed = []
+        # Anything older than (newest - window) can no longer be overtaken.
+        while self._heap and (self._newest - self._heap[0][0]).total_seconds() > self.window:
+            closed.extend(self._release(heapq.heappop(self._heap)[2]))
+        return closed
+
+    def flush(self):
+        """End of stream: release everything and close the open clusters (oldest first)."""
+        closed = []
+        while self._heap:
+            closed.extend(self._release(heapq.heappop(self._heap)[2]))
+        for key in sorted(self._clusters, key=lambda k: self._clusters[k][0]["time"]):
+            closed.extend(self._close(key))
+        return closed
+
+    def _release(self, row):
+        self._released = row["time"]
+        key = camera_key(row)
+        cluster = self._clusters.get(key)
+        closed = []
+        if cluster and is_break(cluster[-1], row):
+            closed = self._close(key)
+        self._clusters.setdefault(key, []).append(row)
+        return closed
+
+    def _close(self, key):
+        cluster = self._clusters.pop(key, [])
+        return split_cluster(cluster) if cluster else []
+
+    def _late(self, row):
+        # Arrived after its neighbours were already released: slot it into its
+        # body's open cluster if it belongs there, otherwise emit it on its own.
+        c = self._clusters.get(camera_key(row))
+        if c and c[0]["time"] <= row["time"]:
+            i = len(c)
+            while i > 0 and c[i - 1]["time"] > row["time"]:
+                i -= 1
+            if not is_break(c[i - 1], row) and (i == len(c) or not is_break(row, c[i])):
+                c.insert(i, row)
+                return []
+        print(f"⚠️ Late frame {row.get('path')} arrived outside the reorder window", file=sys.stderr)
+        return [[row]]
+
+
+def stream_groups(records, make_row=None, reorder_window_sec=REORDER_WINDOW_SEC):
+    """Generator form: yields each group as soon as it is closed.
+
+    `records` may be raw exiftool dicts when `make_row` converts them (records
+    it rejects, e.g. no capture time, are skipped).
+    """
+    grouper = StreamingGrouper(reorder_window_sec)
+    for rec in records:
+        row = make_row(rec) if make_row else rec
+        if row is None:
+            continue
+        yield from grouper.push(row)
+    yield from grouper.flush()
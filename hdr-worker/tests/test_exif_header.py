@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+import exif_header
+from exif_header import read_exif_records, read_header
+
+FIELDS = ["-n", "-DateTimeOriginal", "-Model", "-SequenceNumber", "-BurstUUID", "-BracketShotNumber"]
+MAKER_NOTE_AT = 600
+
+
+def _ifd(at, entries, e="<"):
+    """IFD at offset `at` followed by its out-of-line values. A payload is
+    bytes, or an int offset for data the caller places itself."""
+    head = struct.pack(e + "H", len(entries))
+    tail = b""
+    data_at = at + 2 + 12 * len(entries) + 4
+    for tag, typ, count, payload in sorted(entries, key=lambda x: x[0]):
+        if isinstance(payload, int):
+            value = struct.pack(e + "I", payload)
+        elif len(payload) <= 4:
+            value = payload.ljust(4, b"\0")
+        else:
+            value = struct.pack(e + "I", data_at + len(tail))
+            tail += payload + b"\0" * (len(payload) % 2)
+        head += struct.pack(e + "HHI", tag, typ, count) + value
+    return head + b"\0\0\0\0" + tail
+
+
+def _ascii(text):
+    data = text.encode() + b"\0"
+    return 2, len(data), data
+
+
+def _shorts(values, e="<"):
+    return 3, len(values), struct.pack(f"{e}{len(values)}H", *values)
+
+
+def _raw(tmp_path, name, make, maker_note=None, e="<"):
+    """Minimal TIFF RAW: IFD0 (Make, Model), Exif IFD (capture time, maker note at MAKER_NOTE_AT)."""
+    buf = bytearray(4096)
+    buf[0:8] = (b"II" if e == "<" else b"MM") + struct.pack(e + "HI", 42, 8)
+    ifd0 = _ifd(8, [(0x010F, *_ascii(make)), (0x0110, *_ascii(make + " X1")), (0x8769, 4, 1, 200)], e)
+    buf[8:8 + len(ifd0)] = ifd0
+    exif = [(0x9003, *_ascii("2024:05:01 10:00:00"))]
+    if maker_note is not None:
+        note = maker_note(MAKER_NOTE_AT)
+        exif.append((0x927C, 7, len(note), MAKER_NOTE_AT))
+        buf[MAKER_NOTE_AT:MAKER_NOTE_AT + len(note)] = note
+    exif = _ifd(200, exif, e)
+    buf[200:200 + len(exif)] = exif
+    path = tmp_path / name
+    path.write_bytes(bytes(buf))
+    return str(path)
+
+
+def _canon(at):
+    # ShotInfo[9] = SequenceNumber, FileInfo[5] = BracketShotNumber; offsets from the TIFF header
+    return _ifd(at, [(0x0004, *_shorts([24, 0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0])),
+                     (0x0093, *_shorts([16, 0, 0, 3, 0, 2, 0, 0]))])
+
+
+def _fuji(at):
+    return b"FUJIFILM" + struct.pack("<I", 12) + _ifd(12, [(0x1101, *_shorts([2]))])
+
+
+def _sony(at):
+    return b"SONY DSC \0\0\0" + _ifd(at + 12, [(0xB04A, *_shorts([4], ">"))], ">")
+
+
+def _apple(at):
+    uuid = "0B3E2E5C-3C8A-4D5A-9A53-8E0D3B1C2A11"
+    return b"Apple iOS\0\0\x01MM" + _ifd(14, [(0x000B, *_ascii(uuid))], ">")
+
+
+@pytest.mark.parametrize("make, note, e, expected", [
+    ("Canon", _canon, "<", {"SequenceNumber": 3, "BracketShotNumber": 2}),
+    ("FUJIFILM", _fuji, "<", {"SequenceNumber": 2}),
+    ("SONY", _sony, ">", {"SequenceNumber": 4}),
+    ("Apple", _apple, "<", {"BurstUUID": "0B3E2E5C-3C8A-4D5A-9A53-8E0D3B1C2A11"}),
+])
+def test_sequence_tags_decoded_natively(tmp_path, make, note, e, expected):
+    rec = read_header(_raw(tmp_path, "a.dng", make, note, e))
+    assert rec["Make"] == make and rec["DateTimeOriginal"] == "2024:05:01 10:00:00"
+    assert {k: rec[k] for k in exif_header.SEQUENCE_TAGS if k in rec} == expected
+
+
+def test_native_reader_starts_no_exiftool_by_default(tmp_path, monkeypatch):
+    def no_exiftool(files, fields):
+        raise AssertionError(f"exiftool called for {files}")
+
+    monkeypatch.setattr(exif_header, "exiftool_json", no_exiftool)
+    files = [_raw(tmp_path, "a.dng", "Canon", _canon), _raw(tmp_path, "b.dng", "SONY")]
+    recs = read_exif_records(files, FIELDS, reader="native")
+    assert [r["FileName"] for r in recs] == ["a.dng", "b.dng"]
+    assert recs[0]["SequenceNumber"] == 3 and "SequenceNumber" not in recs[1]
+
+
+def test_opt_in_exiftool_pass_only_asks_for_untagged_sequence_makes(tmp_path, monkeypatch):
+    asked = []
+
+    def fake_exiftool(files, fields):
+        asked.extend(files)
+        return [{"SourceFile": f, "SequenceNumber": 1} for f in files]
+
+    monkeypatch.setattr(exif_header, "exiftool_json", fake_exiftool)
+    monkeypatch.setattr(exif_header, "READ_SEQUENCE_TAGS", True)
+    files = [
+        _raw(tmp_path, "canon.dng", "Canon", _canon),   # decoded natively
+        _raw(tmp_path, "sony.dng", "SONY"),             # enciphered / missing: asked
+        _raw(tmp_path, "nikon.dng", "NIKON CORPORATION"),  # no sequence tags to find
+    ]
+    recs = read_exif_records(files, FIELDS, reader="native")
+    assert asked == [files[1]]
+    assert [r.get("SequenceNumber") for r in recs] == [3, 1, None]
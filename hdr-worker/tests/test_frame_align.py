@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+
+from frame_align import align_stack, is_stable, measure_shifts
+
+PAD = 32
+
+
+def _scene(h, w, seed=0):
+    """Linear radiance: blocky texture under bright windows and deep shadows."""
+    rng = np.random.default_rng(seed)
+    h, w = h + 2 * PAD, w + 2 * PAD
+
+    def noise(scale):
+        n = rng.standard_normal((h // scale + 1, w // scale + 1)).astype(np.float32)
+        return np.kron(n, np.ones((scale, scale), np.float32))[:h, :w]
+
+    tex = np.clip(1 + 0.25 * noise(2) + 0.25 * noise(8) + 0.2 * noise(32), 0.05, None)
+    illum = np.full((h, w), 0.25, np.float32)
+    for level in (4.0, 0.0002) * 4:  # blown-out windows, crushed shadows
+        y, x = rng.integers(0, h - 80), rng.integers(0, w - 120)
+        illum[y:y + rng.integers(30, 80), x:x + rng.integers(40, 120)] = level
+    return tex * illum
+
+
+def _bracket(shifts, evs=(-2, 0, 2), h=400, w=600, seed=0):
+    """uint8 RGB frames; frame i shows the scene moved by shifts[i] (integer px)."""
+    sc = _scene(h, w, seed)
+    rng = np.random.default_rng(seed + 1)
+    frames = []
+    for (dy, dx), ev in zip(shifts, evs):
+        crop = sc[PAD - dy:PAD - dy + h, PAD - dx:PAD - dx + w]
+        v = np.clip(crop * 2.0 ** ev, 0, 1) ** (1 / 2.2) * 255 + rng.normal(0, 1.5, crop.shape)
+        g = np.clip(v + 0.5, 0, 255).astype(np.uint8)
+        frames.append(np.repeat(g[..., None], 3, axis=2))
+    return frames
+
+
+@pytest.mark.parametrize("shifts", [
+    [(0, 0), (0, 0), (4, -6)],
+    [(-3, 2), (0, 0), (0, 0)],
+    [(5, 5), (0, 0), (-3, 2)],
+])
+def test_align_recovers_shift_of_clipped_frames(shifts):
+    frames = _bracket(shifts)
+    # mostly blown-out +2 EV / crushed -2 EV frames, not just a few clipped pixels
+    assert (frames[2] >= 250).mean() > 0.1 and (frames[0] <= 4).mean() > 0.05
+    _, transforms = align_stack(frames, rotation=False)
+    for (dy, dx), t in zip(shifts, transforms):
+        assert "unaligned" not in t
+        assert math.hypot(t["dy"] - dy, t["dx"] - dx) < 0.5, (dy, dx, t)
+
+
+@pytest.mark.parametrize("shift", [(3, 0), (0, -4), (-5, 6), (8, 0)])
+def test_shifted_bracket_is_not_stable(shift):
+    shifts = measure_shifts(_bracket([(0, 0), (0, 0), shift]))
+    assert math.hypot(shifts[2]["dy"] - shift[0], shifts[2]["dx"] - shift[1]) < 0.5
+    assert not is_stable(shifts, 0.5)
+
+
+def test_tripod_bracket_is_stable():
+    assert is_stable(measure_shifts(_bracket([(0, 0)] * 3)), 0.5)
+
+
+@pytest.mark.parametrize("shift, stable", [((0, 0), True), ((1, 0), False), ((0, -1), False)])
+def test_subpixel_tolerance_on_downsampled_check(shift, stable):
+    # 1800 px wide: the check runs on a 2x block-averaged thumbnail, where a
+    # 1 px shift of the full frame is half a thumbnail pixel
+    shifts = measure_shifts(_bracket([(0, 0), (0, 0), shift], h=1200, w=1800), side=1024)
+    assert is_stable(shifts, 0.5) == stable, shifts
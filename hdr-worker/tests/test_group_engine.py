@@ -0,0 +1,238 @@
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from bench_grouping import synthetic_catalog
+from group_engine import group_by_camera, group_by_sequence, group_row_dicts
+from group_raw_brackets_exiftool import read_rows
+
+T0 = datetime(2024, 5, 1, 10, 0, 0)
+
+
+# === Reference: the row-by-row grouping of the baseline script's main() ===
+# Transcribed over parsed rows. Two artefacts of its pandas / `or` parsing are
+# left out on purpose: EV 0 read as missing, and a missing EV in a catalog with
+# known ones (NaN, not None) never falling back to log2(shutter).
+def _num(v, default):
+    return default if v is None or v != v else float(v)
+
+
+def _allowed_gap(a, b):
+    return max(3.0, 1.2 + 2.5 * max(_num(a["shutter"], 0.0), _num(b["shutter"], 0.0)))
+
+
+def _same_setup(a, b):
+    if a["fnum"] and b["fnum"] and abs(a["fnum"] - b["fnum"]) > 0.2:
+        return False
+    if a["focal"] and b["focal"] and abs(a["focal"] - b["focal"]) > 2.0:
+        return False
+    return True
+
+
+def _exposure(item):
+    if item["ev"] is not None:
+        return _num(item["ev"], None)
+    shutter = _num(item["shutter"], None)
+    return math.log2(shutter) if shutter is not None and shutter > 0 else None
+
+
+def _split(cluster):
+    if len(cluster) <= 7:
+        return [cluster]
+    groups, current = [], []
+    direction, start, lo, hi = 0, None, None, None
+    for item in cluster:
+        exp = _exposure(item)
+        split = not current or len(current) >= 7
+        prev_exp = _exposure(current[-1]) if current else None
+        if not split and exp is not None and prev_exp is not None:
+            delta = exp - prev_exp
+            if direction == 0 and abs(delta) >= 0.4:
+                direction = 1 if delta > 0 else -1
+            exp_range = hi - lo if lo is not None else 0.0
+            flip = (direction > 0 and delta < -0.6) or (direction < 0 and delta > 0.6)
+            back = start is not None and abs(exp - start) <= 0.4
+            split = len(current) >= 2 and flip and (back or exp_range >= 0.6)
+        if split:
+            if current:
+                groups.append(current)
+            current, direction, start, lo, hi = [item], 0, exp, exp, exp
+            continue
+        current.append(item)
+        if exp is not None:
+            lo = exp if lo is None else min(lo, exp)
+            hi = exp if hi is None else max(hi, exp)
+    groups.append(current)
+    return groups
+
+
+def _time_clusters(rows):
+    clusters = []
+    for row in sorted(rows, key=lambda r: r["time"]):
+        prev = clusters[-1][-1] if clusters else None
+        if prev and (row["time"] - prev["time"]).total_seconds() <= _allowed_gap(prev, row) \
+                and _same_setup(prev, row):
+            clusters[-1].append(row)
+        else:
+            clusters.append([row])
+    return clusters
+
+
+def _baseline_groups(rows):
+    return [g for c in _time_clusters(rows) for g in _split(c)]
+
+
+def _paths(groups):
+    return [[r["path"] for r in g] for g in groups]
+
+
+# === Catalogs ===
+def _rec(name, sec, ev=None, shutter=1 / 60, fnum=8.0, focal=24.0, body=("ILCE-7M4", "1"), **tags):
+    stamp = T0 + timedelta(seconds=sec)
+    rec = {
+        "Directory": "/shoot", "FileName": name,
+        "SubSecDateTimeOriginal": stamp.strftime("%Y:%m:%d %H:%M:%S.%f")[:-4],
+        "ExposureTime": shutter, "FNumber": fnum, "FocalLength": focal,
+        "Model": body[0], "SerialNumber": body[1],
+    }
+    if ev is not None:
+        rec["ExposureBiasValue"] = ev
+    rec.update(tags)
+    return rec
+
+
+def _rough_catalog(n, seed):
+    """Single body, no sequence tags: gaps on the 3 s limit, long clusters,
+    missing EV / shutter / aperture and setup changes."""
+    rnd = random.Random(seed)
+    recs, t = [], 0.0
+    for i in range(n):
+        # EVs and gaps on binary fractions, so both sides see the same exact values
+        ev = rnd.choice((None, -2.0, -1.0, -0.5, 0.0, 0.5, 1.0, 2.0))
+        shutter = rnd.choice((None, 1 / 256, 1 / 64, 0.25, 1.0))
+        fnum = rnd.choice((0,) + (8.0,) * 12 + (11.0,))
+        focal = rnd.choice((24.0,) * 15 + (35.0,))
+        recs.append(_rec(f"F{i:05d}.ARW", t, ev, shutter, fnum, focal))
+        t += rnd.choice((0.5, 0.5, 1.0, 1.0, 2.0, 3.0, 3.0, 3.5, 9.0))
+    return recs
+
+
+@pytest.mark.parametrize("scenario", ["brackets", "singles", "missing_ev", "long_exposure"])
+def test_matches_baseline_on_synthetic_shoots(scenario):
+    rows, cols = read_rows(synthetic_catalog(3000, scenario, seed=7)[0])
+    expected = _paths(_baseline_groups(rows))
+    assert _paths(group_row_dicts(rows)) == expected
+    groups, strategies = group_by_camera(rows, cols=cols)
+    assert _paths(groups) == expected and set(strategies) == {"time_gap"}
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_baseline_on_rough_catalogs(seed):
+    rows, cols = read_rows(_rough_catalog(2000, seed))
+    expected = _paths(_baseline_groups(rows))
+    assert any(len(c) > 7 for c in _time_clusters(rows))
+    assert _paths(group_row_dicts(rows)) == expected
+    assert _paths(group_by_camera(rows, cols=cols)[0]) == expected
+
+
+def test_parallel_partitions_match_serial():
+    rows, cols = read_rows(synthetic_catalog(4000, "mixed", seed=3)[0])
+    serial = group_by_camera(rows, workers=1, cols=cols)
+    assert group_by_camera(rows, workers=2, cols=cols) == serial
+
+
+# === Sequence tags ===
+def _back_to_back(tag, values, evs=(0.0, -2.0, 2.0) * 2):
+    return [_rec(f"S{i}.ARW", 0.5 * i, ev, **{tag: v}) for i, (ev, v) in enumerate(zip(evs, values))]
+
+
+@pytest.mark.parametrize("tag, values, strategy", [
+    ("SequenceNumber", [1, 2, 3, 1, 2, 3], "sequence_number"),
+    ("BracketShotNumber", [1, 2, 3, 1, 2, 3], "bracket_shot_number"),
+    ("BurstUUID", ["A"] * 3 + ["B"] * 3, "burst_uuid"),
+    ("BracketSequence", [7] * 3 + [8] * 3, "bracket_sequence"),
+])
+def test_sequence_tags_split_back_to_back_brackets(tag, values, strategy):
+    rows, cols = read_rows(_back_to_back(tag, values))
+    # the time heuristic keeps all six frames (one cluster of <= MAX_BRACKET)
+    assert _paths(group_row_dicts(rows)) == [[f"/shoot/S{i}.ARW" for i in range(6)]]
+    groups, strategies = group_by_sequence(rows)
+    assert _paths(groups) == [[f"/shoot/S{i}.ARW" for i in range(3)], [f"/shoot/S{i}.ARW" for i in range(3, 6)]]
+    assert strategies == [strategy, strategy]
+    assert group_by_camera(rows, cols=cols) == (groups, strategies)
+
+
+@pytest.mark.parametrize("tag, values", [
+    ("SequenceNumber", [2, 3, 4, 5, 6, 7]),           # run does not start at 1
+    ("SequenceNumber", [0, 0, 0, 0, 0, 0]),           # "no sequence"
+    ("BurstUUID", ["A"] * 6 + ["A"] * 3),             # bucket longer than MAX_BRACKET
+    ("BurstUUID", ["0"] * 6),                          # placeholder identifier
+])
+def test_implausible_sequence_tags_fall_back_to_time_gap(tag, values):
+    evs = (0.0, -2.0, 2.0) * 3
+    rows, _ = read_rows(_back_to_back(tag, values, evs[:len(values)]))
+    groups, strategies = group_by_sequence(rows)
+    assert groups == group_row_dicts(rows)
+    assert set(strategies) == {"time_gap"}
+
+
+def test_sequence_run_is_not_carried_across_a_time_gap():
+    recs = [_rec("a.ARW", 0, 0.0, SequenceNumber=1), _rec("b.ARW", 1, -2.0, SequenceNumber=2),
+            _rec("c.ARW", 30, 2.0, SequenceNumber=3)]
+    groups, strategies = group_by_sequence(read_rows(recs)[0])
+    assert _paths(groups) == [["/shoot/a.ARW", "/shoot/b.ARW"], ["/shoot/c.ARW"]]
+    assert strategies == ["sequence_number", "time_gap"]
+
+
+def test_burst_uuid_split_by_a_setup_change_falls_back():
+    recs = [_rec("a.ARW", 0, 0.0, BurstUUID="A"), _rec("b.ARW", 1, -2.0, BurstUUID="A"),
+            _rec("c.ARW", 2, 2.0, focal=70.0, BurstUUID="A")]
+    groups, strategies = group_by_sequence(read_rows(recs)[0])
+    assert _paths(groups) == [["/shoot/a.ARW", "/shoot/b.ARW"], ["/shoot/c.ARW"]]
+    assert strategies == ["time_gap", "time_gap"]
+
+
+# === Several bodies ===
+BODY_A, BODY_B = ("ILCE-7M4", "1"), ("ILCE-7M4", "2")
+
+
+def _interleaved(tags_a=False, tags_b=False):
+    recs = []
+    for k in range(4):
+        t = 20.0 * k
+        for i, ev in enumerate((0.0, -2.0, 2.0)):
+            tag = {"SequenceNumber": i + 1} if tags_a else {}
+            recs.append(_rec(f"a{k}{i}.ARW", t + 1.0 * i, ev, body=BODY_A, **tag))
+            tag = {"SequenceNumber": i + 1} if tags_b else {}
+            recs.append(_rec(f"b{k}{i}.ARW", t + 0.5 + 1.0 * i, ev, body=BODY_B, **tag))
+    return recs
+
+
+def _expected_interleaved():
+    return [[f"/shoot/{b}{k}{i}.ARW" for i in range(3)] for k in range(4) for b in "ab"]
+
+
+def test_interleaved_bodies_are_grouped_apart():
+    rows, cols = read_rows(_interleaved())
+    # one body at a time would see a single 6-frame cluster per composition
+    assert all(len(g) == 6 for g in group_row_dicts(rows))
+    groups, strategies = group_by_camera(rows, cols=cols)
+    assert _paths(groups) == _expected_interleaved()
+    assert strategies == ["time_gap"] * 8
+
+
+def test_bodies_keep_their_own_strategy():
+    rows, cols = read_rows(_interleaved(tags_a=True))
+    groups, strategies = group_by_camera(rows, cols=cols)
+    assert _paths(groups) == _expected_interleaved()
+    assert strategies == ["sequence_number", "time_gap"] * 4
+
+
+def test_equal_sequence_values_on_two_bodies_are_not_merged():
+    recs = [_rec(f"{b}{i}.ARW", 0.4 * i + (0.2 if b == "b" else 0), ev, body=body, BurstUUID="SAME")
+            for b, body in (("a", BODY_A), ("b", BODY_B)) for i, ev in enumerate((0.0, -2.0, 2.0))]
+    groups, strategies = group_by_camera(read_rows(recs)[0])
+    assert _paths(groups) == [[f"/shoot/a{i}.ARW" for i in range(3)], [f"/shoot/b{i}.ARW" for i in range(3)]]
+    assert strategies == ["burst_uuid", "burst_uuid"]
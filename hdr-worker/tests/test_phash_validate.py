@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from phash_validate import validate_groups
+
+T0 = datetime(2024, 5, 1, 10, 0, 0)
+
+
+def _row(name, sec, ev, model="A7 IV", serial="1"):
+    return {"path": name, "time": T0 + timedelta(seconds=sec), "ev": ev, "shutter": None,
+            "fnum": 8.0, "focal": 24.0, "model": model, "serial": serial}
+
+
+def _same_room(groups):
+    # every frame hashes alike: merging is decided by time / body / exposure only
+    return {r["path"]: np.zeros(16, dtype=np.uint8) for g in groups for r in g}
+
+
+def _paths(groups):
+    return [[r["path"] for r in g] for g in groups]
+
+
+def test_merge_joins_a_bracket_cut_in_two():
+    groups = [[_row("a1", 0, -2), _row("a2", 1, 0)], [_row("a3", 8, 2)]]
+    out, strategies = validate_groups(groups, ["time_gap", "time_gap"], _same_room(groups))
+    assert _paths(out) == [["a1", "a2", "a3"]]
+    assert strategies == ["time_gap+phash_merge"]
+
+
+def test_merge_never_joins_two_bodies():
+    groups = [
+        [_row("a1", 0, -2), _row("a2", 1, 0)],
+        [_row("b1", 3, 2, serial="2")],
+    ]
+    out, strategies = validate_groups(groups, ["time_gap", "time_gap"], _same_room(groups))
+    assert _paths(out) == [["a1", "a2"], ["b1"]]
+    assert strategies == ["time_gap", "time_gap"]
+
+
+def test_merge_skips_another_body_in_between():
+    groups = [
+        [_row("a1", 0, -2), _row("a2", 1, 0)],
+        [_row("b1", 2, -1, serial="2"), _row("b2", 3, 1, serial="2")],
+        [_row("a3", 8, 2)],
+    ]
+    out, _ = validate_groups(groups, None, _same_room(groups))
+    assert _paths(out) == [["a1", "a2", "a3"], ["b1", "b2"]]
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+import hdr_pipeline
+from hdr_pipeline import extract_frames
+from hdr_stream import HdrStream
+
+
+@pytest.fixture(autouse=True)
+def _fake_preview(monkeypatch):
+    # the "preview" is the source path, so a collision shows up as a wrong owner
+    def extract_preview(src, dst):
+        with open(dst, "w") as f:
+            f.write(src)
+        return dst
+
+    monkeypatch.setattr(hdr_pipeline, "extract_preview", extract_preview)
+
+
+def _owners(pairs):
+    out = {}
+    for src, jpeg in pairs:
+        with open(jpeg) as f:
+            out[src] = f.read()
+    return out
+
+
+def test_extract_frames_keeps_equal_stems_apart(tmp_path):
+    members = ["in/IMG_1.CR2", "in/IMG_1.NEF", "in/IMG_2.CR2"]
+    extracted = extract_frames(members, str(tmp_path))
+    assert [os.path.basename(j) for _, j in extracted] == ["IMG_1.jpg", "IMG_1_1.jpg", "IMG_2.jpg"]
+    assert _owners(extracted) == {m: m for m in members}
+
+
+def test_extract_frames_overwrites_previews_of_a_previous_run(tmp_path):
+    extract_frames(["in/IMG_1.CR2"], str(tmp_path))
+    extracted = extract_frames(["in/IMG_1.CR2"], str(tmp_path))
+    assert [os.path.basename(j) for _, j in extracted] == ["IMG_1.jpg"]
+
+
+def test_stream_previews_do_not_collide(tmp_path, monkeypatch):
+    monkeypatch.setattr(HdrStream, "_prepare", lambda self, path, jpeg: (path, hdr_pipeline.extract_frame(path, jpeg)))
+    members = ["a/IMG_1.CR2", "b/IMG_1.ARW", "c/IMG_1.CR2"]
+    with HdrStream(str(tmp_path)) as stream:
+        for m in members:
+            stream.add(m)
+        pairs = [fut.result() for fut in stream._frames]
+    assert len({j for _, j in pairs}) == 3
+    assert _owners(pairs) == {m: m for m in members}
@@ -0,0 +1,62 @@
+import pytest
+
+import raw_preview
+
+
+class _Pool:
+    def __init__(self, data):
+        self.data = data
+        self.asked = []
+
+    def read_binary_tag(self, src, tags):
+        self.asked.append(src)
+        return self.data
+
+
+@pytest.fixture
+def raw(tmp_path):
+    path = tmp_path / "a.ARW"
+    path.write_bytes(b"II*\0" + b"\0" * 1020)
+    return str(path)
+
+
+@pytest.fixture
+def maps(monkeypatch):
+    opened = []
+    real = raw_preview._map
+
+    def track(path):
+        opened.append(real(path))
+        return opened[-1]
+
+    monkeypatch.setattr(raw_preview, "_map", track)
+    return opened
+
+
+@pytest.mark.parametrize("error", [IndexError, ValueError, OverflowError, MemoryError])
+def test_parser_failure_closes_the_mapping(raw, maps, monkeypatch, error):
+    def broken(mm):
+        raise error("malformed")
+
+    monkeypatch.setattr(raw_preview, "_best", broken)
+    assert raw_preview.largest_jpeg(raw) is None
+    assert raw_preview.preview_info(raw) is None
+    assert len(maps) == 2 and all(mm.closed for mm in maps)
+
+
+def test_native_failure_falls_back_to_exiftool(raw, tmp_path, monkeypatch):
+    def broken(path, dst):
+        with open(dst, "wb") as f:
+            f.write(b"partial")
+        raise OSError("short write")
+
+    pool = _Pool(b"\xff\xd8jpeg")
+    monkeypatch.setattr(raw_preview, "write_largest_jpeg", broken)
+    monkeypatch.setattr(raw_preview, "shared_pool", lambda: pool)
+    dst = tmp_path / "a.jpg"
+    assert raw_preview.extract_preview(raw, str(dst)) == "exiftool"
+    assert pool.asked == [raw] and dst.read_bytes() == b"\xff\xd8jpeg"
+
+    pool.data = None
+    assert raw_preview.extract_preview(raw, str(dst)) is None
+    assert not dst.exists()
@@ -0,0 +1,66 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.exceptions import ClientError, ReadTimeoutError  # noqa: E402
+
+import remote_group  # noqa: E402
+
+
+class _Client:
+    """get_object that fails with the queued errors first, then serves `data`."""
+
+    def __init__(self, data=b"", errors=()):
+        self.data = data
+        self.errors = list(errors)
+        self.calls = 0
+        self.downloads = []
+
+    def get_object(self, Bucket, Key, Range):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        start, end = map(int, Range[len("bytes="):].split("-"))
+        return {"Body": io.BytesIO(self.data[start:end + 1])}
+
+    def download_file(self, bucket, key, dst):
+        self.downloads.append((bucket, key, dst))
+
+
+def _client_error(code, status):
+    return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "GetObject")
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(remote_group, "RANGE_RETRY_BACKOFF_SEC", 0)
+
+
+def test_transient_errors_are_retried():
+    client = _Client(b"0123456789", [ReadTimeoutError(endpoint_url="r2"), _client_error("SlowDown", 503)])
+    assert remote_group.get_range(client, "b", "k", 2, 4) == b"2345"
+    assert client.calls == 3
+
+
+def test_missing_object_is_not_retried():
+    client = _Client(errors=[_client_error("NoSuchKey", 404)])
+    with pytest.raises(ClientError):
+        remote_group.get_range(client, "b", "k", 0, 4)
+    assert client.calls == 1
+
+
+def test_native_falls_back_after_retries_run_out():
+    client = _Client(errors=[ReadTimeoutError(endpoint_url="r2")] * remote_group.RANGE_RETRIES)
+    assert remote_group._native(client, "b", "IMG_1.ARW") is None
+    assert client.calls == remote_group.RANGE_RETRIES
+
+
+def test_download_groups_dedupes_names(tmp_path):
+    (tmp_path / "IMG_1.ARW").write_bytes(b"")
+    client = _Client()
+    groups = [[{"path": "a/IMG_1.ARW", "bucket": "x"}, {"path": "b/IMG_1.ARW"}], [{"path": "a/IMG_2.ARW"}]]
+    remote_group.download_groups(groups, str(tmp_path), client)
+    names = sorted(os.path.basename(dst) for _, _, dst in client.downloads)
+    assert names == ["IMG_1_1.ARW", "IMG_1_2.ARW", "IMG_2.ARW"]
@@ -0,0 +1,42 @@
+import random
+from datetime import datetime, timedelta
+
+from group_engine import group_by_camera
+from stream_grouper import stream_groups
+
+T0 = datetime(2024, 5, 1, 10, 0, 0)
+
+
+def _row(name, sec, ev, serial):
+    return {"path": name, "time": T0 + timedelta(seconds=sec), "ev": ev, "shutter": None,
+            "fnum": 8.0, "focal": 24.0, "model": "A7 IV", "serial": serial}
+
+
+def _two_bodies():
+    """Two bodies bracketing the same room, their frames interleaved in time."""
+    rows = []
+    for k in range(6):
+        t = 20.0 * k
+        rows += [_row(f"a{k}_{i}", t + 1.5 * i, ev, "1") for i, ev in enumerate((-2, 0, 2))]
+        rows += [_row(f"b{k}_{i}", t + 0.7 + 1.5 * i, ev, "2") for i, ev in enumerate((-1, 1))]
+    return sorted(rows, key=lambda r: r["time"])
+
+
+def _paths(groups):
+    return sorted([r["path"] for r in g] for g in groups)
+
+
+def test_interleaved_bodies_match_batch_grouping():
+    rows = _two_bodies()
+    batch, _ = group_by_camera(rows)
+    assert all(len({r["serial"] for r in g}) == 1 for g in batch)
+    assert _paths(stream_groups(rows)) == _paths(batch)
+
+
+def test_out_of_order_arrival_within_window():
+    rows = _two_bodies()
+    shuffled = rows[:]
+    random.Random(0).shuffle(shuffled)
+    # every frame arrives within the reorder window of its capture position
+    shuffled.sort(key=lambda r: (r["time"] - T0).total_seconds() // 4)
+    assert _paths(stream_groups(shuffled)) == _paths(group_by_camera(rows)[0])
@@ -0,0 +1,88 @@
+"""JPEG/PNG 编码后端的微基准：按我们常见的相机分辨率报告每个后端的 MB/s。
+
+用法：
+    python worker/bench_encoders.py
+    python worker/bench_encoders.py --sizes 6000x4000 9504x6336 --repeat 3
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+worker_dir = Path(__file__).resolve().parent
+if str(worker_dir) not in sys.path:
+    sys.path.insert(0, str(worker_dir))
+
+from encoders import available_jpeg_backends, jpeg_bytes, png_bytes  # noqa: E402
+
+# 24MP（A7III）、42MP（A7RIII）、61MP（A7RIV）
+DEFAULT_SIZES = ["6000x4000", "7952x5304", "9504x6336"]
+
+
+def synthetic_image(width: int, height: int) -> np.ndarray:
+    """生成带渐变和噪声的 RGB 图，比纯色图更接近真实照片的编码开销。"""
+    rng = np.random.default_rng(0)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    noise = rng.normal(0, 8, size=(height, width, 1)).astype(np.float32)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def bench(fn, rgb: np.ndarray, repeat: int):
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(rgb)
+        best = min(best, time.perf_counter() - start)
+        size = len(out)
+    mb = rgb.nbytes / (1024 * 1024)
+    return mb / best, best, size
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--quality", type=int, default=95)
+    ap.add_argument("--subsampling", default="4:2:0")
+    ap.add_argument("--progressive", action="store_true")
+    ap.add_argument("--png-levels", nargs="+", type=int, default=[1, 6])
+    ap.add_argument("--png-strategy", default="default")
+    args = ap.parse_args()
+
+    print(f"JPEG backends: {', '.join(available_jpeg_backends())}")
+    print(f"{'size':>10}  {'encoder':<24} {'MB/s':>8} {'sec':>7} {'out MB':>7}")
+    for spec in args.sizes:
+        w, h = (int(v) for v in spec.lower().split("x"))
+        rgb = synthetic_image(w, h)
+        cases = []
+        for name in available_jpeg_backends():
+            cases.append((
+                f"jpeg/{name}",
+                lambda a, n=name: jpeg_bytes(
+                    a,
+                    quality=args.quality,
+                    subsampling=args.subsampling,
+                    progressive=args.progressive,
+                    backend=n,
+                ),
+            ))
+        for level in args.png_levels:
+            cases.append((
+                f"png/pillow level={level}",
+                lambda a, lv=level: png_bytes(a, compress_level=lv, strategy=args.png_strategy),
+            ))
+        for label, fn in cases:
+            rate, sec, size = bench(fn, rgb, args.repeat)
+            print(f"{spec:>10}  {label:<24} {rate:8.1f} {sec:7.3f} {size / 1e6:7.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
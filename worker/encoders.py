@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import io
+import os
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+try:
+    # libjpeg-turbo 的 Python 绑定（pip install PyTurboJPEG），没装时回退到 Pillow
+    from turbojpeg import (  # type: ignore[import]
+        TJFLAG_PROGRESSIVE,
+        TJPF_RGB,
+        TJSAMP_420,
+        TJSAMP_422,
+        TJSAMP_444,
+        TurboJPEG,
+    )
+except ImportError:
+    TurboJPEG = None
+
+
+# 色度子采样：统一用 "4:4:4" / "4:2:2" / "4:2:0" 表示
+SUBSAMPLING_CHOICES = ("4:4:4", "4:2:2", "4:2:0")
+
+# PNG 的 zlib 压缩策略（对应 Pillow 的 compress_type 参数）
+PNG_STRATEGIES = {
+    "default": 0,
+    "filtered": 1,
+    "huffman": 2,
+    "rle": 3,
+    "fixed": 4,
+}
+
+# 默认参数可以通过环境变量覆盖，方便在 runpod 上调优而不用改代码
+JPEG_QUALITY = int(os.environ.get("JPEG_QUALITY", "95"))
+JPEG_SUBSAMPLING = os.environ.get("JPEG_SUBSAMPLING", "4:2:0")
+JPEG_PROGRESSIVE = os.environ.get("JPEG_PROGRESSIVE", "0") == "1"
+JPEG_BACKEND = os.environ.get("JPEG_BACKEND") or None
+# PNG 只是交给 Comfy 的中间文件，默认用最快的压缩等级
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "1"))
+PNG_STRATEGY = os.environ.get("PNG_STRATEGY", "default")
+
+_turbo = None
+_warned_backends = set()
+
+
+def _as_rgb_array(image) -> np.ndarray:
+    """把 PIL Image 或 numpy 数组统一成 C 连续的 uint8 RGB 数组。"""
+    if isinstance(image, Image.Image):
+        image = np.asarray(image.convert("RGB"))
+    arr = np.asarray(image)
+    if arr.dtype != np.uint8:
+        raise ValueError(f"只支持 uint8 图像，收到 {arr.dtype}")
+    if arr.ndim != 3 or arr.shape[2] != 3:
+        raise ValueError(f"只支持 HxWx3 的 RGB 图像，收到 {arr.shape}")
+    return np.ascontiguousarray(arr)
+
+
+def _check_subsampling(subsampling: str) -> None:
+    if subsampling not in SUBSAMPLING_CHOICES:
+        raise ValueError(f"未知的色度子采样 {subsampling!r}，可选：{SUBSAMPLING_CHOICES}")
+
+
+def _jpeg_turbo(rgb: np.ndarray, quality: int, subsampling: str, progressive: bool) -> bytes:
+    global _turbo
+    if _turbo is None:
+        _turbo = TurboJPEG()
+    samp = {"4:4:4": TJSAMP_444, "4:2:2": TJSAMP_422, "4:2:0": TJSAMP_420}[subsampling]
+    flags = TJFLAG_PROGRESSIVE if progressive else 0
+    return _turbo.encode(
+        rgb,
+        quality=quality,
+        pixel_format=TJPF_RGB,
+        jpeg_subsample=samp,
+        flags=flags,
+    )
+
+
+def _jpeg_pillow(rgb: np.ndarray, quality: int, subsampling: str, progressive: bool) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(rgb, "RGB").save(
+        buf,
+        "JPEG",
+        quality=quality,
+        subsampling=subsampling,
+        progressive=progressive,
+    )
+    return buf.getvalue()
+
+
+_JPEG_BACKENDS: Dict[str, Callable[[np.ndarray, int, str, bool], bytes]] = {}
+if TurboJPEG is not None:
+    _JPEG_BACKENDS["turbojpeg"] = _jpeg_turbo
+_JPEG_BACKENDS["pillow"] = _jpeg_pillow
+
+
+def available_jpeg_backends() -> List[str]:
+    """返回当前环境可用的 JPEG 编码后端，按速度从快到慢排列。"""
+    return list(_JPEG_BACKENDS)
+
+
+def jpeg_bytes(
+    image,
+    quality: int = JPEG_QUALITY,
+    subsampling: str = JPEG_SUBSAMPLING,
+    progressive: bool = JPEG_PROGRESSIVE,
+    backend: Optional[str] = JPEG_BACKEND,
+) -> bytes:
+    """把 RGB 图像编码成 JPEG 字节串。
+
+    backend 为空时自动选最快的可用后端；指定的后端不可用（比如没装 PyTurboJPEG）
+    时打印一次警告并回退到 Pillow。
+    """
+    _check_subsampling(subsampling)
+    name = backend or available_jpeg_backends()[0]
+    encode = _JPEG_BACKENDS.get(name)
+    if encode is None:
+        if name not in _warned_backends:
+            _warned_backends.add(name)
+            print(
+                f"⚠️ JPEG 编码后端 {name!r} 不可用（可用：{available_jpeg_backends()}），回退到 pillow",
+                file=sys.stderr,
+                flush=True,
+            )
+        encode = _jpeg_pillow
+    return encode(_as_rgb_array(image), quality, subsampling, progressive)
+
+
+def encode_jpeg(image, path: Path, **options) -> Path:
+    """编码 JPEG 并写入 path，参数同 jpeg_bytes。"""
+    path = Path(path)
+    path.write_bytes(jpeg_bytes(image, **options))
+    return path
+
+
+def png_bytes(
+    image,
+    compress_level: int = PNG_COMPRESS_LEVEL,
+    strategy: str = PNG_STRATEGY,
+) -> bytes:
+    """把 RGB 图像编码成 PNG 字节串。
+
+    compress_level 取 0~9（0 不压缩，9 最小体积）；strategy 对应 zlib 的压缩策略，
+    照片类内容用 "filtered" 或 "rle" 往往比默认策略快。
+    """
+    if strategy not in PNG_STRATEGIES:
+        raise ValueError(f"未知的 PNG 压缩策略 {strategy!r}，可选：{list(PNG_STRATEGIES)}")
+    buf = io.BytesIO()
+    Image.fromarray(_as_rgb_array(image), "RGB").save(
+        buf,
+        "PNG",
+        compress_level=compress_level,
+        compress_type=PNG_STRATEGIES[strategy],
+    )
+    return buf.getvalue()
+
+
+def encode_png(image, path: Path, **options) -> Path:
+    """编码 PNG 并写入 path，参数同 png_bytes。"""
+    path = Path(path)
+    path.write_bytes(png_bytes(image, **options))
+    return path
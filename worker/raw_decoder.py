@@ -3,7 +3,10 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Iterable
 
-import imageio.v2 as imageio
+try:
+    from .encoders import encode_jpeg
+except ImportError:
+    from encoders import encode_jpeg
 
 try:
     import rawpy  # type: ignore[import]
@@ -36,5 +39,5 @@ def decode_camera_raw_to_jpg(raw_path: Path, output_dir: Path) -> Path:
     with rawpy.imread(str(raw_path)) as raw:  # type: ignore[call-arg]
         rgb = raw.postprocess()
 
-    imageio.imwrite(jpg_path, rgb, quality=95)
+    encode_jpeg(rgb, jpg_path)
     return jpg_path
@@ -21,8 +21,10 @@ if str(worker_dir) not in sys.path:
 # Support both package and script execution
 try:
     from .raw_decoder import is_camera_raw_suffix, decode_camera_raw_to_jpg
+    from .encoders import encode_png
 except ImportError:
     from raw_decoder import is_camera_raw_suffix, decode_camera_raw_to_jpg
+    from encoders import encode_png
 
 # 从项目根目录和 worker 同目录加载 .env（如果存在）
 project_root_env = Path(__file__).resolve().parents[1] / ".env"
@@ -151,9 +153,8 @@ def download_input(job) -> Path:
     # 3) 其它格式（包括 JPG/JPEG）：尝试用 Pillow 转成 PNG
     png_path = DOWNLOAD_DIR / f"input-{job['id']}.png"
     try:
-        img = Image.open(local_path)
-        rgb = img.convert("RGB")
-        rgb.save(png_path, "PNG")
+        with Image.open(local_path) as img:
+            encode_png(img, png_path)
         log(f"Converted image {local_path} -> {png_path} via Pillow")
         try:
             local_path.unlink()